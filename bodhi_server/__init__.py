@@ -5,9 +5,9 @@ from loguru import logger
 import orjson
 from pydantic import BaseModel
 
+from bodhi_server.settings import get_settings
 from bodhi_server.settings import ModuleSettings
 
-from .adapters.connection_adapter import ConnectionAdapter
 from .core import (
     FlexibleModel,
     FlexibleModel as FlexModel,
@@ -20,9 +20,12 @@ from .core import (
 
 from .main import Component
 from .main import Entity
+from .main import RxSystem
+from .main import scoped_system
 from .main import Subsystem
 from .main import system
 from .main import System
+from .main import SYSTEM_POOL
 from .main import Visitor
 from .matches import Array
 from .matches import ConstrNum
@@ -42,7 +45,6 @@ from .relational import Field
 from .relational import SQLVisitor
 from .relational import Table
 from .visitors import visit_json
-import retworkx as rx
 
 
 def orjson_dumps(v, *, default):
@@ -52,5 +54,26 @@ def orjson_dumps(v, *, default):
 
 # logger.disable("bodhi_server")
 # logger.disable("tests.integrations")
-module_settings = ModuleSettings()
-connection = ConnectionAdapter()
+_connection = None
+
+
+def __getattr__(name: str):
+    # Built on first use. Importing the package shouldn't reach for arango or postgres.
+    global _connection
+    if name == "connection":
+        if _connection is None:
+            from .adapters.connection_adapter import ConnectionAdapter
+
+            _connection = ConnectionAdapter()
+        return _connection
+    if name == "rx":
+        import retworkx
+
+        return retworkx
+    if name == "module_settings":
+        return get_settings()
+    if name == "ConnectionAdapter":
+        from .adapters.connection_adapter import ConnectionAdapter
+
+        return ConnectionAdapter
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,20 +1,27 @@
-from functools import cached_property
+from typing import Optional
 
+import asyncpg
 from arango.database import StandardDatabase
-from sqlalchemy import create_engine
-from sqlalchemy import MetaData
+from asyncpg.pool import Pool
 
+from bodhi_server.engines import ENGINES
+from bodhi_server.engines import get_tables
 from bodhi_server.graph_database.conn import GraphConnection
 
 # from bodhi_server import module_settings as settings
+from bodhi_server.settings import get_settings
 from bodhi_server.settings import ModuleSettings
 from bodhi_server.tables import MetaTableAdapter
 
 
 class ConnectionAdapter:
     preprocess_graph: bool = True
-    settings: bool = ModuleSettings()
     _graph: StandardDatabase = None
+    _pool: Optional[Pool] = None
+
+    @property
+    def settings(self) -> ModuleSettings:
+        return get_settings()
 
     @property
     def graph(self):
@@ -22,11 +29,24 @@ class ConnectionAdapter:
             self._graph = GraphConnection().get_database(self.preprocess_graph)
         return self._graph
 
-    @cached_property
-    def relational(self):
-        engine = create_engine(self.settings.postgres_connection_str)
-        metadata = MetaData(bind=engine)
-
-        adapter = MetaTableAdapter(metadata)
-        metadata.create_all(engine)
-        return adapter
+    @property
+    def relational(self) -> MetaTableAdapter:
+        return get_tables(self.settings.postgres_connection_str)
+
+    async def pool(self) -> Pool:
+        """The asyncpg pool used for bulk (COPY) writes. Created on first use."""
+        if self._pool is None:
+            engine_settings = self.settings.engine
+            self._pool = await asyncpg.create_pool(
+                dsn=str(self.settings.postgres_connection_str),
+                min_size=engine_settings.async_min_size,
+                max_size=engine_settings.async_max_size,
+                server_settings=engine_settings.server_settings,
+            )
+        return self._pool
+
+    async def close(self):
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+        ENGINES.dispose()
@@ -1,27 +1,22 @@
+from typing import List
+
 from loguru import logger
 
 from pydantic.main import BaseModel
-from sqlalchemy import create_engine
-from sqlalchemy import MetaData
 
 # from bodhi_server import module_settings as settings
-from bodhi_server.settings import ModuleSettings
+from bodhi_server.engines import get_tables
+from bodhi_server.settings import get_settings
 from bodhi_server.tables import MetaTableAdapter
 
 
-settings = ModuleSettings()
+settings = get_settings()
 TABLE_ADAPTER: MetaTableAdapter = None
 
 
 def _init_tables():
-    logger.info("Starting tables if they don't already exist ...")
-
-    engine = create_engine(settings.postgres_connection_str)
-    metadata = MetaData(bind=engine)
-
-    adapter = MetaTableAdapter(metadata)
-    metadata.create_all(engine)
-    return adapter
+    # Shared by the whole process. The tables are only created the first time.
+    return get_tables(settings.postgres_connection_str)
 
 
 def init():
@@ -38,6 +33,37 @@ class DBResponse(BaseModel):
     message: str
 
 
+class RecordStatus(BaseModel):
+    index: int
+    status: bool = False
+    message: str = ""
+
+
+class BatchResponse(BaseModel):
+    status: bool = False
+    accepted: int = 0
+    rejected: int = 0
+    # Records we already had. Neither written again nor rejected.
+    duplicates: int = 0
+    results: List[RecordStatus] = []
+
+
+class StreamResponse(BaseModel):
+    status: bool = False
+    accepted: int = 0
+    rejected: int = 0
+    duplicates: int = 0
+    batches: int = 0
+    # Only the first few. `index` is the line number.
+    errors: List[RecordStatus] = []
+
+
+class BulkMeasureResponse(BaseModel):
+    status: bool = False
+    points: int = 0
+    message: str = ""
+
+
 def main():
     example_data = {
         "bucket": "bakery_inventory",
@@ -1,33 +1,90 @@
 import re
 import sys
 from datetime import datetime
+from datetime import timezone
 from logging import log
-from typing import Any, List, Optional
+from typing import Any, AsyncIterator, List, Optional
 
 from loguru import logger
 
+import orjson
 from pydantic import validate_arguments
+from pydantic import ValidationError
 from sqlalchemy.sql.expression import false
 from stringcase import snakecase
 
 from bodhi_server import connection
 from bodhi_server import circular as circle
+from bodhi_server import SYSTEM_POOL
 
 from bodhi_server.circular import _init_tables
+from bodhi_server.circular import BatchResponse
+from bodhi_server.circular import BulkMeasureResponse
 from bodhi_server.circular import DBResponse
+from bodhi_server.circular import RecordStatus
+from bodhi_server.circular import StreamResponse
 from bodhi_server.convert import json_to_sql
+from bodhi_server.engines import ENGINES
 from bodhi_server.graph_database.graph import ViewParams
+from bodhi_server.graph_database.utilz import memo_stats
+from bodhi_server.ingestion import client_key
+from bodhi_server.ingestion import content_key
+from bodhi_server.ingestion import copy_kernel_rows
+from bodhi_server.ingestion import Deduplicator
+from bodhi_server.ingestion import IngestBuffer
+from bodhi_server.ingestion import iter_ndjson_lines
+from bodhi_server.ingestion import kernel_row
+from bodhi_server.ingestion import KernelRow
+from bodhi_server.ingestion import normalize_data
+from bodhi_server.ingestion import NormalizerRegistry
+from bodhi_server.logic.accumulate import SchemaAccumulator
+from bodhi_server.logic.cache import SchemaHashCache
+from bodhi_server.measures import asyncpg_sql
+from bodhi_server.measures import columnize
+from bodhi_server.measures import compacted_between
+from bodhi_server.measures import copy_measure_columns
+from bodhi_server.measures import encode_ndjson
+from bodhi_server.measures import LiveStats
+from bodhi_server.measures import MeasureColumns
+from bodhi_server.measures import MeasureQuery
+from bodhi_server.measures import pick_rollup
+from bodhi_server.measures import QuantileQuery
+from bodhi_server.measures import query_statement
+from bodhi_server.measures import range_quantiles
+from bodhi_server.measures import SketchBuffer
+from bodhi_server.measures import stream_points
+from bodhi_server.measures import stream_records
 from bodhi_server.logic.maestro import NameMaestro
-from bodhi_server.settings import ModuleSettings
+from bodhi_server.partitions import BUCKET_PARTITIONED
+from bodhi_server.partitions import BucketPartitions
+from bodhi_server.settings import get_settings
 from bodhi_server.tables import MetaTableAdapter
+from bodhi_server.utils import InsertParameters
 from fastapi import HTTPException
 
 # A bunch of models for saving information
 from bodhi_server.models import Measurement, MeasureSet
 
 adapter: Optional[MetaTableAdapter] = None
-settings = ModuleSettings()
-NAME_CONTROLLER: NameMaestro = NameMaestro()
+settings = get_settings()
+NAME_CONTROLLER: NameMaestro = NameMaestro(
+    schema_cache=SchemaHashCache(ttl=settings.cache.schema_ttl)
+)
+INGEST_BUFFER: Optional[IngestBuffer] = None
+
+
+def bucket_accumulator(bucket: str) -> SchemaAccumulator:
+    # The normalizers compile from the schema the maestro keeps for the bucket.
+    return NAME_CONTROLLER.accumulator(bucket, ViewParams(**settings.ns_dict))
+
+
+NORMALIZERS: NormalizerRegistry = NormalizerRegistry(accumulators=bucket_accumulator)
+DEDUP: Deduplicator = Deduplicator(recent=settings.ingest.dedup_recent)
+DUPLICATE_MESSAGE = "Duplicate record. It was already added."
+LIVE_STATS: LiveStats = LiveStats()
+SKETCHES: SketchBuffer = SketchBuffer(
+    settings.metrics.sketch_seconds, settings.metrics.sketch_compression
+)
 
 
 # logger.configure(
@@ -42,27 +99,71 @@ def get_db():
     return connection.relational
 
 
-def normalize_data(inputs: dict):
-    if not isinstance(inputs, dict):
-        return inputs
-    resp = {}
-    for key, value in inputs.items():
-        norm_key = snakecase(key)
-        if isinstance(value, dict):
-            resp[norm_key] = normalize_data(value)
-            continue
-        elif isinstance(value, list):
-            if not value:
-                resp[norm_key] = []
-                continue
-            resp[norm_key] = list(map(normalize_data, value))
-            continue
-        elif isinstance(value, str):
-            conv = value.encode().decode("unicode-escape", errors="ignore")
-            # conv.replace('')
-            resp[norm_key] = conv
-        resp[norm_key] = value
-    return resp
+def record_key(
+    *,
+    bucket: str,
+    tags: dict,
+    event_at: Optional[datetime],
+    data: dict,
+    idempotency_key: Optional[str] = None,
+) -> Optional[str]:
+    """The key a record is deduplicated on. None when it shouldn't be deduplicated."""
+    if idempotency_key is not None:
+        return client_key(bucket=bucket, key=idempotency_key)
+    if settings.ingest.dedup:
+        return content_key(bucket=bucket, data=data, tags=tags, event_at=event_at)
+    return None
+
+
+def flush_kernel(rows: List[dict]):
+    """Write a group of rows into `kernel` with one multi-row insert."""
+    database = connection.relational
+    try:
+        database.ensure_buckets(*{row["bucket"] for row in rows})
+        written = database.insert_kernel(rows)
+    except Exception:
+        DEDUP.forget(row.get("idempotency_key") for row in rows)
+        raise
+    DEDUP.record_conflicts(len(rows) - written)
+
+
+def get_buffer() -> IngestBuffer:
+    global INGEST_BUFFER
+    if INGEST_BUFFER is None or INGEST_BUFFER.is_closed:
+        INGEST_BUFFER = IngestBuffer(
+            flush=flush_kernel,
+            max_size=settings.ingest.buffer_size,
+            linger=settings.ingest.linger_ms / 1000,
+        )
+    return INGEST_BUFFER
+
+
+def close_buffer():
+    """Flush anything still sitting in the ingestion buffer. Run on shutdown."""
+    if INGEST_BUFFER is not None:
+        INGEST_BUFFER.close()
+
+
+def write_kernel(*, wait: bool = True, **row):
+    """Write a single row into `kernel`.
+
+    With buffering on the row joins the next group commit. `wait` blocks until
+    that commit lands (and raises if it failed). Without it, it's fire and forget.
+    """
+    if not settings.ingest.buffered:
+        database = connection.relational
+        try:
+            database.ensure_buckets(row["bucket"])
+            written = database.insert_kernel([row])
+        except Exception:
+            DEDUP.forget([row.get("idempotency_key")])
+            raise
+        DEDUP.record_conflicts(1 - written)
+        return written
+    future = get_buffer().submit(row)
+    if wait:
+        future.result()
+    return future
 
 
 @validate_arguments
@@ -70,17 +171,33 @@ def insert_dict(
     *,
     bucket: str,
     tags: dict = {},
-    event_at: datetime = datetime.now(),
+    event_at: Optional[datetime] = None,
     data: dict = {},
+    wait: bool = True,
+    idempotency_key: Optional[str] = None,
     **values
 ):
     # IRL, this will be sent to another serverless function
-    database = connection.relational
-
-    norm_dict = normalize_data(data)
+    norm_dict = NORMALIZERS.normalize(bucket, data)
+    key = record_key(
+        bucket=bucket,
+        tags=tags,
+        event_at=event_at,
+        data=norm_dict,
+        idempotency_key=idempotency_key,
+    )
+    if DEDUP.is_duplicate(key):
+        return DBResponse(status=True, data={}, message=DUPLICATE_MESSAGE)
+    if event_at is None:
+        event_at = datetime.now(timezone.utc)
     try:
-        database.kernel.insert_into(
-            is_execute=True, bucket=bucket, tags=tags, event_at=event_at, data=norm_dict
+        write_kernel(
+            wait=wait,
+            bucket=bucket,
+            tags=tags,
+            event_at=event_at,
+            data=norm_dict,
+            idempotency_key=key,
         )
 
     except Exception as e:
@@ -106,6 +223,8 @@ def insert_dict(
     except Exception as e:
         logger.exception(e)
         logger.info(str(e))
+        # The views never made it. Make sure the next record tries again.
+        NAME_CONTROLLER.invalidate_schema(bucket, ViewParams(**settings.ns_dict))
         return DBResponse(
             status=False,
             data={},
@@ -122,6 +241,22 @@ def create_new_view(bucket: str, data: dict):
     return created_views
 
 
+def stats() -> dict:
+    """Counters for the in-process caches and buffers."""
+    return {
+        "schema_cache": NAME_CONTROLLER.schema_cache.stats(),
+        "schemas": NAME_CONTROLLER.schema_stats(),
+        "memo": memo_stats(),
+        "systems": SYSTEM_POOL.stats(),
+        "ingest_buffer": INGEST_BUFFER.stats() if INGEST_BUFFER else {},
+        "normalizers": NORMALIZERS.stats(),
+        "dedup": DEDUP.stats(),
+        "engines": ENGINES.stats(),
+        "live_stats": LIVE_STATS.stats(),
+        "sketches": {"pending": len(SKETCHES)},
+    }
+
+
 def execute_view(created_views: List[Any]):
     database = connection.relational
     try:
@@ -139,18 +274,35 @@ def ingest_data(
     *,
     bucket: str,
     tags: dict = {},
-    event_at: datetime = datetime.now(),
+    event_at: Optional[datetime] = None,
     data: dict = {},
+    wait: bool = True,
+    idempotency_key: Optional[str] = None,
     **values
 ):
     # NOTE: This should most certainly not be global now that I think about it.
     # There are better options.
     # TODO: Replace your damn values
-    database = connection.relational
-    norm_dict = normalize_data(data)
+    norm_dict = NORMALIZERS.normalize(bucket, data)
+    key = record_key(
+        bucket=bucket,
+        tags=tags,
+        event_at=event_at,
+        data=norm_dict,
+        idempotency_key=idempotency_key,
+    )
+    if DEDUP.is_duplicate(key):
+        return DBResponse(status=True, data={}, message=DUPLICATE_MESSAGE)
+    if event_at is None:
+        event_at = datetime.now(timezone.utc)
     try:
-        response = database.kernel.insert_into(
-            is_execute=True, bucket=bucket, tags=tags, event_at=event_at, data=norm_dict
+        response = write_kernel(
+            wait=wait,
+            bucket=bucket,
+            tags=tags,
+            event_at=event_at,
+            data=norm_dict,
+            idempotency_key=key,
         )
         logger.warning(response)
     except Exception as e:
@@ -161,6 +313,149 @@ def ingest_data(
     return DBResponse(status=True, data={}, message="Success")
 
 
+def bucket_partitions() -> Optional[BucketPartitions]:
+    # Only touch the relational adapter when kernel is actually list partitioned.
+    if settings.partitions.partitioning not in BUCKET_PARTITIONED:
+        return None
+    return connection.relational.bucket_partitions
+
+
+def prepare_row(record: dict) -> KernelRow:
+    """Validate and normalize a raw record into a row ready for COPY."""
+    params = InsertParameters(**record)
+    data = NORMALIZERS.normalize(params.bucket, params.data)
+    return kernel_row(
+        bucket=params.bucket,
+        tags=params.tags,
+        event_at=params.event_at or datetime.now(timezone.utc),
+        data=data,
+        idempotency_key=record_key(
+            bucket=params.bucket,
+            tags=params.tags,
+            event_at=params.event_at,
+            data=data,
+            idempotency_key=params.idempotency_key,
+        ),
+    )
+
+
+async def ingest_batch(records: List[dict]) -> BatchResponse:
+    """Validate a batch of records and write the valid ones with a single COPY.
+
+    Every record gets its own status. Invalid records are rejected on their own,
+    the rest of the batch still goes through. Records we already have count as
+    duplicates and aren't written again.
+
+    Args:
+        records (List[dict]): Raw records in the `InsertParameters` shape.
+
+    Returns:
+        BatchResponse: Accepted, rejected and duplicate counts plus a status per record.
+    """
+    rows, results = [], []
+    accepted = duplicates = 0
+    for index, record in enumerate(records):
+        try:
+            row = prepare_row(record)
+        except (ValidationError, TypeError) as e:
+            results.append(RecordStatus(index=index, status=False, message=str(e)))
+            continue
+        if DEDUP.is_duplicate(row.idempotency_key):
+            duplicates += 1
+            results.append(
+                RecordStatus(index=index, status=True, message=DUPLICATE_MESSAGE)
+            )
+            continue
+        rows.append(row)
+        results.append(RecordStatus(index=index, status=True, message="Success"))
+
+    if rows:
+        try:
+            written = await copy_kernel_rows(
+                await connection.pool(), rows, bucket_partitions()
+            )
+            # The rest were already in kernel. The unique index skipped them.
+            DEDUP.record_conflicts(len(rows) - written)
+            accepted = written
+            duplicates += len(rows) - written
+        except Exception as e:
+            logger.exception(e)
+            DEDUP.forget(row.idempotency_key for row in rows)
+            # COPY is all or nothing, so every valid record failed along with it.
+            for result in results:
+                if result.status and result.message != DUPLICATE_MESSAGE:
+                    result.status = False
+                    result.message = "The data was not added to the database"
+
+    return BatchResponse(
+        status=accepted + duplicates > 0,
+        accepted=accepted,
+        rejected=sum(1 for result in results if not result.status),
+        duplicates=duplicates,
+        results=results,
+    )
+
+
+async def ingest_stream(chunks: AsyncIterator[bytes]) -> StreamResponse:
+    """Ingest a newline delimited json body while it's still arriving.
+
+    Lines are parsed one at a time and gathered into batches of
+    `stream_batch_size`. Each full batch is copied into `kernel` before we read
+    any further, so a slow database slows down the upload instead of piling
+    records up in memory.
+
+    Args:
+        chunks (AsyncIterator[bytes]): The request body stream.
+
+    Returns:
+        StreamResponse: Accepted and rejected line counts, with the first few errors.
+    """
+    response = StreamResponse()
+    batch: List[KernelRow] = []
+    pool = await connection.pool()
+    partitions = bucket_partitions()
+
+    def reject(line_no: int, message: str, count: int = 1):
+        response.rejected += count
+        if len(response.errors) < settings.ingest.stream_max_errors:
+            response.errors.append(RecordStatus(index=line_no, message=message))
+
+    async def flush(line_no: int, rows: List[KernelRow]):
+        try:
+            written = await copy_kernel_rows(pool, rows, partitions)
+            DEDUP.record_conflicts(len(rows) - written)
+            response.accepted += written
+            response.duplicates += len(rows) - written
+            response.batches += 1
+        except Exception as e:
+            logger.exception(e)
+            DEDUP.forget(row.idempotency_key for row in rows)
+            reject(line_no, "The batch ending here was not added", len(rows))
+
+    lines = iter_ndjson_lines(chunks, settings.ingest.stream_max_line_bytes)
+    async for line_no, line in lines:
+        if line is None:
+            reject(line_no, "The line is too long")
+            continue
+        try:
+            row = prepare_row(orjson.loads(line))
+        except (orjson.JSONDecodeError, ValidationError, TypeError) as e:
+            reject(line_no, str(e))
+            continue
+        if DEDUP.is_duplicate(row.idempotency_key):
+            response.duplicates += 1
+            continue
+        batch.append(row)
+        if len(batch) >= settings.ingest.stream_batch_size:
+            await flush(line_no, batch)
+            batch = []
+
+    if batch:
+        await flush(line_no, batch)
+    response.status = response.accepted + response.duplicates > 0
+    return response
+
+
 def find(*, bucket: str, tags: dict = {}, **values):
     pass
 
@@ -182,12 +477,112 @@ def measure_one(measure: Measurement):
 def measure_many(measure_set: MeasureSet):
     try:
         db = get_db()
-        db.metrics.insert_many(measure_set.get_insertable())
+        db.metrics.insert_many(measure_set.get_insertable(db.metrics_layout))
+    except Exception as e:
+        logger.exception(e)
+        raise HTTPException(
+            status_code=500, detail="Unable to save the specific metrics"
+        )
+    LIVE_STATS.observe(measure_set.subject, measure_set.values)
+    SKETCHES.add(measure_set.subject, measure_set.values, measure_set.clock_at)
+
+
+async def measure_bulk(measures: MeasureColumns) -> BulkMeasureResponse:
+    """Write a whole grid of measurements (ticks x names) with one COPY.
+
+    Raises:
+        HTTPException: 422 when the columns don't line up, 500 when the COPY fails.
+    """
+    try:
+        batch = columnize(measures, settings.metrics.bulk_max_points)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    try:
+        points = await copy_measure_columns(
+            await connection.pool(), batch, settings.metrics.layout
+        )
     except Exception as e:
         logger.exception(e)
         raise HTTPException(
             status_code=500, detail="Unable to save the specific metrics"
         )
+    LIVE_STATS.observe_batch(batch)
+    SKETCHES.add_batch(batch)
+    return BulkMeasureResponse(status=True, points=points, message="Success")
+
+
+def live_measures(subject: str, names: Optional[List[str]] = None) -> dict:
+    """Running stats of a subject's names, straight from memory."""
+    return LIVE_STATS.get(subject, names)
+
+
+def measure_quantiles(query: QuantileQuery) -> dict:
+    """Quantiles over a time range, from the merged sketches of its buckets."""
+    try:
+        return range_quantiles(
+            get_db(),
+            subject=query.subject,
+            names=query.names,
+            start=query.start,
+            end=query.end,
+            quantiles=query.quantiles,
+            seconds=settings.metrics.sketch_seconds,
+        )
+    except Exception as e:
+        logger.exception(e)
+        raise HTTPException(status_code=500, detail="Unable to read the sketches")
+
+
+def uncovered(db, query: MeasureQuery) -> bool:
+    """Whether the buckets would come from raw points, missing the compacted ones."""
+    if query.resolution is None or db.metrics_layout != "typed":
+        return False
+    if pick_rollup(db.rollup_widths, query.resolution) is not None:
+        return False
+    return compacted_between(db, query.subject, query.names, query.start, query.end)
+
+
+def query_measures(query: MeasureQuery) -> AsyncIterator[bytes]:
+    """Stream a time range of measurements as NDJSON.
+
+    Everything that can fail on the request is checked here, before the
+    response starts. The rows are only read once the stream is iterated.
+
+    Raises:
+        HTTPException: 422 when the query can't be answered as asked.
+    """
+    metrics = settings.metrics
+    if query.buckets() > metrics.query_max_buckets:
+        raise HTTPException(
+            status_code=422,
+            detail=f"Ask for at most {metrics.query_max_buckets} buckets per name",
+        )
+    db = get_db()
+    try:
+        statement = query_statement(db, query, metrics.bucket_function)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    if uncovered(db, query):
+        widths = ", ".join(map(str, db.rollup_widths)) or "no"
+        raise HTTPException(
+            status_code=422,
+            detail="Part of this range is compacted, only the rollups "
+            f"({widths} seconds) can bucket it. Ask for a multiple of one "
+            "or for the raw points",
+        )
+    sql, args = asyncpg_sql(statement)
+
+    async def lines() -> AsyncIterator[bytes]:
+        pool = await connection.pool()
+        if query.resolution is None and db.metrics_layout == "typed":
+            # Older points may be in compressed chunks.
+            records = stream_points(pool, db, query, metrics.query_prefetch)
+        else:
+            records = stream_records(pool, sql, args, metrics.query_prefetch)
+        async for line in encode_ndjson(records, query.format, metrics.query_prefetch):
+            yield line
+
+    return lines()
 
 
 if __name__ == "__main__":
@@ -1,15 +1,38 @@
-from bodhi_server import system
+from datetime import datetime
+from typing import Optional
+
+from bodhi_server import scoped_system
 from bodhi_server.graph_database.utilz import dict_to_schema
+from bodhi_server.graph_database.utilz import memoize
 from bodhi_server.relational import plan_sql
 from bodhi_server.walkers import schema_walk
 
 
-def json_to_sql(json_record: dict, root_table_name: str):
+def json_to_sql(
+    json_record: dict,
+    root_table_name: str,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+):
     json_record_schema = dict_to_schema(item=json_record, check=True)
-    schema_walk(json_record_schema, root_table_name)
-    global_system = system()
-    created_views = plan_sql(global_system)
-    return created_views
+    return plan_schema(json_record_schema, root_table_name, start=start, end=end)
+
+
+@memoize(bounds="plan")
+def plan_schema(
+    schema: dict,
+    root_table_name: str,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+):
+    """Plan the views of one schema in a system of its own.
+
+    The system goes back to the pool afterwards, and the views are cached
+    by the schema (and name and bounds), so a known schema isn't replanned.
+    """
+    with scoped_system() as local:
+        schema_walk(schema, root_table_name)
+        return plan_sql(local, start=start, end=end)
 
 
 if __name__ == "__main__":
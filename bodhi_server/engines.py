@@ -0,0 +1,85 @@
+import threading
+from typing import Dict, Optional
+
+from loguru import logger
+
+from sqlalchemy import create_engine
+from sqlalchemy import MetaData
+from sqlalchemy.engine import Engine
+
+from bodhi_server.settings import get_settings
+from bodhi_server.settings import ModuleSettings
+from bodhi_server.tables import MetaTableAdapter
+
+
+class EngineRegistry:
+    """One pooled engine, and one set of tables, per database for the whole process.
+
+    Planning views, ingesting and the connection adapter all borrow from the
+    same pool. `create_all` (and the partition setup after it) runs the first
+    time the tables of a database are asked for, never again.
+
+    Args:
+        settings (Optional[ModuleSettings], optional): Pool and partition settings. Defaults to the environment.
+    """
+
+    def __init__(self, settings: Optional[ModuleSettings] = None):
+        self.settings = settings or get_settings()
+        self._engines: Dict[str, Engine] = {}
+        self._tables: Dict[str, MetaTableAdapter] = {}
+        self._lock = threading.RLock()
+
+    def _url(self, url: Optional[str]) -> str:
+        return str(url or self.settings.postgres_connection_str)
+
+    def engine(self, url: Optional[str] = None) -> Engine:
+        url = self._url(url)
+        engine = self._engines.get(url)
+        if engine is None:
+            with self._lock:
+                engine = self._engines.get(url)
+                if engine is None:
+                    engine = create_engine(url, **self.settings.engine.engine_options)
+                    self._engines[url] = engine
+        return engine
+
+    def tables(self, url: Optional[str] = None) -> MetaTableAdapter:
+        url = self._url(url)
+        adapter = self._tables.get(url)
+        if adapter is None:
+            with self._lock:
+                adapter = self._tables.get(url)
+                if adapter is None:
+                    logger.info("Starting tables if they don't already exist ...")
+                    engine = self.engine(url)
+                    metadata = MetaData(bind=engine)
+                    adapter = MetaTableAdapter(
+                        metadata,
+                        **self.settings.partitions.table_options,
+                        **self.settings.metrics.table_options,
+                    )
+                    metadata.create_all(engine)
+                    adapter.prepare()
+                    self._tables[url] = adapter
+        return adapter
+
+    def dispose(self):
+        """Close every pooled connection. The tables are remembered, they still exist."""
+        with self._lock:
+            for engine in self._engines.values():
+                engine.dispose()
+
+    def stats(self) -> dict:
+        # repr masks the password
+        return {repr(engine.url): engine.pool.status() for engine in self._engines.values()}
+
+
+ENGINES = EngineRegistry()
+
+
+def get_engine(url: Optional[str] = None) -> Engine:
+    return ENGINES.engine(url)
+
+
+def get_tables(url: Optional[str] = None) -> MetaTableAdapter:
+    return ENGINES.tables(url)
@@ -15,10 +15,10 @@ from bodhi_server.graph_database.graph import EdgeQuery
 from bodhi_server.graph_database.graph import Node
 from bodhi_server.graph_database.utilz import gen_hex_id
 from bodhi_server.graph_database.utilz import to_snake
-from bodhi_server.settings import ModuleSettings
+from bodhi_server.settings import get_settings
 
 
-modset = ModuleSettings()
+modset = get_settings()
 
 
 class GraphController(BaseModel):
@@ -26,7 +26,7 @@ class GraphController(BaseModel):
     locs: dict = {}
 
     def __init__(self, name: Optional[str] = None, **data):
-        data["name"] = name or modset.arangoo.graph_name
+        data["name"] = name or modset.arangoo.graph
         data["name"] = to_snake(data["name"])
         super().__init__(**data)
 
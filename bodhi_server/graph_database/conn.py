@@ -6,6 +6,7 @@ from arango.exceptions import DatabaseCreateError
 from arango.exceptions import UserCreateError
 from retry import retry
 
+from bodhi_server.settings import get_settings
 from bodhi_server.settings import ModuleSettings
 
 
@@ -13,7 +14,9 @@ from bodhi_server.settings import ModuleSettings
 
 
 class GraphConnection:
-    settings: ModuleSettings = ModuleSettings()
+    @property
+    def settings(self) -> ModuleSettings:
+        return get_settings()
 
     def __init__(self):
         # These are guarunteed to work. So we're keeping these.
@@ -1,40 +1,161 @@
+import functools
+import random
+import sys
+import threading
 import uuid
+from collections import OrderedDict
 from hashlib import sha256
-from typing import Tuple
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 import orjson
+import xxhash
 from auto_all import end_all
 from auto_all import start_all
-from decorator import decorate
-from frozendict import frozendict
 from genson import SchemaBuilder
-from pyrsistent import freeze
-from pyrsistent import pmap
-from pyrsistent import thaw
 from stringcase import snakecase
 
+from bodhi_server.settings import get_settings
+
 start_all(globals())
 
 
-def _memoize(func, *args, **kw):
-    if kw:              # frozenset is used to ensure hashability
-        key = freeze(args), freeze(kw)
-    else:
-        key = freeze(args)
-    cache = func.cache  # attribute added by memoize
-    if key not in cache:
-        cache[key] = func(*args, **kw)
-    return cache[key]
+MEMO_KEY_OPTIONS = orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS
+MEMOS: List["LRUMemo"] = []
+
 
+def structural_key(args: tuple, kw: dict) -> bytes:
+    """A 128 bit fingerprint of the arguments. Equal dicts hash equal, whatever their order.
 
-def memoize(f):
+    orjson walks the arguments in C, which is a lot cheaper than freezing
+    them into pyrsistent structures.
     """
-    A simple memoize implementation. It works by adding a .cache dictionary
-    to the decorated function. The cache will grow indefinitely, so it is
-    your responsibility to clear it, if needed.
+    serialized = orjson.dumps([args, kw], option=MEMO_KEY_OPTIONS, default=repr)
+    return xxhash.xxh3_128_digest(serialized)
+
+
+def weigh(value: Any) -> int:
+    """Roughly how many bytes a cached result holds on to."""
+    if isinstance(value, (dict, list)):
+        return len(orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS, default=repr))
+    return sys.getsizeof(value)
+
+
+class LRUMemo:
+    """Memoizes a function in a least recently used cache, bounded by entries and by size.
+
+    Bounds that aren't given are read from the cache settings when they're
+    needed, as `<bounds>_entries` and `<bounds>_bytes`.
+
+    Args:
+        func (Callable): The function. Its arguments are fingerprinted with `structural_key`.
+        max_entries (int, optional): Results kept at most. Defaults to `CacheSettings.memo_entries`.
+        max_bytes (int, optional): Rough size of the results kept at most. Defaults to `CacheSettings.memo_bytes`.
+        bounds (str, optional): The settings the missing bounds come from. Defaults to "memo".
     """
-    f.cache = {}
-    return decorate(f, _memoize)
+
+    def __init__(
+        self,
+        func: Callable,
+        max_entries: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        bounds: str = "memo",
+    ):
+        self.func = func
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self.bounds = bounds
+        self._entries: "OrderedDict[bytes, Tuple[Any, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes: int = 0
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+        functools.update_wrapper(self, func)
+
+    def __call__(self, *args, **kw):
+        key = structural_key(args, kw)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+        # Called outside the lock. Two threads may both compute a result, which is fine.
+        result = self.func(*args, **kw)
+        size = weigh(result)
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = (result, size)
+                self.bytes += size
+            max_entries, max_bytes = self.max_entries, self.max_bytes
+            while self._entries and (
+                len(self._entries) > max_entries or self.bytes > max_bytes
+            ):
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.bytes -= evicted
+                self.evictions += 1
+        return result
+
+    @property
+    def max_entries(self) -> int:
+        if self._max_entries is not None:
+            return self._max_entries
+        return getattr(get_settings().cache, f"{self.bounds}_entries")
+
+    @property
+    def max_bytes(self) -> int:
+        if self._max_bytes is not None:
+            return self._max_bytes
+        return getattr(get_settings().cache, f"{self.bounds}_bytes")
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": len(self),
+            "bytes": self.bytes,
+        }
+
+
+def memoize(
+    f: Optional[Callable] = None,
+    *,
+    max_entries: Optional[int] = None,
+    max_bytes: Optional[int] = None,
+    bounds: str = "memo",
+):
+    """Memoize a function in a bounded `LRUMemo`. Works with or without arguments.
+
+    The bounds default to `CacheSettings.memo_entries` and `memo_bytes`, or
+    to another pair of cache settings named by `bounds`. They're read once
+    the function runs, not when it's decorated. The stats of every memoized
+    function are in `memo_stats`.
+    """
+
+    def wrap(func: Callable) -> LRUMemo:
+        memo = LRUMemo(
+            func, max_entries=max_entries, max_bytes=max_bytes, bounds=bounds
+        )
+        MEMOS.append(memo)
+        return memo
+
+    return wrap(f) if f is not None else wrap
+
+
+def memo_stats() -> Dict[str, dict]:
+    return {memo.__name__: memo.stats() for memo in MEMOS}
 
 
 js_keys = ['$schema', 'type', 'properties']
@@ -75,6 +196,74 @@ def to_snake(name: str) -> str:
     return snakecase(name)
 
 
+def sample_items(items: list, cap: int, head: int, probes: int = 8) -> list:
+    """At most `cap` items: the first `head`, then a uniform pick of the rest.
+
+    The pick is what a reservoir sample would give, drawn straight from the
+    indices since the length is known, and seeded by it so the same array
+    always gives the same sample. The whole array is kept when the sampled
+    items don't all have the same `structure_fingerprint`, or when one of
+    `probes` items left out of the sample has another.
+    """
+    # accumulate's package imports the planner, which imports this module.
+    from bodhi_server.logic.accumulate import structure_fingerprint
+
+    if not cap or len(items) <= cap:
+        return items
+    head = min(head, cap)
+    rng = random.Random(len(items))
+    picked = sorted(rng.sample(range(head, len(items)), cap - head))
+    sample = [*items[:head], *(items[index] for index in picked)]
+    shapes = {structure_fingerprint(item) for item in sample}
+    if len(shapes) > 1:
+        return items
+    chosen = set(picked)
+    rest = rng.sample(range(head, len(items)), min(probes, len(items) - head))
+    for index in rest:
+        if index not in chosen and structure_fingerprint(items[index]) not in shapes:
+            return items
+    return sample
+
+
+def sample_arrays(item: Any, cap: Optional[int] = None, head: Optional[int] = None):
+    """`item` with every long array cut down by `sample_items`.
+
+    Schema inference over the result costs about the same however long the
+    arrays were. Only the objects and arrays on the way to a cut are copied,
+    and when nothing is cut `item` itself comes back. The cap and head
+    default to the ingest settings.
+    """
+    if cap is None or head is None:
+        ingest = get_settings().ingest
+        cap = ingest.infer_array_cap if cap is None else cap
+        head = ingest.infer_array_head if head is None else head
+    if not cap:
+        return item
+    return _sample_arrays(item, cap, head)
+
+
+def _sample_arrays(item: Any, cap: int, head: int):
+    if isinstance(item, dict):
+        copied = None
+        for key, value in item.items():
+            sampled = _sample_arrays(value, cap, head)
+            if sampled is not value:
+                copied = dict(item) if copied is None else copied
+                copied[key] = sampled
+        return item if copied is None else copied
+    if isinstance(item, (list, tuple)):
+        # The same list when it was short enough
+        kept = sample_items(item, cap, head)
+        copied = None
+        for index, value in enumerate(kept):
+            sampled = _sample_arrays(value, cap, head)
+            if sampled is not value:
+                copied = list(kept) if copied is None else copied
+                copied[index] = sampled
+        return kept if copied is None else copied
+    return item
+
+
 @memoize
 def dict_to_schema(item: dict, check = False) -> dict:
     if check:
@@ -83,7 +272,7 @@ def dict_to_schema(item: dict, check = False) -> dict:
             return item
 
     scheme_build = SchemaBuilder()
-    scheme_build.add_object(item)
+    scheme_build.add_object(sample_arrays(item))
     return scheme_build.to_schema()
 
 
@@ -0,0 +1,14 @@
+from .buffer import IngestBuffer
+from .bulk import copy_kernel_rows
+from .bulk import kernel_row
+from .bulk import KERNEL_COPY_COLUMNS
+from .bulk import KernelRow
+from .dedup import client_key
+from .dedup import content_key
+from .dedup import Deduplicator
+from .normalize import compile_normalizer
+from .normalize import normalize_data
+from .normalize import NormalizerRegistry
+from .normalize import ShapeMismatch
+from .stream import iter_ndjson_lines
+from .stream import NDJSON_TYPES
@@ -0,0 +1,122 @@
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from loguru import logger
+
+
+Record = Dict[str, Any]
+# The record, its future and when it was submitted (time.monotonic).
+Pending = Tuple[Record, Future, float]
+
+
+class IngestBuffer:
+    """Collects records across requests and writes them as a group commit.
+
+    A background thread flushes whatever is pending once `max_size` records have
+    piled up, or once the oldest pending record has waited `linger` seconds.
+    `submit` hands back a future, so the caller picks between waiting on the
+    flush (durable) or walking away (fire and forget).
+
+    Args:
+        flush (Callable[[List[Record]], Any]): Writes a list of records in one go.
+        max_size (int, optional): Flush as soon as this many are pending. Defaults to 500.
+        linger (float, optional): Max seconds a record waits for company. Defaults to 0.01.
+    """
+
+    def __init__(
+        self,
+        flush: Callable[[List[Record]], Any],
+        max_size: int = 500,
+        linger: float = 0.01,
+    ):
+        if max_size < 1:
+            raise ValueError("The buffer needs to hold at least one record.")
+        self._flush = flush
+        self.max_size = max_size
+        self.linger = linger
+        self._cond = threading.Condition()
+        self._pending: List[Pending] = []
+        self._closed: bool = False
+        self._worker: Optional[threading.Thread] = None
+        self.flushes: int = 0
+        self.flushed_records: int = 0
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    @property
+    def is_closed(self) -> bool:
+        return self._closed
+
+    def submit(self, record: Record) -> Future:
+        future: Future = Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("The ingestion buffer has already been closed.")
+            self._pending.append((record, future, time.monotonic()))
+            self._start_worker()
+            if len(self._pending) >= self.max_size:
+                self._cond.notify()
+        return future
+
+    def close(self, timeout: Optional[float] = None):
+        """Stop taking records and flush everything that's still pending."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+            worker = self._worker
+        if worker is not None:
+            worker.join(timeout)
+
+    def stats(self) -> dict:
+        return {
+            "pending": self.pending,
+            "flushes": self.flushes,
+            "flushed_records": self.flushed_records,
+        }
+
+    def _start_worker(self):
+        if self._worker is not None:
+            return
+        self._worker = threading.Thread(
+            target=self._run, name="bodhi-ingest-buffer", daemon=True
+        )
+        self._worker.start()
+
+    def _next_batch(self) -> List[Pending]:
+        with self._cond:
+            while not self._pending and not self._closed:
+                self._cond.wait()
+            while len(self._pending) < self.max_size and not self._closed:
+                # Leftovers of a full batch keep their age, they don't start over.
+                remaining = self._pending[0][2] + self.linger - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch = self._pending[: self.max_size]
+            self._pending = self._pending[self.max_size :]
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                # Only happens once we're closed and drained.
+                return
+            self._write(batch)
+
+    def _write(self, batch: List[Pending]):
+        try:
+            self._flush([record for record, _, _ in batch])
+        except Exception as e:
+            logger.exception(e)
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+        self.flushes += 1
+        self.flushed_records += len(batch)
+        for _, future, _ in batch:
+            future.set_result(True)
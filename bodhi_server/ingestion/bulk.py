@@ -0,0 +1,98 @@
+from datetime import datetime
+from typing import Any, Dict, List, NamedTuple, Optional
+
+import orjson
+from asyncpg.pool import Pool
+
+from bodhi_server.partitions import BucketPartitions
+
+
+class KernelRow(NamedTuple):
+    """A record ready for COPY. The fields are the `kernel` columns, in order."""
+
+    bucket: str
+    tags: str
+    event_at: datetime
+    data: str
+    idempotency_key: Optional[str]
+
+
+KERNEL_COPY_COLUMNS = KernelRow._fields
+
+# COPY can't skip conflicts. Rows with idempotency keys land here first.
+_COLUMNS = ", ".join(KERNEL_COPY_COLUMNS)
+CREATE_STAGE = (
+    "CREATE TEMP TABLE kernel_stage (bucket TEXT, tags JSONB, event_at TIMESTAMPTZ, "
+    "data JSONB, idempotency_key TEXT) ON COMMIT DROP"
+)
+# Keys are claimed in kernel_keys first (see `MetaTableAdapter.insert_kernel`).
+# Only the rows whose key was claimed just now go in, one per key.
+INSERT_FROM_STAGE = (
+    "WITH claimed AS (INSERT INTO kernel_keys (idempotency_key) "
+    "SELECT DISTINCT idempotency_key FROM kernel_stage "
+    "WHERE idempotency_key IS NOT NULL "
+    "ON CONFLICT DO NOTHING RETURNING idempotency_key) "
+    f"INSERT INTO kernel ({_COLUMNS}) "
+    f"SELECT {_COLUMNS} FROM kernel_stage WHERE idempotency_key IS NULL "
+    f"UNION ALL SELECT DISTINCT ON (idempotency_key) {_COLUMNS} FROM kernel_stage "
+    "WHERE idempotency_key IN (SELECT idempotency_key FROM claimed) "
+    "ON CONFLICT DO NOTHING"
+)
+
+
+def to_jsonb(value: Dict[str, Any]) -> str:
+    # asyncpg's jsonb codec takes text, even through a binary COPY.
+    return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS).decode()
+
+
+def kernel_row(
+    *,
+    bucket: str,
+    tags: Dict[str, Any],
+    event_at: datetime,
+    data: Dict[str, Any],
+    idempotency_key: Optional[str] = None,
+) -> KernelRow:
+    """Convert a single record into a `KernelRow`."""
+    return KernelRow(bucket, to_jsonb(tags), event_at, to_jsonb(data), idempotency_key)
+
+
+async def copy_kernel_rows(
+    pool: Pool,
+    rows: List[KernelRow],
+    partitions: Optional[BucketPartitions] = None,
+) -> int:
+    """Write the rows into `kernel` using a single binary COPY.
+
+    COPY is all or nothing. If one row fails the whole batch is rolled back.
+    When any row has an idempotency key, the rows are copied into a temporary
+    table and only the ones whose key is new to `kernel_keys` are moved over,
+    so rows that are already in `kernel` get skipped instead of failing the
+    batch. That holds with time partitioning too, where retries carry a new
+    `event_at`.
+
+    Args:
+        pool (Pool): The asyncpg pool we're borrowing a connection from.
+        rows (List[KernelRow]): Rows created with `kernel_row`.
+        partitions (Optional[BucketPartitions], optional): Set when kernel is list partitioned by bucket,
+            so new buckets get their partition before the COPY. Defaults to None.
+
+    Returns:
+        int: The number of rows that made it into `kernel`.
+    """
+    async with pool.acquire() as conn:
+        if partitions is not None:
+            await partitions.ensure_async(conn, {row.bucket for row in rows})
+        if all(row.idempotency_key is None for row in rows):
+            status: str = await conn.copy_records_to_table(
+                "kernel", records=rows, columns=KERNEL_COPY_COLUMNS
+            )
+        else:
+            async with conn.transaction():
+                await conn.execute(CREATE_STAGE)
+                await conn.copy_records_to_table(
+                    "kernel_stage", records=rows, columns=KERNEL_COPY_COLUMNS
+                )
+                status = await conn.execute(INSERT_FROM_STAGE)
+    # The status looks like "COPY 1000" or "INSERT 0 1000"
+    return int(status.split()[-1])
@@ -0,0 +1,89 @@
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, Iterable, Optional
+
+import orjson
+import xxhash
+
+CANONICAL = orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS
+
+
+def content_key(
+    *,
+    bucket: str,
+    data: Dict[str, Any],
+    tags: Dict[str, Any],
+    event_at: Optional[datetime] = None,
+) -> str:
+    """The idempotency key of a record that didn't come with one.
+
+    Keys are sorted before hashing, so the same record sent twice hashes the
+    same no matter how the client ordered it. Records sent without an
+    `event_at` are stamped when they arrive, so their time stays out of the key.
+    """
+    canonical = orjson.dumps([bucket, data, tags, event_at], option=CANONICAL)
+    return xxhash.xxh3_128_hexdigest(canonical)
+
+
+def client_key(*, bucket: str, key: str) -> str:
+    """Scope a client supplied key to its bucket."""
+    return xxhash.xxh3_128_hexdigest(orjson.dumps([bucket, key]))
+
+
+class Deduplicator:
+    """Catches repeated idempotency keys before they reach the database.
+
+    The recent keys are kept exactly, so a retry of something we just wrote is
+    rejected in memory. Anything older goes to the unique index on `kernel`,
+    which has the final word (the insert skips conflicts). Other processes and
+    restarts write keys we never saw, so only the database can say a key is new.
+
+    Args:
+        recent (int, optional): How many of the latest keys are kept exactly. Defaults to 100_000.
+    """
+
+    def __init__(self, recent: int = 100_000):
+        self.max_recent = recent
+        self._recent: "OrderedDict[str, None]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.checked: int = 0
+        self.duplicates: int = 0
+        self.conflicts: int = 0
+
+    def is_duplicate(self, key: Optional[str]) -> bool:
+        """Claims `key`. True means it was already claimed and the record should be dropped."""
+        if key is None:
+            return False
+        with self._lock:
+            self.checked += 1
+            if key in self._recent:
+                self._recent.move_to_end(key)
+                self.duplicates += 1
+                return True
+            self._recent[key] = None
+            if len(self._recent) > self.max_recent:
+                self._recent.popitem(last=False)
+            return False
+
+    def forget(self, keys: Iterable[Optional[str]]):
+        """Release keys whose write failed, so a retry isn't mistaken for a duplicate."""
+        with self._lock:
+            for key in keys:
+                self._recent.pop(key, None)
+
+    def record_conflicts(self, count: int):
+        # Duplicates the unique index caught after the in-memory check let them through.
+        if count > 0:
+            with self._lock:
+                self.conflicts += count
+
+    def stats(self) -> dict:
+        dropped = self.duplicates + self.conflicts
+        return {
+            "checked": self.checked,
+            "duplicates": self.duplicates,
+            "conflicts": self.conflicts,
+            "recent": len(self._recent),
+            "dedup_rate": dropped / self.checked if self.checked else 0.0,
+        }
@@ -0,0 +1,201 @@
+import threading
+from collections import defaultdict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from loguru import logger
+
+from stringcase import snakecase
+
+from bodhi_server.graph_database.utilz import sample_arrays
+from bodhi_server.logic.accumulate import SchemaAccumulator
+
+Normalizer = Callable[[Any], Any]
+SCALAR_TYPES = {"string", "integer", "number", "boolean", "null"}
+
+
+def normalize_data(inputs: dict):
+    """The generic (slow) path. Walks the record and snakecases every key."""
+    if not isinstance(inputs, dict):
+        return inputs
+    resp = {}
+    for key, value in inputs.items():
+        norm_key = snakecase(key)
+        if isinstance(value, dict):
+            resp[norm_key] = normalize_data(value)
+            continue
+        elif isinstance(value, list):
+            if not value:
+                resp[norm_key] = []
+                continue
+            resp[norm_key] = list(map(normalize_data, value))
+            continue
+        elif isinstance(value, str):
+            conv = value.encode().decode("unicode-escape", errors="ignore")
+            # conv.replace('')
+            resp[norm_key] = conv
+        resp[norm_key] = value
+    return resp
+
+
+class ShapeMismatch(Exception):
+    """The record doesn't have the shape the normalizer was compiled for."""
+
+
+def _generic_list(value: Any) -> Any:
+    if type(value) is not list:
+        raise ShapeMismatch("expected an array")
+    return list(map(normalize_data, value))
+
+
+def _scalar(value: Any) -> Any:
+    # Strings come back untouched on the generic path too. Only containers change.
+    if type(value) in (dict, list):
+        raise ShapeMismatch("expected a scalar")
+    return value
+
+
+def _as_is(value: Any) -> Any:
+    # The generic path doesn't descend into arrays nested directly in arrays.
+    return value
+
+
+def _compile_object(properties: Dict[str, dict]) -> Normalizer:
+    fields: Dict[str, Tuple[str, Normalizer]] = {
+        key: (snakecase(key), compile_normalizer(sub_schema))
+        for key, sub_schema in properties.items()
+    }
+
+    def normalize_object(value: Any) -> Any:
+        if type(value) is not dict:
+            raise ShapeMismatch("expected an object")
+        resp = {}
+        for key, item in value.items():
+            field = fields.get(key)
+            if field is None:
+                raise ShapeMismatch(f"unknown key {key}")
+            resp[field[0]] = field[1](item)
+        return resp
+
+    return normalize_object
+
+
+def _compile_array(items: Optional[dict]) -> Normalizer:
+    if not items:
+        return _generic_list
+    item_type = items.get("type")
+    if item_type == "array":
+        item_normalizer = _as_is
+    else:
+        item_normalizer = compile_normalizer(items)
+
+    def normalize_array(value: Any) -> Any:
+        if type(value) is not list:
+            raise ShapeMismatch("expected an array")
+        return [item_normalizer(item) for item in value]
+
+    return normalize_array
+
+
+def compile_normalizer(schema: dict) -> Normalizer:
+    """Build a normalizer specialized for a json schema.
+
+    The snakecased keys are worked out once, here, instead of for every record.
+    Anything the schema is vague about (mixed types, objects without properties)
+    goes through the generic path for that part of the record.
+
+    Args:
+        schema (dict): A json schema, as genson creates it.
+
+    Returns:
+        Normalizer: Takes a record and returns it normalized. Raises `ShapeMismatch` if the record doesn't fit.
+    """
+    kind = schema.get("type")
+    if isinstance(kind, list):
+        if SCALAR_TYPES.issuperset(kind):
+            return _scalar
+        return normalize_data
+    if kind == "object":
+        properties = schema.get("properties")
+        if not properties:
+            return normalize_data
+        return _compile_object(properties)
+    if kind == "array":
+        return _compile_array(schema.get("items"))
+    if kind in SCALAR_TYPES:
+        return _scalar
+    return normalize_data
+
+
+class NormalizerRegistry:
+    """Compiled normalizers, one per bucket, built from the bucket's inferred schema.
+
+    The schema is the one the bucket's `SchemaAccumulator` keeps. Records that
+    don't fit the compiled shape go through `normalize_data` and are folded
+    into the accumulator, so the next record like them takes the fast path.
+
+    Args:
+        accumulators (Callable[[str], SchemaAccumulator], optional): The accumulator of a bucket.
+            Defaults to one per bucket, kept by the registry.
+        max_buckets (int, optional): How many buckets we keep normalizers for. Defaults to 1024.
+    """
+
+    def __init__(
+        self,
+        accumulators: Optional[Callable[[str], SchemaAccumulator]] = None,
+        max_buckets: int = 1024,
+    ):
+        if accumulators is None:
+            accumulators = defaultdict(SchemaAccumulator).__getitem__
+        self.accumulators = accumulators
+        self.max_buckets = max_buckets
+        self._compiled: Dict[str, Normalizer] = {}
+        self._lock = threading.Lock()
+        self.hits: int = 0
+        self.fallbacks: int = 0
+        self.compiles: int = 0
+
+    def __len__(self) -> int:
+        return len(self._compiled)
+
+    def compile(self, bucket: str, schema: dict) -> Normalizer:
+        normalizer = compile_normalizer(schema)
+        with self._lock:
+            if bucket not in self._compiled and len(self._compiled) >= self.max_buckets:
+                # Oldest bucket out. Dicts keep insertion order.
+                self._compiled.pop(next(iter(self._compiled)))
+            self._compiled[bucket] = normalizer
+            self.compiles += 1
+        return normalizer
+
+    def normalize(self, bucket: str, record: dict) -> dict:
+        normalizer = self._compiled.get(bucket)
+        if normalizer is not None:
+            try:
+                normalized = normalizer(record)
+                with self._lock:
+                    self.hits += 1
+                return normalized
+            except ShapeMismatch as e:
+                logger.debug(f"Record doesn't fit the {bucket} normalizer: {e}")
+                with self._lock:
+                    self.fallbacks += 1
+        # Widen the bucket's schema, or start it. Sampled, like the maestro's folds.
+        accumulator = self.accumulators(bucket)
+        accumulator.fold(sample_arrays(record))
+        self.compile(bucket, accumulator.schema())
+        return normalize_data(record)
+
+    def invalidate(self, bucket: Optional[str] = None):
+        with self._lock:
+            if bucket is None:
+                self._compiled.clear()
+                return
+            self._compiled.pop(bucket, None)
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "fallbacks": self.fallbacks,
+            "compiles": self.compiles,
+            "buckets": len(self),
+        }
@@ -0,0 +1,57 @@
+from typing import AsyncIterator, Optional, Tuple
+
+NDJSON_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl")
+
+
+async def iter_ndjson_lines(
+    chunks: AsyncIterator[bytes], max_line_bytes: int = 1 << 20
+) -> AsyncIterator[Tuple[int, Optional[bytes]]]:
+    """Split a chunked body into lines without ever holding the whole body.
+
+    Only the current (unfinished) line is buffered. A line that grows past
+    `max_line_bytes` is dropped and comes back as `None` so the caller can count
+    it as rejected.
+
+    Args:
+        chunks (AsyncIterator[bytes]): The raw body, as the server receives it.
+        max_line_bytes (int, optional): Longest line we're willing to buffer. Defaults to 1MiB.
+
+    Yields:
+        Tuple[int, Optional[bytes]]: The line number (starting at 1) and the line. Blank lines are skipped.
+    """
+    pending = bytearray()
+    line_no = 0
+    too_long = False
+    async for chunk in chunks:
+        start = 0
+        while True:
+            end = chunk.find(b"\n", start)
+            if end == -1:
+                if not too_long:
+                    pending += chunk[start:]
+                    if len(pending) > max_line_bytes:
+                        pending.clear()
+                        too_long = True
+                break
+
+            line_no += 1
+            if too_long:
+                too_long = False
+                yield line_no, None
+            else:
+                pending += chunk[start:end]
+                line = bytes(pending).strip()
+                pending.clear()
+                if len(line) > max_line_bytes:
+                    yield line_no, None
+                elif line:
+                    yield line_no, line
+            start = end + 1
+
+    # The last line doesn't need a trailing newline.
+    if too_long:
+        yield line_no + 1, None
+        return
+    line = bytes(pending).strip()
+    if line:
+        yield line_no + 1, line
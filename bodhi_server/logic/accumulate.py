@@ -0,0 +1,233 @@
+import threading
+from typing import Any, Dict, FrozenSet, List, Optional, Set, Tuple
+
+import orjson
+import xxhash
+from auto_all import end_all
+from auto_all import start_all
+from genson import SchemaBuilder
+from pydantic import BaseModel
+
+start_all(globals())
+
+# ("address", "lines", "[]") is every item of record["address"]["lines"]
+Path = Tuple[str, ...]
+ITEMS = "[]"
+
+
+def json_type(value: Any) -> str:
+    # bool before int, it's a subclass.
+    if isinstance(value, bool):
+        return "boolean"
+    if isinstance(value, int):
+        return "integer"
+    if isinstance(value, float):
+        return "number"
+    if isinstance(value, str):
+        return "string"
+    if value is None:
+        return "null"
+    if isinstance(value, (list, tuple)):
+        return "array"
+    if isinstance(value, dict):
+        return "object"
+    return type(value).__name__
+
+
+# Exact types only, subclasses go through json_type.
+TYPE_NAMES = {
+    bool: "boolean",
+    int: "integer",
+    float: "number",
+    str: "string",
+    type(None): "null",
+    list: "array",
+    tuple: "array",
+    dict: "object",
+}
+
+
+def structure_fingerprint(record: dict) -> str:
+    """A hash of the record's key paths and value types, in one walk.
+
+    Array items are collapsed: `[1, 2, 3]` looks like `[1]`. Objects inside
+    arrays add their key sets, since an item going without a key changes
+    what's required. Two records with the same fingerprint always give the
+    same schema, so it's a cheap check to run before any schema work.
+    """
+    # NUL separates keys, so "a.b" and {"a": {"b": ...}} can't collide.
+    tokens = set()
+    stack: List[Tuple[str, Any, bool]] = [("", record, False)]
+    while stack:
+        path, value, in_array = stack.pop()
+        kind = TYPE_NAMES.get(type(value)) or json_type(value)
+        tokens.add(f"{path}\x01{kind}")
+        if kind == "object":
+            if in_array:
+                keys = "\x00".join(sorted(map(str, value)))
+                tokens.add(f"{path}\x02{keys}")
+            stack.extend(
+                (f"{path}\x00{key}", item, in_array) for key, item in value.items()
+            )
+        elif kind == "array":
+            items = f"{path}\x00{ITEMS}"
+            stack.extend((items, item, True) for item in value)
+    shape = "\x03".join(sorted(tokens)).encode("utf-8", "surrogatepass")
+    return xxhash.xxh3_64_hexdigest(shape)
+
+
+def record_shape(
+    record: dict,
+) -> Tuple[Dict[Path, Set[str]], List[Tuple[Path, FrozenSet[str]]]]:
+    """The types found at every path, and the keys of every object, in one walk."""
+    types: Dict[Path, Set[str]] = {}
+    objects: List[Tuple[Path, FrozenSet[str]]] = []
+    stack: List[Tuple[Path, Any]] = [((), record)]
+    while stack:
+        path, value = stack.pop()
+        kind = json_type(value)
+        types.setdefault(path, set()).add(kind)
+        if kind == "object":
+            objects.append((path, frozenset(value)))
+            stack.extend(((*path, str(key)), item) for key, item in value.items())
+        elif kind == "array":
+            stack.extend(((*path, ITEMS), item) for item in value)
+    return types, objects
+
+
+def dotted(path: Path) -> str:
+    return ".".join(path).replace(f".{ITEMS}", ITEMS) or "$"
+
+
+class SchemaChange(BaseModel):
+    """What a record changed about its bucket's schema.
+
+    Paths are dotted, with `[]` for array items: `address.lines[]`.
+    """
+
+    changed: bool = False
+    # Paths never seen before, with their types
+    added: Dict[str, List[str]] = {}
+    # Known paths that took a new type
+    widened: Dict[str, List[str]] = {}
+    # Properties a record went without, so they aren't required anymore
+    optional: List[str] = []
+
+
+UNCHANGED = SchemaChange()
+
+
+class SchemaAccumulator:
+    """The schema of every record folded in so far, kept up to date incrementally.
+
+    A record is checked against the types and required keys seen so far,
+    which costs one walk over it, or just a fingerprint when a record of
+    the same structure was seen before. Only records that actually change
+    something are handed to the (long-lived) genson builder. The schema is
+    the same as genson would give for every record, at a fraction of the
+    cost once a bucket settles down. Requests for the same bucket can fold
+    from several threads, so one lock guards the state.
+    """
+
+    def __init__(self, max_seen: int = 1024):
+        self._builder = SchemaBuilder()
+        self._types: Dict[Path, Set[str]] = {}
+        # Object path -> keys every object there had
+        self._required: Dict[Path, FrozenSet[str]] = {}
+        self._schema: Optional[dict] = None
+        self._hash: str = ""
+        self.records: int = 0
+        self.changes: int = 0
+        # Structures already folded in. Another record like them changes nothing.
+        self._seen: Set[str] = set()
+        self.max_seen = max_seen
+        self.prechecked: int = 0
+        self._lock = threading.Lock()
+
+    @property
+    def fingerprint(self) -> str:
+        """A hash of the schema, changes only when the schema does."""
+        with self._lock:
+            return self._hash
+
+    def diff(self, record: dict) -> SchemaChange:
+        """How `record` would change the schema, without folding it in."""
+        shape = record_shape(record)
+        with self._lock:
+            return self._diff(*shape)
+
+    def _diff(self, types: Dict[Path, Set[str]], objects: list) -> SchemaChange:
+        added, widened = {}, {}
+        for path, kinds in types.items():
+            known = self._types.get(path)
+            if known is None:
+                added[dotted(path)] = sorted(kinds)
+            elif not kinds <= known:
+                widened[dotted(path)] = sorted(kinds - known)
+        optional = set()
+        for path, keys in objects:
+            required = self._required.get(path)
+            if required is not None and not required <= keys:
+                optional.update(dotted((*path, key)) for key in required - keys)
+        if not (added or widened or optional):
+            return UNCHANGED
+        return SchemaChange(
+            changed=True, added=added, widened=widened, optional=sorted(optional)
+        )
+
+    def fold(self, record: dict) -> SchemaChange:
+        """Fold a record in. `changed` is False when the schema stayed the same."""
+        structure = structure_fingerprint(record)
+        with self._lock:
+            self.records += 1
+            if structure in self._seen:
+                self.prechecked += 1
+                return UNCHANGED
+        types, objects = record_shape(record)
+        with self._lock:
+            return self._fold(record, structure, types, objects)
+
+    def _fold(
+        self, record: dict, structure: str, types: Dict[Path, Set[str]], objects: list
+    ) -> SchemaChange:
+        change = self._diff(types, objects)
+        if len(self._seen) >= self.max_seen:
+            self._seen.clear()
+        self._seen.add(structure)
+        if not change.changed:
+            return change
+        for path, kinds in types.items():
+            self._types.setdefault(path, set()).update(kinds)
+        for path, keys in objects:
+            required = self._required.get(path)
+            self._required[path] = keys if required is None else required & keys
+        self._builder.add_object(record)
+        self._schema = None
+        self._hash = self._fingerprint()
+        self.changes += 1
+        return change
+
+    def _fingerprint(self) -> str:
+        # Stable across processes. Sets are sorted first.
+        shape = [
+            sorted((list(path), sorted(kinds)) for path, kinds in self._types.items()),
+            sorted((list(path), sorted(keys)) for path, keys in self._required.items()),
+        ]
+        return xxhash.xxh3_64_hexdigest(orjson.dumps(shape))
+
+    def schema(self) -> dict:
+        """The JSON schema of everything folded in. Rebuilt only after a change."""
+        with self._lock:
+            if self._schema is None:
+                self._schema = self._builder.to_schema()
+            return self._schema
+
+    def stats(self) -> dict:
+        return {
+            "records": self.records,
+            "changes": self.changes,
+            "prechecked": self.prechecked,
+        }
+
+
+end_all(globals())
@@ -0,0 +1,92 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, Optional
+
+from auto_all import end_all
+from auto_all import start_all
+
+start_all(globals())
+
+
+class SchemaHashCache:
+    """Remembers which record schemas a view already covers, per bucket.
+
+    The maestro checks here before it talks to the graph database. If the hash
+    of a record's schema was already folded into the bucket's view (and that
+    knowledge hasn't expired) there's nothing to update. It's shared by every
+    request thread, so a lock guards it.
+
+    Args:
+        ttl (float, optional): Seconds a bucket's hashes stay trusted. Defaults to 300.
+        max_hashes (int, optional): Distinct hashes kept per bucket. Defaults to 64.
+    """
+
+    def __init__(self, ttl: float = 300.0, max_hashes: int = 64):
+        self.ttl = ttl
+        self.max_hashes = max_hashes
+        self._buckets: Dict[Hashable, OrderedDict] = {}
+        self._expires: Dict[Hashable, float] = {}
+        self.hits: int = 0
+        self.misses: int = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def _is_expired(self, bucket: Hashable) -> bool:
+        return self._expires.get(bucket, 0.0) <= time.monotonic()
+
+    def check(self, bucket: Hashable, schema_hash: str) -> bool:
+        """True if the bucket's view is known to cover this schema hash."""
+        with self._lock:
+            hashes = self._buckets.get(bucket)
+            if hashes is not None and self._is_expired(bucket):
+                self._forget(bucket)
+                hashes = None
+            if hashes is None or schema_hash not in hashes:
+                self.misses += 1
+                return False
+            hashes.move_to_end(schema_hash)
+            self.hits += 1
+            return True
+
+    def remember(self, bucket: Hashable, schema_hash: str):
+        with self._lock:
+            if self._is_expired(bucket):
+                self._buckets.pop(bucket, None)
+            hashes = self._buckets.setdefault(bucket, OrderedDict())
+            hashes[schema_hash] = None
+            hashes.move_to_end(schema_hash)
+            while len(hashes) > self.max_hashes:
+                hashes.popitem(last=False)
+            self._expires[bucket] = time.monotonic() + self.ttl
+
+    def invalidate(self, bucket: Optional[Hashable] = None):
+        """Forget a single bucket, or every bucket when none is given."""
+        with self._lock:
+            if bucket is None:
+                self._buckets.clear()
+                self._expires.clear()
+                return
+            self._forget(bucket)
+
+    def _forget(self, bucket: Hashable):
+        self._buckets.pop(bucket, None)
+        self._expires.pop(bucket, None)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hit_rate,
+            "buckets": len(self),
+        }
+
+
+end_all(globals())
@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import Dict, Hashable, Optional
 
 from loguru import logger
 
@@ -7,14 +7,23 @@ from bodhi_server.graph_database._controller import GraphController
 from bodhi_server.graph_database.graph import *
 from bodhi_server.graph_database.graph import ViewNamespace
 from bodhi_server.graph_database.utilz import *
+from bodhi_server.logic.accumulate import SchemaAccumulator
+from bodhi_server.logic.cache import SchemaHashCache
 from bodhi_server.logic.consts import *
 from bodhi_server.logic.interfaces import NamespaceResponse
 from bodhi_server.utils import *
 
 
 class NameMaestro:
-    def __init__(self, graph_controller: Optional[GraphController] = None):
+    def __init__(
+        self,
+        graph_controller: Optional[GraphController] = None,
+        schema_cache: Optional[SchemaHashCache] = None,
+    ):
         self.controller = graph_controller or GraphController()
+        self.schema_cache = schema_cache or SchemaHashCache()
+        # One per (view, view space), for as long as the process runs.
+        self.accumulators: Dict[Hashable, SchemaAccumulator] = {}
 
     def get_or_create_namespace_view(self, view_name: str, **data):
         """Get or create namespace
@@ -97,11 +106,50 @@ class NameMaestro:
         else:
             raise AttributeError("There must either be a schema or an absense of one.")
 
+    def accumulator(self, view_name: str, view_space: ViewParams) -> SchemaAccumulator:
+        key = (to_snake(view_name), view_space)
+        accumulator = self.accumulators.get(key)
+        if accumulator is None:
+            # setdefault, so two threads never end up with an accumulator each.
+            accumulator = self.accumulators.setdefault(key, SchemaAccumulator())
+        return accumulator
+
     def update_schema(self, *, view_name: str, record: dict, view_space: ViewParams):
+        # Steady state: the record doesn't change the bucket's schema and the
+        # view is known to cover it. No genson, no graph calls.
+        cache_key = (to_snake(view_name), view_space)
+        accumulator = self.accumulator(view_name, view_space)
+        change = accumulator.fold(sample_arrays(record))
+        if not change.changed and self.schema_cache.check(
+            cache_key, accumulator.fingerprint
+        ):
+            return []
+        if change.changed:
+            logger.debug(f"Schema of {cache_key[0]} changed: {change.dict()}")
+
         response = self.get_or_create_namespace_view(
             view_name=view_name, **view_space.__dict__
         )
-        return self._update_schema(record, response)
+        created_views = self._update_schema(accumulator.schema(), response)
+        self.schema_cache.remember(cache_key, accumulator.fingerprint)
+        return created_views
+
+    def schema_stats(self) -> dict:
+        stats = [accumulator.stats() for accumulator in self.accumulators.values()]
+        return {
+            "buckets": len(stats),
+            "records": sum(item["records"] for item in stats),
+            "changes": sum(item["changes"] for item in stats),
+        }
+
+    def invalidate_schema(
+        self, view_name: Optional[str] = None, view_space: Optional[ViewParams] = None
+    ):
+        """Drop the cached schema hashes of a view (or of every view)."""
+        if view_name is None or view_space is None:
+            self.schema_cache.invalidate()
+            return
+        self.schema_cache.invalidate((to_snake(view_name), view_space))
 
     def create_view(self, ns_resp: NamespaceResponse):
         # logger.debug(ns_resp)
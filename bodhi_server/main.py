@@ -1,10 +1,24 @@
 import abc
 import hashlib
 import json
-from copy import deepcopy
-from functools import lru_cache
+import sys
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
 from pathlib import Path
-from typing import Any, Dict, List, Literal, Optional, Union
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Literal,
+    TYPE_CHECKING,
+    Optional,
+    Tuple,
+    Union,
+)
 
 from inflection import camelize
 from inflection import tableize
@@ -19,17 +33,45 @@ import stringcase
 import typer
 
 from bodhi_server.pytables import *
+from bodhi_server.settings import get_settings
 from bodhi_server.utils import *
 
-SYS_MAP = DynamicGlobalMap()
-
+if TYPE_CHECKING:
+    import retworkx as rx
 
-@lru_cache
-def make_cache(node_json: str):
-    return hashlib.md5(node_json).hexdigest()
+SYS_MAP = DynamicGlobalMap()
+# Node attribute dicts by hash. Every string field shares one, and so on.
+INTERNED_ATTRS: Dict[str, dict] = {}
+INTERNED_PROPS: Dict[frozenset, dict] = {}
+MAX_INTERNED_ATTRS = 4096
+
+
+def intern_props(props: dict) -> dict:
+    """One shared dict for props with the same (hashable) contents."""
+    try:
+        key = frozenset(props.items())
+    except TypeError:
+        return props
+    interned = INTERNED_PROPS.get(key)
+    if interned is not None:
+        return interned
+    if len(INTERNED_PROPS) < MAX_INTERNED_ATTRS:
+        INTERNED_PROPS[key] = props
+    return props
 
 
 class Node(abc.ABC):
+    __slots__ = (
+        "_node_type",
+        "_value",
+        "_parent",
+        "_is_entity",
+        "_name",
+        "_sub_type",
+        "_attrs",
+        "_identity",
+    )
+
     def __init__(
         self,
         node_type: str,
@@ -45,7 +87,10 @@ class Node(abc.ABC):
         self._is_entity = is_entity
         self._name = name
         self._sub_type = sub_type
-        self._attrs = attrs
+        # Shared, `add_props` replaces it instead of changing it.
+        self._attrs = intern_props(attrs)
+        # Attributes as stored in the graph, and the node id. Built on first use.
+        self._identity: Optional[Tuple[dict, str]] = None
 
     @property
     def name(self) -> str:
@@ -66,7 +111,7 @@ class Node(abc.ABC):
         Returns:
             str: An id that has the format: {name}-{node_hash}
         """
-        return f"{self.name}-{self.node_hash}"
+        return self._ensure_identity()[1]
 
     @property
     def props(self) -> dict:
@@ -84,28 +129,49 @@ class Node(abc.ABC):
     def parent(self, _parent: "Node"):
         self._parent = _parent
 
+    def _graph_attrs(self) -> dict:
+        attrs = {**self._attrs, "node_type": self.ntype}
+        if self._sub_type is not None:
+            attrs["sub_type"] = self._sub_type
+        if self.value:
+            attrs["node_value"] = self.value
+        return attrs
+
+    def _ensure_identity(self) -> Tuple[dict, str]:
+        if self._identity is None:
+            attrs = self._graph_attrs()
+            node_json = orjson.dumps({"attrs": attrs}, option=orjson.OPT_SORT_KEYS)
+            node_hash = hashlib.md5(node_json).hexdigest()
+            if len(INTERNED_ATTRS) < MAX_INTERNED_ATTRS:
+                attrs = INTERNED_ATTRS.setdefault(node_hash, attrs)
+            self._identity = (attrs, sys.intern(f"{self.name}-{node_hash}"))
+        return self._identity
+
+    def _invalidate(self):
+        """Forget the cached identity. Call after changing the name, props or value."""
+        self._identity = None
+
     @property
     def graph_repr(self) -> adt.Dict:
         graph_repr = adt.Dict()
         graph_repr.name = self.name
-        graph_repr.attrs = adt.Dict(**self._attrs)
-        graph_repr.attrs.node_type = self.ntype
-        if self._sub_type is not None:
-            graph_repr.attrs.sub_type = self._sub_type
-        if self.value:
-            graph_repr.attrs.node_value = self.value
+        graph_repr.attrs = adt.Dict(self._ensure_identity()[0])
         return graph_repr
 
     @property
     def graph_repr_dict(self) -> Dict:
-        return self.graph_repr.to_dict()
+        return {"name": self.name, "attrs": dict(self.graph_attrs)}
+
+    @property
+    def graph_attrs(self) -> dict:
+        """The attributes stored in the graph. Shared between nodes, don't change it."""
+        return self._ensure_identity()[0]
 
     @property
     def node_hash(self) -> str:
-        local_rep = deepcopy(self.graph_repr)
-        local_rep.pop("name", None)
-        node_json = orjson.dumps(local_rep.to_dict(), option=orjson.OPT_SORT_KEYS)
-        return make_cache(node_json)
+        """md5 of the node's attributes. Computed once, until they change."""
+        # The end of the node id
+        return self._ensure_identity()[1][-32:]
 
     @property
     def ntype(self) -> str:
@@ -118,9 +184,12 @@ class Node(abc.ABC):
     @value.setter
     def value(self, _value):
         self._value = _value
+        self._invalidate()
 
     def add_props(self, **attrs):
-        self._attrs.update(attrs)
+        # A new dict, the old one may be shared.
+        self._attrs = intern_props({**self._attrs, **attrs})
+        self._invalidate()
 
     def __repr__(self) -> str:
         return f"{camelize(self.ntype)}({self.name}, parent={self.parent})"
@@ -131,6 +200,8 @@ class Node(abc.ABC):
 
 
 class System(Node):
+    __slots__ = ()
+
     def __init__(self):
         super().__init__("system", is_entity=False)
         self.value = nx.DiGraph(name=self.name)
@@ -195,7 +266,7 @@ class System(Node):
     def add_node(self, node: "Subsystem"):
         if self.node_count == 0:
             self.net.graph.update({"root_id": node.node_id})
-        self.net.add_node(node.node_id, **node.graph_repr_dict)
+        self.net.add_node(node.node_id, name=node.name, attrs=node.graph_attrs)
 
     def add_edge(self, parent: "Subsystem", child: "Subsystem", **edges):
         self.net.add_edge(parent.node_id, child.node_id, **edges)
@@ -206,11 +277,205 @@ class System(Node):
         if node.parent:
             self.add_edge(node.parent, node, **edges)
 
+    def predecessors(self, node: Union["Subsystem", str]) -> List[str]:
+        return list(self.net.predecessors(self.extract_id(node)))
+
+    def direct_successors(self, node: Union["Subsystem", str]) -> List[str]:
+        return list(self.net.successors(self.extract_id(node)))
+
+    def subgraph(self, node_ids: Iterable[str]) -> nx.DiGraph:
+        """A copy of the nodes and the edges between them, as a networkx graph."""
+        return self.net.subgraph(node_ids).copy()
+
+    def topological_sort(self) -> List[str]:
+        return list(nx.topological_sort(self.net))
+
+    def is_dag(self) -> bool:
+        return nx.is_directed_acyclic_graph(self.net)
+
     def to_dict(self):
         return json.loads(nx.jit_data(self.net))
 
+    def clear(self):
+        """Drop every node and edge, so the system can be used again."""
+        self.net.clear()
+        self.net.graph["name"] = self.name
+
+
+def empty_digraph() -> "rx.PyDiGraph":
+    # retworkx loads here, once a retworkx system is built, not on `import bodhi_server`.
+    import retworkx as rx
+
+    return rx.PyDiGraph(multigraph=False)
+
+
+class RxSystem(System):
+    """A system on a retworkx graph, with the same API as `System`.
+
+    Nodes are kept by index, next to a map from their ids. Traversals and the
+    topological sort run in retworkx. `net` is the `PyDiGraph`, so code that
+    wants networkx should use `subgraph` or `to_networkx`.
+    """
+
+    __slots__ = ("_index", "_ids", "_root_id")
+
+    def __init__(self):
+        Node.__init__(self, "system", is_entity=False)
+        self.value = empty_digraph()
+        self._index: Dict[str, int] = {}
+        self._ids: List[str] = []
+        self._root_id: Optional[str] = None
+
+    @property
+    def net(self) -> "rx.PyDiGraph":
+        return self.value
+
+    @property
+    def node_count(self) -> int:
+        return self.net.num_nodes()
+
+    @property
+    def edge_count(self) -> int:
+        return self.net.num_edges()
+
+    @property
+    def root_id(self) -> str:
+        if self.node_count > 0:
+            return self._root_id
+        raise ValueError("there hasn't been an added root yet")
+
+    def get_node(self, node: Union["Subsystem", str]) -> dict:
+        return self.net[self._index[self.extract_id(node)]]
+
+    def _successor_indices(self, index: int) -> List[int]:
+        # retworkx lists the newest edge first. networkx goes by insertion.
+        return list(reversed(self.net.successor_indices(index)))
+
+    def successors(
+        self,
+        node: Union["Subsystem", str],
+        depth_limit: int = 1,
+        protocol: Literal["breadth", "depth"] = "breadth",
+    ):
+        """The same as `System.successors`, in the same order."""
+        source = self._index[self.extract_id(node)]
+        limit = self.node_count if depth_limit is None else depth_limit
+        ids = self._ids
+        if protocol == "breadth":
+            found = {ids[source]: []}
+            seen, level = {source}, [source]
+            for _ in range(limit):
+                following = []
+                for parent in level:
+                    for child in self._successor_indices(parent):
+                        if child not in seen:
+                            seen.add(child)
+                            following.append(child)
+                            found.setdefault(ids[parent], []).append(ids[child])
+                if not following:
+                    break
+                level = following
+            return found
+        found = {}
+        seen = {source}
+        stack = [(source, iter(self._successor_indices(source)), limit)]
+        while stack:
+            parent, children, depth = stack[-1]
+            for child in children:
+                if child not in seen:
+                    seen.add(child)
+                    found.setdefault(ids[parent], []).append(ids[child])
+                    if depth > 1:
+                        following = iter(self._successor_indices(child))
+                        stack.append((child, following, depth - 1))
+                    break
+            else:
+                stack.pop()
+        return found
+
+    def add_node(self, node: "Subsystem"):
+        node_id = node.node_id
+        payload = {"name": node.name, "attrs": node.graph_attrs}
+        index = self._index.get(node_id)
+        if index is not None:
+            self.net[index] = payload
+            return
+        if self.node_count == 0:
+            self._root_id = node_id
+        self._index[node_id] = self.net.add_node(payload)
+        self._ids.append(node_id)
+
+    def add_edge(self, parent: "Subsystem", child: "Subsystem", **edges):
+        # Like networkx, missing ends are added.
+        for end in (parent, child):
+            if end.node_id not in self._index:
+                self.add_node(end)
+        index = self._index
+        self.net.add_edge(index[parent.node_id], index[child.node_id], edges)
+
+    def predecessors(self, node: Union["Subsystem", str]) -> List[str]:
+        index = self._index[self.extract_id(node)]
+        parents = reversed(self.net.predecessor_indices(index))
+        return [self._ids[parent] for parent in parents]
+
+    def direct_successors(self, node: Union["Subsystem", str]) -> List[str]:
+        index = self._index[self.extract_id(node)]
+        return [self._ids[child] for child in self._successor_indices(index)]
+
+    def subgraph(self, node_ids: Iterable[str]) -> nx.DiGraph:
+        # In the order they were added, like a networkx subgraph
+        node_ids = sorted(set(node_ids), key=self._index.__getitem__)
+        graph = nx.DiGraph()
+        for node_id in node_ids:
+            graph.add_node(node_id, **self.net[self._index[node_id]])
+        for node_id in node_ids:
+            index = self._index[node_id]
+            for child in self._successor_indices(index):
+                child_id = self._ids[child]
+                if child_id in graph:
+                    edges = self.net.get_edge_data(index, child)
+                    graph.add_edge(node_id, child_id, **edges)
+        return graph
+
+    def to_networkx(self) -> nx.DiGraph:
+        graph = self.subgraph(self._ids)
+        graph.graph.update(name=self.name, root_id=self._root_id)
+        return graph
+
+    def topological_sort(self) -> List[str]:
+        import retworkx as rx
+
+        return [self._ids[index] for index in rx.topological_sort(self.net)]
+
+    def is_dag(self) -> bool:
+        import retworkx as rx
+
+        return rx.is_directed_acyclic_graph(self.net)
+
+    def to_dict(self):
+        return json.loads(nx.jit_data(self.to_networkx()))
+
+    def clear(self):
+        self.value = empty_digraph()
+        self._index.clear()
+        self._ids.clear()
+        self._root_id = None
+
+
+SYSTEMS = {"networkx": System, "retworkx": RxSystem}
+
+
+def new_system() -> System:
+    """An empty system of the configured kind (`BODHI_GRAPH_BACKEND`)."""
+    backend = get_settings().plan.graph_backend
+    if backend not in SYSTEMS:
+        raise ValueError(f"Unknown graph backend {backend}, use one of {list(SYSTEMS)}")
+    return SYSTEMS[backend]()
+
 
 class Subsystem(Node):
+    __slots__ = ("_system",)
+
     def __init__(
         self,
         _node_type: str,
@@ -222,6 +487,7 @@ class Subsystem(Node):
         super().__init__(
             _node_type, name=name, is_entity=is_entity, sub_type=sub_type, **attrs
         )
+        self._system: Optional[System] = None
 
     def add_current(self, _sys: Optional[System] = None):
         """Add the current entity to the system .
@@ -251,6 +517,8 @@ class Subsystem(Node):
 
 
 class Entity(Subsystem):
+    __slots__ = ()
+
     def __init__(
         self,
         sub_type: Optional[str] = None,
@@ -271,6 +539,8 @@ class Entity(Subsystem):
 
 
 class Component(Subsystem):
+    __slots__ = ()
+
     def __init__(
         self,
         _type: Optional[str] = "component",
@@ -305,7 +575,7 @@ class SystemProperties:
 
     @property
     def is_dag(self) -> bool:
-        return nx.is_directed_acyclic_graph(self.system.net)
+        return self.system.is_dag()
 
     @property
     def root_id(self) -> str:
@@ -322,7 +592,7 @@ class SystemProperties:
         Returns:
             List[str]: A list of ids with a topological sort.
         """
-        return list(nx.topological_sort(self.system.net))
+        return self.system.topological_sort()
 
     @property
     def rev_top_sort(self) -> List[str]:
@@ -431,11 +701,75 @@ class Visitor(SystemProperties, abc.ABC):
         raise NotImplementedError
 
 
+# Set by `scoped_system`. `system()` hands it out instead of the default.
+CURRENT_SYSTEM: ContextVar[Optional[System]] = ContextVar(
+    "current_system", default=None
+)
+
+
+class SystemPool:
+    """Empty systems to plan in, reused instead of growing one global graph.
+
+    Args:
+        size (int, optional): Most idle systems kept around. Defaults to 8.
+        factory (Callable, optional): Makes new systems. Defaults to `new_system`.
+    """
+
+    def __init__(self, size: int = 8, factory: Callable[[], System] = new_system):
+        self.size = size
+        self.factory = factory
+        self._idle: List[System] = []
+        self._lock = threading.Lock()
+        self.created: int = 0
+        self.reused: int = 0
+
+    def acquire(self) -> System:
+        with self._lock:
+            if self._idle:
+                self.reused += 1
+                return self._idle.pop()
+            self.created += 1
+        return self.factory()
+
+    def release(self, _system: System):
+        _system.clear()
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append(_system)
+
+    def stats(self) -> dict:
+        return {"created": self.created, "reused": self.reused, "idle": len(self._idle)}
+
+
+SYSTEM_POOL = SystemPool()
+
+
+@contextmanager
+def scoped_system(pool: SystemPool = SYSTEM_POOL) -> Iterator[System]:
+    """A system of its own for the current request, returned to the pool after.
+
+    Everything walked inside the block lands in it rather than the default
+    system, so planning only sees this request's tables.
+    """
+    local = pool.acquire()
+    token = CURRENT_SYSTEM.set(local)
+    try:
+        yield local
+    finally:
+        CURRENT_SYSTEM.reset(token)
+        pool.release(local)
+
+
 def system(name: str = "default") -> System:
+    if name == "default":
+        current = CURRENT_SYSTEM.get()
+        if current is not None:
+            return current
+
     if name in SYS_MAP:
         return SYS_MAP[name]
 
-    SYS_MAP[name] = System()
+    SYS_MAP[name] = new_system()
     return SYS_MAP.get(name)
 
 
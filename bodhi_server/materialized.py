@@ -1,17 +1,18 @@
 import random as rand
 import uuid
+from datetime import datetime
 from typing import Optional
 
 from devtools import debug
 from loguru import logger
 
 from decorator import decorator
-from pglast import parse_sql
-from random_word import RandomWords
 
-# from sqlalchemy import cast
+from sqlalchemy import cast
+from sqlalchemy import literal
 from sqlalchemy import select
 from sqlalchemy.dialects import postgresql as psql
+from sqlalchemy.dialects.postgresql import TIMESTAMP
 from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.schema import DDLElement
 from sqlalchemy.sql import ClauseElement
@@ -25,7 +26,6 @@ from bodhi_server.matches import TableType
 from bodhi_server.pytables import *
 from bodhi_server.tables import MetaTableAdapter
 
-rand_words = RandomWords()
 adapter = TableAdapter()
 # meta_adapter: Optional[MetaTableAdapter] = None
 # A local password for the time being.
@@ -89,7 +89,27 @@ def json_col(field: FieldType, meta_adapter: MetaTableAdapter):
     return meta_adapter.kernel.field_as(name, kind)
 
 
-def create_select(table: TableType, _adapter: MetaTableAdapter):
+def time_literal(moment: datetime):
+    # Rendered with literal_binds, so it has to be a plain string cast in postgres.
+    return cast(literal(moment.isoformat()), TIMESTAMP(timezone=True))
+
+
+def create_select(
+    table: TableType,
+    _adapter: MetaTableAdapter,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+):
+    """Select the table's fields out of the kernel.
+
+    Args:
+        table (TableType): The table we're creating a select for.
+        _adapter (MetaTableAdapter): The tables.
+        start (Optional[datetime], optional): Only rows with `event_at >= start`. Defaults to None.
+        end (Optional[datetime], optional): Only rows with `event_at < end`. Defaults to None.
+
+    Constant bounds let the planner prune the time partitions of `kernel`.
+    """
     if not table.field_count:
         raise ValueError(
             "We can't create a select function with zero fields. Again Later."
@@ -98,14 +118,25 @@ def create_select(table: TableType, _adapter: MetaTableAdapter):
     traits_gen = list(map(adapted_col, table.traits))
     traits_gen += _adapter.kernel.combined
     select_stmt = select(traits_gen).where(_adapter.kernel.bucket == table.entity)
+    if start is not None:
+        select_stmt = select_stmt.where(_adapter.kernel.c.event_at >= time_literal(start))
+    if end is not None:
+        select_stmt = select_stmt.where(_adapter.kernel.c.event_at < time_literal(end))
 
     return select_stmt
 
 
 @compilize
-def build_view(table: TableType, _adapter: Optional[MetaTableAdapter] = None):
+def build_view(
+    table: TableType,
+    _adapter: Optional[MetaTableAdapter] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+):
     _ladapter = _adapter or _init_tables()
-    return CreateView(table.name, selectable=create_select(table, _ladapter))
+    return CreateView(
+        table.name, selectable=create_select(table, _ladapter, start=start, end=end)
+    )
 
 
 @compilize
@@ -0,0 +1,22 @@
+from .bulk import ColumnBatch
+from .bulk import columnize
+from .bulk import copy_measure_columns
+from .bulk import MeasureColumns
+from .chunks import compacted_between
+from .live import LiveStats
+from .live import RunningStats
+from .query import asyncpg_sql
+from .query import encode_ndjson
+from .query import MeasureQuery
+from .query import QuantileQuery
+from .query import query_statement
+from .query import stream_points
+from .query import stream_records
+from .rollups import pick_rollup
+from .sketch import range_quantiles
+from .sketch import SketchBuffer
+from .sketch import TDigest
+from .typed import METRIC_LAYOUTS
+from .typed import typed_value
+from .typed import VALUE_COLUMNS
+from .typed import value_column
@@ -0,0 +1,189 @@
+from datetime import datetime, timezone
+from itertools import repeat
+from typing import Iterable, List, Optional, Tuple, TYPE_CHECKING
+
+import numpy as np
+from pydantic import BaseModel
+
+from bodhi_server.measures.typed import INT64_MAX
+from bodhi_server.measures.typed import INT64_MIN
+from bodhi_server.measures.typed import typed_value
+from bodhi_server.measures.typed import VALUE_COLUMNS
+
+if TYPE_CHECKING:
+    # asyncpg stays out of `import bodhi_server`. See tests/benchmarks.
+    from asyncpg.pool import Pool
+
+# No created_at, its server default stamps it. The rollup watermark goes by it,
+# so it can't come from the client's clock.
+TYPED_COPY_COLUMNS = ("subject", "name", "val_type", *VALUE_COLUMNS, "clock_at")
+TEXT_COPY_COLUMNS = ("subject", "name", "value", "val_type", "clock_at", "created_at")
+# numpy's dtype kind -> (val_type, typed column)
+KINDS = {
+    "b": ("bool", "value_bool"),
+    "i": ("int", "value_int"),
+    "u": ("int", "value_int"),
+    "f": ("float", "value_float"),
+    "U": ("str", "value_text"),
+}
+
+
+class MeasureColumns(BaseModel):
+    """Measurements as columns. `values[i][j]` is `names[j]` at `clock_at[i]`.
+
+    `clock_at` (unix seconds) and `values` are deliberately untyped lists.
+    They're checked as whole arrays in `columnize`, not element by element.
+    """
+
+    subject: str
+    names: List[str]
+    clock_at: list
+    values: list
+    created_at: Optional[datetime] = None
+
+
+class ColumnBatch:
+    """Validated measurement columns, ready to be copied."""
+
+    def __init__(
+        self,
+        subject: str,
+        names: List[str],
+        clock: np.ndarray,
+        values: np.ndarray,
+        created_at: datetime,
+    ):
+        self.subject = subject
+        self.names = names
+        self.clock = clock
+        self.values = values
+        self.created_at = created_at
+
+    @property
+    def points(self) -> int:
+        return self.values.size
+
+    def clock_times(self) -> List[datetime]:
+        # One datetime per tick, shared by every name in it.
+        return [
+            datetime.fromtimestamp(moment, timezone.utc) for moment in self.clock.tolist()
+        ]
+
+    def typed_column(self, index: int) -> Tuple[str, str, list]:
+        """The val_type, typed column and python values of one name."""
+        column = self.values[:, index]
+        try:
+            inferred = np.array(column.tolist())
+        except (ValueError, OverflowError):
+            inferred = column
+        kind = inferred.dtype.kind
+        if kind in "iu" and len(inferred) and (
+            inferred.min() < INT64_MIN or inferred.max() > INT64_MAX
+        ):
+            kind = "O"
+        if kind not in KINDS:
+            # Mixed or odd types. Rare, so it's fine to take the slow path here.
+            return "mixed", "", column.tolist()
+        val_type, target = KINDS[kind]
+        return val_type, target, inferred.tolist()
+
+    def typed_records(self) -> Iterable[tuple]:
+        """Rows in `TYPED_COPY_COLUMNS` order, built column by column."""
+        ticks, width = self.values.shape
+        typed = {
+            name: np.full((ticks, width), None, dtype=object) for name in VALUE_COLUMNS
+        }
+        val_types = np.empty((ticks, width), dtype=object)
+        for index in range(width):
+            val_type, target, column = self.typed_column(index)
+            if target:
+                typed[target][:, index] = column
+                val_types[:, index] = val_type
+                continue
+            for tick, value in enumerate(column):
+                spread = typed_value(value)
+                val_types[tick, index] = spread.pop("val_type")
+                for name, item in spread.items():
+                    typed[name][tick, index] = item
+        clock = np.repeat(np.array(self.clock_times(), dtype=object), width)
+        return zip(
+            repeat(self.subject),
+            self.names * ticks,
+            val_types.ravel().tolist(),
+            *[typed[name].ravel().tolist() for name in VALUE_COLUMNS],
+            clock.tolist(),
+        )
+
+    def text_records(self) -> Iterable[tuple]:
+        """Rows in `TEXT_COPY_COLUMNS` order, for the text layout."""
+        ticks, width = self.values.shape
+        val_types = [type(value).__name__ for value in self.values.ravel().tolist()]
+        return zip(
+            repeat(self.subject),
+            self.names * ticks,
+            self.values.astype(str).ravel().tolist(),
+            val_types,
+            np.repeat(self.clock, width).tolist(),
+            repeat(self.created_at.timestamp()),
+        )
+
+
+def columnize(measures: MeasureColumns, max_points: int = 1_000_000) -> ColumnBatch:
+    """Check the columns' shapes and types with array operations.
+
+    Raises:
+        ValueError: With a message that says what's wrong with the columns.
+    """
+    names = measures.names
+    if not names or len(set(names)) != len(names):
+        raise ValueError("names must be a non-empty list of unique names")
+    try:
+        clock = np.asarray(measures.clock_at, dtype=np.float64)
+    except (TypeError, ValueError):
+        raise ValueError("clock_at must be a list of unix timestamps")
+    if clock.ndim != 1 or not len(clock):
+        raise ValueError("clock_at must be a non-empty list of unix timestamps")
+    if not np.isfinite(clock).all():
+        raise ValueError("clock_at can't have NaN or infinite timestamps")
+
+    expected = (len(clock), len(names))
+    if expected[0] * expected[1] > max_points:
+        raise ValueError(f"Send at most {max_points} points at once")
+    shape_error = f"values must be {expected[0]} rows of {expected[1]} values"
+    try:
+        values = np.array(measures.values, dtype=object)
+    except ValueError:
+        raise ValueError(shape_error)
+    # Also catches nested lists, they add a dimension.
+    if values.shape != expected:
+        raise ValueError(shape_error)
+    created_at = measures.created_at or datetime.now(timezone.utc)
+    if created_at.tzinfo is None:
+        created_at = created_at.replace(tzinfo=timezone.utc)
+    return ColumnBatch(measures.subject, names, clock, values, created_at)
+
+
+async def copy_measure_columns(
+    pool: "Pool", batch: ColumnBatch, layout: str = "text"
+) -> int:
+    """Write every point in the batch with a single COPY.
+
+    Args:
+        pool (Pool): The asyncpg pool.
+        batch (ColumnBatch): From `columnize`.
+        layout (str, optional): The metrics layout. Defaults to "text".
+
+    Returns:
+        int: The number of points written.
+    """
+    if layout == "typed":
+        table, columns = "metric_points", TYPED_COPY_COLUMNS
+        records = batch.typed_records()
+    else:
+        table, columns = "metrics", TEXT_COPY_COLUMNS
+        records = batch.text_records()
+    async with pool.acquire() as conn:
+        status: str = await conn.copy_records_to_table(
+            table, records=records, columns=columns
+        )
+    return int(status.split()[-1])
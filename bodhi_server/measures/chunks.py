@@ -0,0 +1,228 @@
+import asyncio
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+import numpy as np
+from loguru import logger
+from sqlalchemy import and_
+from sqlalchemy import func
+from sqlalchemy import or_
+from sqlalchemy import select
+from sqlalchemy.sql.expression import ColumnElement
+
+from bodhi_server.measures.gorilla import decode_chunk
+from bodhi_server.measures.gorilla import encode_chunk
+from bodhi_server.measures.rollups import align
+from bodhi_server.measures.rollups import frozen_before
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+MICROSECOND = timedelta(microseconds=1)
+# Different from the rollup refresh, the two can run side by side.
+COMPACT_LOCK = 0x636F6D70616374
+# Past this, a float64 can't hold every int exactly. Those points stay raw.
+EXACT_INT = 1 << 53
+ChunkKey = Tuple[str, str, str]
+
+
+def compactable(points) -> ColumnElement:
+    """Points a chunk can hold without losing anything. Text and nulls stay raw."""
+    return or_(
+        points.value_float.isnot(None),
+        points.value_int.between(-EXACT_INT, EXACT_INT),
+        points.value_bool.isnot(None),
+    )
+
+
+def eligible(points, created: datetime) -> ColumnElement:
+    # Only the points the rollups already cover.
+    return and_(compactable(points), points.created_at <= created)
+
+
+def to_micros(moment: datetime) -> int:
+    return (moment - EPOCH) // MICROSECOND
+
+
+def from_micros(micros: int) -> datetime:
+    return EPOCH + timedelta(microseconds=micros)
+
+
+def chunk_rows(records: Iterable[tuple], window_start: datetime) -> List[dict]:
+    """Encode points as `metric_chunks` rows, one per (subject, name, val_type).
+
+    Args:
+        records (Iterable[tuple]): subject, name, val_type, value_float, value_int,
+            value_bool and clock_at of every point.
+        window_start (datetime): The start of the window they all fall in.
+    """
+    series: Dict[ChunkKey, list] = defaultdict(list)
+    for subject, name, val_type, as_float, as_int, as_bool, clock_at in records:
+        value = as_float if as_float is not None else as_int
+        value = float(as_bool if value is None else value)
+        series[(subject, name, val_type)].append((to_micros(clock_at), value))
+    rows = []
+    for (subject, name, val_type), points in series.items():
+        points.sort()
+        times = np.array([moment for moment, _ in points], dtype=np.int64)
+        values = np.array([value for _, value in points], dtype=np.float64)
+        rows.append(
+            {
+                "subject": subject,
+                "name": name,
+                "val_type": val_type,
+                "window_start": window_start,
+                "first_at": from_micros(int(times[0])),
+                "last_at": from_micros(int(times[-1])),
+                "count": len(points),
+                "data": encode_chunk(times, values),
+            }
+        )
+    return rows
+
+
+def compact_window(
+    adapter, conn, start: datetime, end: datetime, created: datetime
+) -> int:
+    """Move one window's compactable points from `metric_points` into chunks.
+
+    DELETE ... RETURNING hands back exactly the rows that were removed, so a
+    point written while this runs is either in a chunk or still raw.
+    """
+    points = adapter.metric_points
+    c = points.c
+    where = [eligible(c, created), c.clock_at >= start, c.clock_at < end]
+    returning = (
+        c.subject,
+        c.name,
+        c.val_type,
+        c.value_float,
+        c.value_int,
+        c.value_bool,
+        c.clock_at,
+    )
+    deleted = conn.execute(
+        points.delete().where(and_(*where)).returning(*returning)
+    ).fetchall()
+    rows = chunk_rows(deleted, start)
+    if rows:
+        conn.execute(adapter.metric_chunks.insert(), rows)
+    return len(deleted)
+
+
+def check_compaction(adapter):
+    """Refuse to compact while the `metrics` view is kept.
+
+    The view reads `metric_points` only. Points moved into chunks would drop
+    out of it without a word.
+
+    Raises:
+        RuntimeError: The adapter keeps the view.
+    """
+    if adapter.metrics_layout == "typed" and adapter.metrics_view:
+        raise RuntimeError(
+            "Compaction would hide points from the metrics view. "
+            "Set BODHI_METRICS_VIEW=false once nothing reads `metrics`, "
+            "or BODHI_COMPACT_AFTER_SECONDS=0 to keep every point raw."
+        )
+
+
+def compact_points(adapter, after: float, window: int = 7200) -> int:
+    """Compact the points older than `after` seconds into chunks, a window at a time.
+
+    Only points the rollups already cover are taken, and only up to where
+    the rollups stop being refreshed (see `rollups.frozen_before`). Without
+    rollups nothing is compacted: bucketed queries only read raw points, so
+    they'd lose whatever went into a chunk.
+
+    Returns:
+        int: Points compacted. 0 when another compaction is running.
+
+    Raises:
+        RuntimeError: The `metrics` view is kept, see `check_compaction`.
+    """
+    if not adapter.metric_rollups:
+        logger.warning("Not compacting metric points, there are no rollups to read")
+        return 0
+    check_compaction(adapter)
+    points = adapter.metric_points.c
+    marks = adapter.rollup_watermarks.c
+    compacted = 0
+    while True:
+        with adapter.engine.begin() as conn:
+            locked = select([func.pg_try_advisory_xact_lock(COMPACT_LOCK)])
+            if not conn.execute(locked).scalar():
+                return compacted
+            now = conn.execute(select([func.now()])).scalar()
+            horizon = frozen_before(now, after, [window, *adapter.metric_rollups])
+            created = conn.execute(select([func.min(marks.watermark)])).scalar()
+            if created is None:
+                return compacted
+            first = conn.execute(
+                select([func.min(points.clock_at)]).where(
+                    and_(eligible(points, created), points.clock_at < horizon)
+                )
+            ).scalar()
+            if first is None:
+                break
+            start = align(first, window)
+            compacted += compact_window(
+                adapter, conn, start, start + timedelta(seconds=window), created
+            )
+    logger.debug(f"Compacted {compacted} points")
+    return compacted
+
+
+async def maintain_chunks(adapter, every: float, after: float, window: int = 7200):
+    """Compact old points every `every` seconds for as long as the server runs."""
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(every)
+        try:
+            await loop.run_in_executor(None, compact_points, adapter, after, window)
+        except Exception as e:
+            logger.exception(e)
+
+
+def chunk_query(adapter, subject: str, names: List[str], start, end):
+    """Chunks holding points in [start, end), in window order."""
+    chunks = adapter.metric_chunks.c
+    return (
+        select([chunks.name, chunks.val_type, chunks.window_start, chunks.data])
+        .where(
+            and_(
+                chunks.subject == subject,
+                chunks.name.in_(names),
+                chunks.last_at >= start,
+                chunks.first_at < end,
+            )
+        )
+        .order_by(chunks.window_start)
+    )
+
+
+def compacted_between(adapter, subject: str, names: List[str], start, end) -> bool:
+    """Whether any of the names has points in [start, end) that went into chunks."""
+    statement = chunk_query(adapter, subject, names, start, end).limit(1)
+    return adapter.engine.execute(statement).first() is not None
+
+
+def decode_points(
+    chunks: Iterable[tuple], start: datetime, end: datetime
+) -> Iterator[dict]:
+    """The points of one window's chunks as rows, ordered by (clock_at, name)."""
+    decoded = []
+    low, high = to_micros(start), to_micros(end)
+    for name, val_type, data in chunks:
+        times, values = decode_chunk(bytes(data))
+        keep = (times >= low) & (times < high)
+        for moment, value in zip(times[keep].tolist(), values[keep].tolist()):
+            decoded.append((moment, name, val_type, value))
+    decoded.sort(key=lambda point: point[:2])
+    for moment, name, val_type, value in decoded:
+        yield {
+            "name": name,
+            "clock_at": from_micros(moment),
+            "val_type": val_type,
+            "value": value,
+            "value_text": None,
+        }
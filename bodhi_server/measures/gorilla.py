@@ -0,0 +1,149 @@
+import struct
+from typing import Tuple
+
+import numpy as np
+
+# version, points, first timestamp (microseconds), first value's bits
+HEADER = struct.Struct("<BIqQ")
+VERSION = 1
+# Delta-of-delta buckets: (control bits, control length, value bits). Anything
+# bigger is written whole behind the control 11111.
+DOD_BUCKETS = ((0b10, 2, 7), (0b110, 3, 9), (0b1110, 4, 12), (0b11110, 5, 32))
+DOD_ESCAPE = (0b11111, 5, 64)
+# Value bits, by the number of leading ones in the control
+DOD_SIZES = {1: 7, 2: 9, 3: 12, 4: 32, 5: 64}
+
+
+class BitWriter:
+    def __init__(self):
+        self._out = bytearray()
+        self._acc = 0
+        self._bits = 0
+
+    def write(self, value: int, bits: int):
+        self._acc = (self._acc << bits) | (value & ((1 << bits) - 1))
+        self._bits += bits
+        while self._bits >= 8:
+            self._bits -= 8
+            self._out.append((self._acc >> self._bits) & 0xFF)
+        self._acc &= (1 << self._bits) - 1
+
+    def getvalue(self) -> bytes:
+        if self._bits:
+            return bytes(self._out) + bytes([(self._acc << (8 - self._bits)) & 0xFF])
+        return bytes(self._out)
+
+
+class BitReader:
+    def __init__(self, data: bytes, offset: int = 0):
+        self._data = data
+        self._pos = offset
+        self._acc = 0
+        self._bits = 0
+
+    def read(self, bits: int) -> int:
+        while self._bits < bits:
+            if self._pos >= len(self._data):
+                raise ValueError("Truncated chunk")
+            self._acc = (self._acc << 8) | self._data[self._pos]
+            self._pos += 1
+            self._bits += 8
+        self._bits -= bits
+        value = self._acc >> self._bits
+        self._acc &= (1 << self._bits) - 1
+        return value
+
+
+def signed(value: int, bits: int) -> int:
+    return value - (1 << bits) if value >> (bits - 1) else value
+
+
+def encode_chunk(times: np.ndarray, values: np.ndarray) -> bytes:
+    """Compress one series' points, Gorilla style.
+
+    Timestamps (int64 microseconds, ascending) are written as
+    delta-of-deltas, so a steady interval costs a bit per point. Values are
+    XORed with the previous one and only the bits that changed are kept.
+
+    Args:
+        times (np.ndarray): int64 microseconds since the epoch, sorted.
+        values (np.ndarray): float64 values, one per timestamp.
+    """
+    times = np.asarray(times, dtype=np.int64)
+    bits = np.asarray(values, dtype=np.float64).view(np.uint64)
+    if not len(times):
+        raise ValueError("Can't encode an empty chunk")
+    # The arithmetic is vectorized, only the bit packing loops.
+    deltas = np.diff(times, prepend=times[0])
+    dods = np.diff(deltas, prepend=0).tolist()
+    xors = (bits ^ np.concatenate([bits[:1], bits[:-1]])).tolist()
+
+    writer = BitWriter()
+    leading, trailing = -1, 0
+    for index in range(1, len(times)):
+        dod = dods[index]
+        if dod == 0:
+            writer.write(0, 1)
+        else:
+            for control, length, size in DOD_BUCKETS:
+                if -(1 << (size - 1)) <= dod < (1 << (size - 1)):
+                    break
+            else:
+                control, length, size = DOD_ESCAPE
+            writer.write(control, length)
+            writer.write(dod, size)
+
+        xor = xors[index]
+        if xor == 0:
+            writer.write(0, 1)
+            continue
+        lead = min(64 - xor.bit_length(), 31)
+        trail = (xor & -xor).bit_length() - 1
+        if leading >= 0 and lead >= leading and trail >= trailing:
+            # Fits in the previous window of meaningful bits
+            writer.write(0b10, 2)
+            writer.write(xor >> trailing, 64 - leading - trailing)
+            continue
+        leading, trailing = lead, trail
+        meaningful = 64 - lead - trail
+        writer.write(0b11, 2)
+        writer.write(lead, 5)
+        # 64 meaningful bits don't fit in 6, they're written as 0.
+        writer.write(meaningful & 0x3F, 6)
+        writer.write(xor >> trail, meaningful)
+
+    header = HEADER.pack(VERSION, len(times), int(times[0]), int(bits[0]))
+    return header + writer.getvalue()
+
+
+def decode_chunk(blob: bytes) -> Tuple[np.ndarray, np.ndarray]:
+    """The timestamps (int64 microseconds) and float64 values of a chunk."""
+    version, count, first_time, first_bits = HEADER.unpack_from(blob)
+    if version != VERSION:
+        raise ValueError(f"Unknown chunk version {version}")
+    times = [first_time]
+    words = [first_bits]
+    reader = BitReader(blob, HEADER.size)
+    read = reader.read
+    delta, word = 0, first_bits
+    leading, trailing = 0, 0
+    for _ in range(count - 1):
+        if read(1):
+            ones = 1
+            while ones < 5 and read(1):
+                ones += 1
+            size = DOD_SIZES[ones]
+            delta += signed(read(size), size)
+        times.append(times[-1] + delta)
+
+        if read(1):
+            if read(1):
+                leading = read(5)
+                meaningful = read(6) or 64
+                trailing = 64 - leading - meaningful
+            word ^= read(64 - leading - trailing) << trailing
+        words.append(word)
+    return (
+        np.array(times, dtype=np.int64),
+        np.array(words, dtype=np.uint64).view(np.float64),
+    )
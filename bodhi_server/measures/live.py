@@ -0,0 +1,245 @@
+import asyncio
+import math
+import threading
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from loguru import logger
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from bodhi_server.measures.bulk import ColumnBatch
+
+SeriesKey = Tuple[str, str]
+SNAPSHOT_COLUMNS = ("count", "mean", "m2", "min", "max", "updated_at")
+NUMERIC_COLUMNS = ("value_float", "value_int", "value_bool")
+
+
+def as_number(value: Any) -> Optional[float]:
+    """The value as a float, if it's a finite number. Bools count, like in the rollups."""
+    if isinstance(value, (int, float)):
+        number = float(value)
+        return number if math.isfinite(number) else None
+    return None
+
+
+class RunningStats:
+    """Count, mean, variance, min and max of a stream, updated in O(1).
+
+    The variance uses Welford's update. Batches are folded in with Chan's
+    pairwise merge, so a whole column of values costs one update.
+    """
+
+    __slots__ = ("count", "mean", "m2", "min", "max", "updated_at")
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        # Sum of squared differences from the mean
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.updated_at: Optional[datetime] = None
+
+    def add(self, value: float):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def merge(self, count: int, mean: float, m2: float, low: float, high: float):
+        """Fold in the stats of another batch of values."""
+        if count <= 0:
+            return
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta * delta * self.count * count / total
+        self.count = total
+        self.min = min(self.min, low)
+        self.max = max(self.max, high)
+
+    @property
+    def variance(self) -> float:
+        # The sample variance
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    def to_dict(self) -> dict:
+        empty = self.count == 0
+        return {
+            "count": self.count,
+            "mean": None if empty else self.mean,
+            "variance": None if empty else self.variance,
+            "stddev": None if empty else math.sqrt(self.variance),
+            "min": None if empty else self.min,
+            "max": None if empty else self.max,
+            "updated_at": self.updated_at,
+        }
+
+
+class LiveStats:
+    """Running statistics of every (subject, name), kept in process.
+
+    Updated as measurements arrive and read straight from memory, so live
+    dashboards don't aggregate over the metrics tables. The series changed
+    since the last snapshot are tracked, and only those get written.
+    """
+
+    def __init__(self):
+        self._series: Dict[SeriesKey, RunningStats] = {}
+        self._dirty: set = set()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._series)
+
+    def _stats(self, key: SeriesKey, now: datetime) -> RunningStats:
+        # Call with the lock held.
+        stats = self._series.get(key)
+        if stats is None:
+            stats = self._series[key] = RunningStats()
+        stats.updated_at = now
+        self._dirty.add(key)
+        return stats
+
+    def observe(self, subject: str, values: Dict[str, Any]):
+        """One measurement of every name in `values`. Non-numbers are skipped."""
+        numbers = [(name, as_number(value)) for name, value in values.items()]
+        now = datetime.now(timezone.utc)
+        with self._lock:
+            for name, number in numbers:
+                if number is not None:
+                    self._stats((subject, name), now).add(number)
+
+    def observe_batch(self, batch: ColumnBatch):
+        """A whole /measure/bulk grid, folded in one column at a time."""
+        merges = []
+        for index, name in enumerate(batch.names):
+            _, target, column = batch.typed_column(index)
+            if target in NUMERIC_COLUMNS:
+                numbers = np.asarray(column, dtype=np.float64)
+                numbers = numbers[np.isfinite(numbers)]
+            elif target:
+                # Text
+                continue
+            else:
+                mixed = (as_number(value) for value in column)
+                numbers = np.array(
+                    [number for number in mixed if number is not None], dtype=np.float64
+                )
+            if not numbers.size:
+                continue
+            mean = numbers.mean()
+            merges.append(
+                (
+                    name,
+                    numbers.size,
+                    float(mean),
+                    float(((numbers - mean) ** 2).sum()),
+                    float(numbers.min()),
+                    float(numbers.max()),
+                )
+            )
+        now = datetime.now(timezone.utc)
+        with self._lock:
+            for name, *merge in merges:
+                self._stats((batch.subject, name), now).merge(*merge)
+
+    def get(
+        self, subject: str, names: Optional[Iterable[str]] = None
+    ) -> Dict[str, dict]:
+        """The current stats of a subject's names (all of them by default)."""
+        with self._lock:
+            if names is None:
+                names = [name for (owner, name) in self._series if owner == subject]
+            return {
+                name: self._series[(subject, name)].to_dict()
+                for name in names
+                if (subject, name) in self._series
+            }
+
+    def changed_rows(self) -> List[dict]:
+        """Rows for `metric_stats` of every series changed since the last call."""
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            return [
+                {
+                    "subject": subject,
+                    "name": name,
+                    **{
+                        column: getattr(self._series[(subject, name)], column)
+                        for column in SNAPSHOT_COLUMNS
+                    },
+                }
+                for subject, name in dirty
+            ]
+
+    def mark_changed(self, rows: Iterable[dict]):
+        # A failed snapshot gets retried next time.
+        with self._lock:
+            self._dirty.update((row["subject"], row["name"]) for row in rows)
+
+    def restore(self, rows: Iterable[dict]):
+        """Pick up where the last snapshot left off. Series seen since then are kept."""
+        with self._lock:
+            for row in rows:
+                key = (row["subject"], row["name"])
+                if key in self._series:
+                    continue
+                stats = self._series[key] = RunningStats()
+                for column in SNAPSHOT_COLUMNS:
+                    setattr(stats, column, row[column])
+
+    def stats(self) -> dict:
+        return {"series": len(self._series), "unsaved": len(self._dirty)}
+
+
+def snapshot_live_stats(adapter, live: LiveStats) -> int:
+    """Upsert the changed series into `metric_stats`.
+
+    Returns:
+        int: The number of series written.
+    """
+    rows = live.changed_rows()
+    if not rows:
+        return 0
+    table = adapter.metric_stats
+    upsert = pg_insert(table)
+    statement = upsert.on_conflict_do_update(
+        index_elements=["subject", "name"],
+        set_={column: upsert.excluded[column] for column in SNAPSHOT_COLUMNS},
+    )
+    try:
+        with adapter.engine.begin() as conn:
+            conn.execute(statement, rows)
+    except Exception:
+        live.mark_changed(rows)
+        raise
+    return len(rows)
+
+
+def restore_live_stats(adapter, live: LiveStats) -> int:
+    """Load the last snapshot into `live`. Returns the number of series."""
+    table = adapter.metric_stats
+    with adapter.engine.connect() as conn:
+        rows = [dict(row) for row in conn.execute(select([table]))]
+    live.restore(rows)
+    return len(rows)
+
+
+async def maintain_snapshots(adapter, live: LiveStats, every: float = 10.0):
+    """Snapshot the live stats every `every` seconds for as long as the server runs."""
+    loop = asyncio.get_running_loop()
+    try:
+        await loop.run_in_executor(None, restore_live_stats, adapter, live)
+    except Exception as e:
+        logger.exception(e)
+    while True:
+        await asyncio.sleep(every)
+        try:
+            await loop.run_in_executor(None, snapshot_live_stats, adapter, live)
+        except Exception as e:
+            logger.exception(e)
@@ -0,0 +1,270 @@
+import re
+from datetime import datetime, timezone
+from decimal import Decimal
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    List,
+    Literal,
+    Optional,
+    Tuple,
+    TYPE_CHECKING,
+)
+
+import orjson
+from pydantic import BaseModel
+from pydantic import confloat
+from pydantic import Field
+from pydantic import validator
+from sqlalchemy import and_
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.sql.selectable import Select
+
+from bodhi_server.measures.chunks import chunk_query
+from bodhi_server.measures.chunks import decode_points
+from bodhi_server.measures.rollups import align
+from bodhi_server.measures.rollups import numeric_value
+from bodhi_server.measures.rollups import series_query
+
+if TYPE_CHECKING:
+    from asyncpg.pool import Pool
+
+# Numbered binds (:1) are one substitution away from asyncpg's ($1).
+NUMERIC_DIALECT = postgresql.dialect(paramstyle="numeric")
+NUMBERED_BIND = re.compile(r"(?<![:\w]):(\d+)")
+
+
+class RangeQuery(BaseModel):
+    """Some of a subject's names over a time range. Naive times are UTC."""
+
+    subject: str
+    names: List[str] = Field(..., min_items=1)
+    start: datetime
+    end: datetime
+
+    @validator("start", "end")
+    def utc(cls, moment: datetime) -> datetime:
+        return moment if moment.tzinfo else moment.replace(tzinfo=timezone.utc)
+
+    @validator("end")
+    def after_start(cls, end: datetime, values: dict) -> datetime:
+        start = values.get("start")
+        if start is not None and end <= start:
+            raise ValueError("end must come after start")
+        return end
+
+
+class MeasureQuery(RangeQuery):
+    """A time range of one subject's measurements.
+
+    Without a `resolution` the raw points come back. With one, every name gets
+    one row per bucket (count, sum, min, max, sum_sq and mean), read from the
+    coarsest rollup that fits.
+    """
+
+    # Bucket width in seconds
+    resolution: Optional[float] = Field(None, gt=0)
+    # rows: one JSON object per row. columns: one object of arrays per chunk.
+    format: Literal["rows", "columns"] = "rows"
+    limit: Optional[int] = Field(None, gt=0)
+
+    def buckets(self) -> int:
+        """How many buckets the range spans, per name."""
+        if self.resolution is None:
+            return 0
+        first = align(self.start, self.resolution)
+        last = align(self.end, self.resolution, up=True)
+        return int((last - first).total_seconds() // self.resolution)
+
+
+class QuantileQuery(RangeQuery):
+    """Quantiles (0 to 1) of each name over a time range."""
+
+    quantiles: List[confloat(ge=0, le=1)] = Field([0.5, 0.95, 0.99], min_items=1)
+
+
+def raw_points(adapter, query: MeasureQuery) -> Select:
+    """The points themselves, in time order. Either metrics layout."""
+    if adapter.metrics_layout == "typed":
+        points = adapter.metric_points.c
+        columns = [
+            points.name,
+            points.clock_at,
+            points.val_type,
+            numeric_value(points).label("value"),
+            points.value_text,
+        ]
+        start, end = query.start, query.end
+    else:
+        points = adapter.metrics.table.c
+        columns = [points.name, points.clock_at, points.val_type, points.value]
+        # The text layout keeps unix seconds.
+        start, end = query.start.timestamp(), query.end.timestamp()
+    return (
+        select(columns)
+        .where(
+            and_(
+                points.subject == query.subject,
+                points.name.in_(query.names),
+                points.clock_at >= start,
+                points.clock_at < end,
+            )
+        )
+        .order_by(points.clock_at, points.name)
+    )
+
+
+def query_statement(
+    adapter, query: MeasureQuery, function: str = "time_bucket"
+) -> Select:
+    """Raw points, or buckets from the rollups when the query has a `resolution`.
+
+    Raises:
+        ValueError: Buckets were asked for, but the metrics aren't typed.
+    """
+    if query.resolution is None:
+        statement = raw_points(adapter, query)
+    elif adapter.metrics_layout != "typed":
+        raise ValueError("Bucketed queries need the typed metrics layout")
+    else:
+        statement = series_query(
+            adapter,
+            subject=query.subject,
+            names=query.names,
+            start=query.start,
+            end=query.end,
+            resolution=query.resolution,
+            function=function,
+        )
+    if query.limit is not None:
+        statement = statement.limit(query.limit)
+    return statement
+
+
+def asyncpg_sql(statement) -> Tuple[str, list]:
+    """Compile a sqlalchemy statement into asyncpg's SQL and arguments."""
+    compiled = statement.compile(dialect=NUMERIC_DIALECT)
+    sql = NUMBERED_BIND.sub(r"$\1", str(compiled))
+    return sql, [compiled.params[name] for name in compiled.positiontup]
+
+
+def json_default(value: Any) -> Any:
+    # NUMERIC columns come back as Decimal
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError
+
+
+def dumps(value: Any) -> bytes:
+    return orjson.dumps(value, default=json_default) + b"\n"
+
+
+async def stream_records(
+    pool: "Pool", sql: str, args: list, prefetch: int = 1000
+) -> AsyncIterator[dict]:
+    """Rows through a server-side cursor, `prefetch` at a time.
+
+    The result is never held in memory at once, on either side.
+    """
+    async with pool.acquire() as conn:
+        # asyncpg cursors only live inside a transaction.
+        async with conn.transaction(readonly=True):
+            async for record in conn.cursor(sql, *args, prefetch=prefetch):
+                yield dict(record)
+
+
+async def merge_sorted(
+    first: AsyncIterator[dict], second: AsyncIterator[dict], key: Callable
+) -> AsyncIterator[dict]:
+    """Two sorted streams as one, still sorted."""
+    done = object()
+
+    async def pull(stream):
+        try:
+            return await stream.__anext__()
+        except StopAsyncIteration:
+            return done
+
+    left, right = await pull(first), await pull(second)
+    while left is not done or right is not done:
+        if right is done or (left is not done and key(left) <= key(right)):
+            yield left
+            left = await pull(first)
+        else:
+            yield right
+            right = await pull(second)
+
+
+async def stream_points(
+    pool: "Pool", adapter, query: MeasureQuery, prefetch: int = 1000
+) -> AsyncIterator[dict]:
+    """Raw points of the typed layout, whether they're still rows or in chunks.
+
+    Chunks are decoded a window at a time and merged with the rows in time
+    order. Both are read in one snapshot, so a compaction running meanwhile
+    doesn't make points disappear or show up twice.
+    """
+    sql, args = asyncpg_sql(raw_points(adapter, query))
+    chunk_sql, chunk_args = asyncpg_sql(
+        chunk_query(adapter, query.subject, query.names, query.start, query.end)
+    )
+
+    async def decoded(conn) -> AsyncIterator[dict]:
+        window, pending = None, []
+        async for name, val_type, start, data in conn.cursor(
+            chunk_sql, *chunk_args, prefetch=prefetch
+        ):
+            if start != window and pending:
+                for point in decode_points(pending, query.start, query.end):
+                    yield point
+                pending = []
+            window = start
+            pending.append((name, val_type, data))
+        for point in decode_points(pending, query.start, query.end):
+            yield point
+
+    async with pool.acquire() as conn:
+        async with conn.transaction(isolation="repeatable_read", readonly=True):
+            rows = (
+                dict(record)
+                async for record in conn.cursor(sql, *args, prefetch=prefetch)
+            )
+            points = merge_sorted(
+                rows, decoded(conn), key=lambda row: (row["clock_at"], row["name"])
+            )
+            sent = 0
+            async for point in points:
+                yield point
+                sent += 1
+                if sent == query.limit:
+                    break
+
+
+async def encode_ndjson(
+    records: AsyncIterator[dict], format: str = "rows", chunk: int = 1000
+) -> AsyncIterator[bytes]:
+    """Records as NDJSON lines.
+
+    "rows" writes one object per record. "columns" writes one object per
+    `chunk` records, mapping every column to an array of its values.
+    """
+    if format == "rows":
+        async for record in records:
+            yield dumps(record)
+        return
+    columns: dict = {}
+    size = 0
+    async for record in records:
+        if not columns:
+            columns = {key: [] for key in record}
+        for key, value in record.items():
+            columns[key].append(value)
+        size += 1
+        if size == chunk:
+            yield dumps(columns)
+            columns = {key: [] for key in columns}
+            size = 0
+    if size:
+        yield dumps(columns)
@@ -0,0 +1,331 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from functools import reduce
+from math import gcd
+from typing import Dict, Iterable, Optional, Sequence, Tuple
+
+from loguru import logger
+
+from sqlalchemy import and_
+from sqlalchemy import cast
+from sqlalchemy import Float
+from sqlalchemy import func
+from sqlalchemy import Integer
+from sqlalchemy import literal_column
+from sqlalchemy import select
+from sqlalchemy import union_all
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.sql.expression import ColumnElement
+from sqlalchemy.sql.selectable import Select
+
+from bodhi_server.timescale import bucket_expr
+from bodhi_server.timescale import interval_literal
+
+UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+# Both time_bucket and date_bin (the way we call it) count buckets from here.
+ORIGIN = datetime(2000, 1, 3, tzinfo=timezone.utc)
+# Any two refreshes hold this lock, so they never overlap.
+REFRESH_LOCK = 0x626F646869
+AGGREGATES = ("count", "sum", "min", "max", "sum_sq")
+
+
+def parse_width(width: str) -> int:
+    """"90s", "5m", "1h" or "1d" in seconds."""
+    width = width.strip().lower()
+    if width[-1:] not in UNITS or not width[:-1].isdigit() or int(width[:-1]) < 1:
+        raise ValueError(f"{width!r} isn't a width like 30s, 5m, 1h or 1d")
+    return int(width[:-1]) * UNITS[width[-1]]
+
+
+def parse_widths(spec: str) -> Tuple[int, ...]:
+    """A comma separated list of widths, finest first."""
+    widths = {parse_width(width) for width in spec.split(",") if width.strip()}
+    return tuple(sorted(widths))
+
+
+def width_label(seconds: int) -> str:
+    for unit in ("d", "h", "m"):
+        if seconds % UNITS[unit] == 0:
+            return f"{seconds // UNITS[unit]}{unit}"
+    return f"{seconds}s"
+
+
+def rollup_table_name(seconds: int) -> str:
+    return f"metric_rollup_{width_label(seconds)}"
+
+
+def pick_rollup(widths: Iterable[int], resolution: float) -> Optional[int]:
+    """The coarsest rollup that can be re-bucketed into `resolution` exactly."""
+    fits = [
+        width for width in widths if width <= resolution and resolution % width == 0
+    ]
+    return max(fits) if fits else None
+
+
+def align(moment: datetime, seconds: float, up: bool = False) -> datetime:
+    """Round `moment` to a bucket boundary (the same ones `bucket_expr` uses)."""
+    offset = (moment - ORIGIN).total_seconds()
+    buckets = offset // seconds
+    if up and offset % seconds:
+        buckets += 1
+    return ORIGIN + timedelta(seconds=buckets * seconds)
+
+
+def numeric_value(points) -> ColumnElement:
+    """The value of a point as a float. Null for text values."""
+    return func.coalesce(
+        points.value_float,
+        cast(points.value_int, Float(precision=53)),
+        cast(cast(points.value_bool, Integer), Float(precision=53)),
+    )
+
+
+def raw_buckets(
+    adapter,
+    seconds: float,
+    subject: str,
+    names: Sequence[str],
+    start: datetime,
+    end: datetime,
+    function: str = "time_bucket",
+) -> Select:
+    """Aggregates of the raw points per (name, bucket)."""
+    points = adapter.metric_points.c
+    value = numeric_value(points)
+    bucket = bucket_expr(seconds, points.clock_at, function).label("bucket")
+    return (
+        select(
+            [
+                points.name,
+                bucket,
+                func.count(value).label("count"),
+                func.sum(value).label("sum"),
+                func.min(value).label("min"),
+                func.max(value).label("max"),
+                func.sum(value * value).label("sum_sq"),
+            ]
+        )
+        .where(
+            and_(
+                points.subject == subject,
+                points.name.in_(list(names)),
+                points.clock_at >= start,
+                points.clock_at < end,
+                value.isnot(None),
+            )
+        )
+        .group_by(points.name, bucket)
+    )
+
+
+def series_query(
+    adapter,
+    *,
+    subject: str,
+    names: Sequence[str],
+    start: datetime,
+    end: datetime,
+    resolution: float,
+    function: str = "time_bucket",
+) -> Select:
+    """Per (name, bucket) aggregates at `resolution`, from the coarsest rollup that fits.
+
+    The rollup covers the points created up to its watermark. Points created
+    after that are aggregated from `metric_points` and merged in, so the
+    answer doesn't wait for the next refresh. `start` and `end` are widened
+    to whole buckets.
+
+    Args:
+        adapter (MetaTableAdapter): The tables. Needs the typed metrics layout.
+        resolution (float): Bucket width in seconds.
+
+    Returns:
+        Select: name, bucket, count, sum, min, max, sum_sq and mean, ordered by name and bucket.
+    """
+    start, end = align(start, resolution), align(end, resolution, up=True)
+    seconds = pick_rollup(adapter.metric_rollups, resolution)
+    if seconds is None:
+        source = raw_buckets(
+            adapter, resolution, subject, names, start, end, function
+        ).alias("source")
+    else:
+        rollup = adapter.metric_rollups[seconds].c
+        marks = adapter.rollup_watermarks.c
+        watermark = func.coalesce(
+            select([marks.watermark])
+            .where(marks.rollup == width_label(seconds))
+            .as_scalar(),
+            literal_column("'-infinity'::timestamptz"),
+        )
+        rolled = select(
+            [rollup.name, rollup.bucket, *[rollup[name] for name in AGGREGATES]]
+        ).where(
+            and_(
+                rollup.subject == subject,
+                rollup.name.in_(list(names)),
+                rollup.bucket >= start,
+                rollup.bucket < end,
+            )
+        )
+        fresh = raw_buckets(adapter, seconds, subject, names, start, end, function)
+        fresh = fresh.where(adapter.metric_points.c.created_at > watermark)
+        source = union_all(rolled, fresh).alias("source")
+
+    bucket = bucket_expr(resolution, source.c.bucket, function).label("bucket")
+    total = func.sum(source.c["count"])
+    return (
+        select(
+            [
+                source.c.name,
+                bucket,
+                total.label("count"),
+                func.sum(source.c["sum"]).label("sum"),
+                func.min(source.c["min"]).label("min"),
+                func.max(source.c["max"]).label("max"),
+                func.sum(source.c.sum_sq).label("sum_sq"),
+                (func.sum(source.c["sum"]) / func.nullif(total, 0)).label("mean"),
+            ]
+        )
+        .group_by(source.c.name, bucket)
+        .order_by(source.c.name, bucket)
+    )
+
+
+def frozen_before(now: datetime, after: float, widths: Iterable[int]) -> datetime:
+    """Buckets that end before this are frozen. Their points may be compacted.
+
+    It's aligned to every width, so a bucket is either frozen or has all of
+    its points in `metric_points`.
+    """
+    step = reduce(lambda a, b: a * b // gcd(a, b), widths, 1)
+    return align(now - timedelta(seconds=after), step)
+
+
+def refresh_statement(
+    adapter,
+    seconds: int,
+    low: datetime,
+    high: datetime,
+    function: str = "time_bucket",
+    frozen: Optional[datetime] = None,
+):
+    """Recompute every bucket that got new points between the two watermarks.
+
+    Whole buckets are recomputed from the points created up to `high`, so
+    running it twice over the same window is harmless. Buckets before
+    `frozen` are left as they are, some of their points are in chunks now.
+    """
+    points = adapter.metric_points.c
+    rollup = adapter.metric_rollups[seconds]
+    bucket = bucket_expr(seconds, points.clock_at, function)
+    window = [points.created_at > low, points.created_at <= high]
+    if frozen is not None:
+        window.append(points.clock_at >= frozen)
+    changed = (
+        select([points.subject, points.name, bucket.label("bucket")])
+        .where(and_(*window))
+        .distinct()
+        .cte("changed")
+    )
+    value = numeric_value(points)
+    aggregates = (
+        select(
+            [
+                points.subject,
+                points.name,
+                changed.c.bucket,
+                func.count(value),
+                func.sum(value),
+                func.min(value),
+                func.max(value),
+                func.sum(value * value),
+            ]
+        )
+        .select_from(
+            adapter.metric_points.join(
+                changed,
+                and_(
+                    points.subject == changed.c.subject,
+                    points.name == changed.c.name,
+                    points.clock_at >= changed.c.bucket,
+                    points.clock_at < changed.c.bucket + interval_literal(seconds),
+                ),
+            )
+        )
+        .where(and_(points.created_at <= high, value.isnot(None)))
+        .group_by(points.subject, points.name, changed.c.bucket)
+    )
+    upsert = pg_insert(rollup).from_select(
+        ["subject", "name", "bucket", *AGGREGATES], aggregates
+    )
+    return upsert.on_conflict_do_update(
+        index_elements=["subject", "name", "bucket"],
+        set_={name: upsert.excluded[name] for name in AGGREGATES},
+    )
+
+
+def refresh_rollups(
+    adapter, lag: float = 5.0, function: str = "time_bucket", freeze_after: float = 0
+) -> Dict[str, int]:
+    """Bring every rollup up to (now - `lag`).
+
+    The lag leaves room for transactions that started earlier but haven't
+    committed yet. Their points would land behind the watermark otherwise.
+    With `freeze_after` (seconds), buckets older than that aren't touched
+    again. Set it when old points get compacted into chunks.
+
+    Returns:
+        Dict[str, int]: Buckets rewritten per rollup. Empty if another refresh is running.
+    """
+    refreshed: Dict[str, int] = {}
+    if not adapter.metric_rollups:
+        return refreshed
+    marks = adapter.rollup_watermarks
+    with adapter.engine.begin() as conn:
+        locked = select([func.pg_try_advisory_xact_lock(REFRESH_LOCK)])
+        if not conn.execute(locked).scalar():
+            return refreshed
+        now = conn.execute(select([func.now()])).scalar()
+        high = now - timedelta(seconds=lag)
+        frozen = None
+        if freeze_after:
+            frozen = frozen_before(now, freeze_after, adapter.metric_rollups)
+        known = dict(
+            conn.execute(select([marks.c.rollup, marks.c.watermark])).fetchall()
+        )
+        for seconds in adapter.metric_rollups:
+            label = width_label(seconds)
+            low = known.get(label) or ORIGIN
+            if low >= high:
+                continue
+            result = conn.execute(
+                refresh_statement(adapter, seconds, low, high, function, frozen)
+            )
+            mark = pg_insert(marks).values(rollup=label, watermark=high)
+            conn.execute(
+                mark.on_conflict_do_update(
+                    index_elements=["rollup"], set_={"watermark": high}
+                )
+            )
+            refreshed[label] = result.rowcount
+    logger.debug(f"Rollups refreshed up to {high}: {refreshed}")
+    return refreshed
+
+
+async def maintain_rollups(
+    adapter,
+    every: float = 30.0,
+    lag: float = 5.0,
+    function: str = "time_bucket",
+    freeze_after: float = 0,
+):
+    """Refresh the rollups every `every` seconds for as long as the server runs."""
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(every)
+        try:
+            await loop.run_in_executor(
+                None, refresh_rollups, adapter, lag, function, freeze_after
+            )
+        except Exception as e:
+            logger.exception(e)
@@ -0,0 +1,306 @@
+import asyncio
+import struct
+import threading
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from loguru import logger
+from sqlalchemy import and_
+from sqlalchemy import select
+
+from bodhi_server.measures.bulk import ColumnBatch
+from bodhi_server.measures.live import as_number
+from bodhi_server.measures.live import NUMERIC_COLUMNS
+from bodhi_server.measures.rollups import align
+from bodhi_server.measures.rollups import ORIGIN
+
+# version, compression, centroids, min, max. Then the means and the weights.
+HEADER = struct.Struct("<BHIdd")
+VERSION = 1
+SketchKey = Tuple[str, str, datetime]
+
+
+def compress(
+    means: np.ndarray, weights: np.ndarray, compression: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Merge sorted-or-not centroids down to about `compression` of them.
+
+    Every centroid is put in the group of the k-scale unit its midpoint falls
+    in. The scale is steep at the tails, so the extremes stay (nearly)
+    singletons while the middle gets lumped together. All of it is array
+    operations, however many digests went in.
+    """
+    order = np.argsort(means, kind="stable")
+    means, weights = means[order], weights[order]
+    cumulative = np.cumsum(weights)
+    q = (cumulative - weights / 2) / cumulative[-1]
+    k = compression * (np.arcsin(np.clip(2 * q - 1, -1, 1)) / np.pi + 0.5)
+    groups = np.floor(k).astype(np.int64)
+    starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+    merged = np.add.reduceat(weights, starts)
+    return np.add.reduceat(means * weights, starts) / merged, merged
+
+
+class TDigest:
+    """A t-digest. Mergeable quantile estimates in a few kilobytes.
+
+    Args:
+        compression (int, optional): Roughly the most centroids kept. More is more accurate. Defaults to 100.
+    """
+
+    __slots__ = ("compression", "means", "weights", "min", "max", "_pending")
+
+    def __init__(self, compression: int = 100):
+        self.compression = compression
+        self.means = np.empty(0, dtype=np.float64)
+        self.weights = np.empty(0, dtype=np.float64)
+        self.min = np.inf
+        self.max = -np.inf
+        self._pending: List[np.ndarray] = []
+
+    @property
+    def count(self) -> float:
+        self._flush()
+        return float(self.weights.sum())
+
+    def update(self, values: Iterable[float]) -> "TDigest":
+        values = np.asarray(values, dtype=np.float64)
+        values = values[np.isfinite(values)]
+        if values.size:
+            self._pending.append(values)
+            self.min = min(self.min, float(values.min()))
+            self.max = max(self.max, float(values.max()))
+            if sum(len(pending) for pending in self._pending) > 10 * self.compression:
+                self._flush()
+        return self
+
+    def _flush(self):
+        if not self._pending:
+            return
+        pending = np.concatenate(self._pending)
+        self._pending = []
+        self.means, self.weights = compress(
+            np.concatenate([self.means, pending]),
+            np.concatenate([self.weights, np.ones(len(pending))]),
+            self.compression,
+        )
+
+    @classmethod
+    def merge_all(
+        cls, digests: Sequence["TDigest"], compression: Optional[int] = None
+    ) -> "TDigest":
+        """One digest out of many, with a single sort and reduce."""
+        merged = cls(compression or max([d.compression for d in digests] or [100]))
+        for digest in digests:
+            digest._flush()
+        digests = [digest for digest in digests if digest.weights.size]
+        if digests:
+            merged.means, merged.weights = compress(
+                np.concatenate([digest.means for digest in digests]),
+                np.concatenate([digest.weights for digest in digests]),
+                merged.compression,
+            )
+            merged.min = min(digest.min for digest in digests)
+            merged.max = max(digest.max for digest in digests)
+        return merged
+
+    def quantiles(self, qs: Iterable[float]) -> List[Optional[float]]:
+        """Estimates of every quantile in `qs` (0 to 1). None when it's empty."""
+        self._flush()
+        qs = np.clip(np.asarray(list(qs), dtype=np.float64), 0, 1)
+        if not self.weights.size:
+            return [None] * len(qs)
+        cumulative = np.cumsum(self.weights)
+        total = cumulative[-1]
+        # Each centroid's mass sits around its middle. min and max pin the ends.
+        positions = np.r_[0.0, cumulative - self.weights / 2, total]
+        means = np.r_[self.min, self.means, self.max]
+        return np.interp(qs * total, positions, means).tolist()
+
+    def quantile(self, q: float) -> Optional[float]:
+        return self.quantiles([q])[0]
+
+    def to_bytes(self) -> bytes:
+        self._flush()
+        header = HEADER.pack(
+            VERSION, self.compression, len(self.means), self.min, self.max
+        )
+        return header + self.means.tobytes() + self.weights.tobytes()
+
+    @classmethod
+    def from_bytes(cls, blob: bytes) -> "TDigest":
+        version, compression, size, low, high = HEADER.unpack_from(blob)
+        if version != VERSION:
+            raise ValueError(f"Unknown t-digest version {version}")
+        digest = cls(compression)
+        body = np.frombuffer(blob, dtype=np.float64, offset=HEADER.size)
+        if body.size != 2 * size:
+            raise ValueError("Truncated t-digest")
+        digest.means, digest.weights = body[:size].copy(), body[size:].copy()
+        digest.min, digest.max = low, high
+        return digest
+
+
+class SketchBuffer:
+    """Values waiting to be sketched, per (subject, name, time bucket).
+
+    `drain` turns each bucket's values into a digest. The digests are
+    written as new rows, so concurrent servers never fight over one and a
+    bucket's rows are merged when it's read. That also makes a failed write
+    easy to retry: its rows are put back as they are (see `requeue`).
+
+    Args:
+        seconds (int, optional): Width of a bucket. Defaults to 60.
+        compression (int, optional): The digests' compression. Defaults to 100.
+    """
+
+    def __init__(self, seconds: int = 60, compression: int = 100):
+        self.seconds = seconds
+        self.compression = compression
+        # Single values from /measure, arrays from /measure/bulk
+        self._values: Dict[SketchKey, list] = defaultdict(list)
+        # Digests whose write failed, sent again with the next drain
+        self._unsaved: List[dict] = []
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._values) + len(self._unsaved)
+
+    def bucket(self, moment: datetime) -> datetime:
+        if moment.tzinfo is None:
+            moment = moment.replace(tzinfo=timezone.utc)
+        return align(moment, self.seconds)
+
+    def add(self, subject: str, values: Dict[str, object], clock_at: datetime):
+        bucket = self.bucket(clock_at)
+        numbers = [(name, as_number(value)) for name, value in values.items()]
+        with self._lock:
+            for name, number in numbers:
+                if number is not None:
+                    self._values[(subject, name, bucket)].append(number)
+
+    def add_batch(self, batch: ColumnBatch):
+        """A /measure/bulk grid. Ticks are split into buckets once, for every name."""
+        offsets = (batch.clock - ORIGIN.timestamp()) // self.seconds
+        buckets, inverse = np.unique(offsets, return_inverse=True)
+        width = timedelta(seconds=self.seconds)
+        starts = [ORIGIN + width * int(offset) for offset in buckets]
+        # Ticks in bucket order, and where each bucket ends
+        order = np.argsort(inverse, kind="stable")
+        ends = np.cumsum(np.bincount(inverse))[:-1]
+        split = []
+        for index, name in enumerate(batch.names):
+            _, target, column = batch.typed_column(index)
+            if target in NUMERIC_COLUMNS:
+                numbers = np.asarray(column, dtype=np.float64)
+            elif target:
+                # Text
+                continue
+            else:
+                mixed = (as_number(value) for value in column)
+                numbers = np.array(
+                    [np.nan if number is None else number for number in mixed]
+                )
+            for start, chunk in zip(starts, np.split(numbers[order], ends)):
+                split.append(((batch.subject, name, start), chunk))
+        with self._lock:
+            for key, chunk in split:
+                self._values[key].append(chunk)
+
+    def drain(self) -> List[dict]:
+        """Rows for `metric_sketches`, one per bucket with new values."""
+        with self._lock:
+            pending, self._values = self._values, defaultdict(list)
+            rows, self._unsaved = self._unsaved, []
+        for (subject, name, bucket), chunks in pending.items():
+            values = np.concatenate([np.atleast_1d(chunk) for chunk in chunks])
+            digest = TDigest(self.compression).update(values)
+            if not digest.count:
+                continue
+            rows.append(
+                {
+                    "subject": subject,
+                    "name": name,
+                    "bucket": bucket,
+                    "count": int(digest.count),
+                    "digest": digest.to_bytes(),
+                }
+            )
+        return rows
+
+    def requeue(self, rows: Iterable[dict]):
+        # A failed flush gets retried next time.
+        with self._lock:
+            self._unsaved.extend(rows)
+
+
+def flush_sketches(adapter, buffer: SketchBuffer) -> int:
+    """Write the buffered digests. Returns the number of rows."""
+    rows = buffer.drain()
+    if not rows:
+        return 0
+    try:
+        with adapter.engine.begin() as conn:
+            conn.execute(adapter.metric_sketches.insert(), rows)
+    except Exception:
+        buffer.requeue(rows)
+        raise
+    return len(rows)
+
+
+async def maintain_sketches(adapter, buffer: SketchBuffer, every: float = 10.0):
+    """Flush the sketch buffer every `every` seconds for as long as the server runs."""
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(every)
+        try:
+            await loop.run_in_executor(None, flush_sketches, adapter, buffer)
+        except Exception as e:
+            logger.exception(e)
+
+
+def sketch_query(adapter, subject: str, names: Sequence[str], start, end):
+    sketches = adapter.metric_sketches.c
+    return select([sketches.name, sketches.digest]).where(
+        and_(
+            sketches.subject == subject,
+            sketches.name.in_(list(names)),
+            sketches.bucket >= start,
+            sketches.bucket < end,
+        )
+    )
+
+
+def range_quantiles(
+    adapter,
+    *,
+    subject: str,
+    names: Sequence[str],
+    start: datetime,
+    end: datetime,
+    quantiles: Sequence[float],
+    seconds: int = 60,
+) -> Dict[str, dict]:
+    """Quantiles of each name over a time range, from its merged sketches.
+
+    The range is widened to whole sketch buckets.
+    """
+    start, end = align(start, seconds), align(end, seconds, up=True)
+    digests: Dict[str, List[TDigest]] = defaultdict(list)
+    with adapter.engine.connect() as conn:
+        rows = conn.execute(sketch_query(adapter, subject, names, start, end))
+        for name, blob in rows:
+            digests[name].append(TDigest.from_bytes(bytes(blob)))
+    answer = {}
+    for name, found in digests.items():
+        merged = TDigest.merge_all(found)
+        estimates = merged.quantiles(quantiles)
+        answer[name] = {
+            "count": int(merged.count),
+            "min": merged.min,
+            "max": merged.max,
+            "quantiles": {str(q): value for q, value in zip(quantiles, estimates)},
+        }
+    return answer
@@ -0,0 +1,38 @@
+from typing import Any, Dict, Optional
+
+import orjson
+
+# One column per storage type. Exactly one of them is set on a row (none for nulls).
+VALUE_COLUMNS = ("value_float", "value_int", "value_bool", "value_text")
+METRIC_LAYOUTS = ("text", "typed")
+INT64_MIN, INT64_MAX = -(1 << 63), (1 << 63) - 1
+
+
+def value_column(value: Any) -> Optional[str]:
+    """The typed column `value` belongs in."""
+    # bool first. It's a subclass of int.
+    if isinstance(value, bool):
+        return "value_bool"
+    if isinstance(value, int):
+        return "value_int" if INT64_MIN <= value <= INT64_MAX else "value_text"
+    if isinstance(value, float):
+        return "value_float"
+    if value is None:
+        return None
+    return "value_text"
+
+
+def typed_value(value: Any) -> Dict[str, Any]:
+    """Spread a single value over the typed columns.
+
+    Returns:
+        Dict[str, Any]: Every one of `VALUE_COLUMNS` plus `val_type`.
+    """
+    row = dict.fromkeys(VALUE_COLUMNS)
+    row["val_type"] = type(value).__name__
+    column = value_column(value)
+    if column == "value_text" and not isinstance(value, str):
+        value = str(value) if isinstance(value, int) else orjson.dumps(value, default=str).decode()
+    if column is not None:
+        row[column] = value
+    return row
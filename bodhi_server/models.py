@@ -1,13 +1,16 @@
 from datetime import datetime
 from typing import Any, Dict, Union
 
+from pydantic import Field
+
 from bodhi_server.core import FlexibleModel
+from bodhi_server.measures.typed import typed_value
 
 
 class Measurement(FlexibleModel):
     tags: Dict[str, Any] = {}
     clock_at: datetime
-    created_at: datetime = datetime.now()
+    created_at: datetime = Field(default_factory=datetime.now)
     subject: str
     value: str
     dtype: str
@@ -27,15 +30,31 @@ class Measurement(FlexibleModel):
 class MeasureSet(FlexibleModel):
     tags: Dict[str, Any] = {}
     clock_at: datetime
-    created_at: datetime = datetime.now()
+    created_at: datetime = Field(default_factory=datetime.now)
     subject: str
     values: Dict[str, Any] = {}
 
-    def get_insertable(self):
-        """Return a list of insertable values. To insert values in a batch."""
+    def get_insertable(self, layout: str = "text"):
+        """Return a list of insertable values. To insert values in a batch.
+
+        Args:
+            layout (str, optional): The metrics layout we're inserting into. With "typed"
+                every value goes into the column for its type, and postgres sets
+                `created_at` (the rollups' watermark goes by it). Defaults to "text".
+        """
         measures_with_timestamps = []
         if not self.values:
             raise ValueError("Values cannot be empty")
+        if layout == "typed":
+            return [
+                {
+                    "subject": self.subject,
+                    "name": name,
+                    "clock_at": self.clock_at,
+                    **typed_value(val),
+                }
+                for name, val in self.values.items()
+            ]
         for name, val in self.values.items():
             measure = Measurement(
                 name=name,
@@ -0,0 +1,251 @@
+import asyncio
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, List, Literal, Optional, Set, Tuple
+
+from loguru import logger
+
+import xxhash
+from sqlalchemy import select
+from sqlalchemy import text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import ProgrammingError
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.schema import DDLElement
+
+from bodhi_server.timescale import create_hypertable
+
+Interval = Literal["day", "week", "month"]
+Bounds = Tuple[str, datetime, datetime]
+# How `kernel` (and `event_log`) get laid out on disk.
+PARTITION_MODES = ("none", "range", "hypertable", "list")
+TIME_PARTITIONED = ("range", "hypertable")
+BUCKET_PARTITIONED = ("list",)
+IS_HYPERTABLE = text(
+    "SELECT EXISTS (SELECT 1 FROM timescaledb_information.hypertables "
+    "WHERE hypertable_name = :name)"
+)
+
+
+class CreateRangePartition(DDLElement):
+    def __init__(self, parent: str, name: str, start: datetime, end: datetime):
+        self.parent = parent
+        self.name = name
+        self.start = start
+        self.end = end
+
+
+@compiles(CreateRangePartition)
+def compile_range_partition(element: CreateRangePartition, compiler, **kw):
+    return (
+        f"CREATE TABLE IF NOT EXISTS {element.name} PARTITION OF {element.parent} "
+        f"FOR VALUES FROM ('{element.start.isoformat()}') TO ('{element.end.isoformat()}')"
+    )
+
+
+class CreateListPartition(DDLElement):
+    def __init__(self, parent: str, name: str, value: str):
+        self.parent = parent
+        self.name = name
+        self.value = value
+
+
+@compiles(CreateListPartition)
+def compile_list_partition(element: CreateListPartition, compiler, **kw):
+    value = element.value.replace("'", "''")
+    return (
+        f"CREATE TABLE IF NOT EXISTS {element.name} PARTITION OF {element.parent} "
+        f"FOR VALUES IN ('{value}')"
+    )
+
+
+class CreateDefaultPartition(DDLElement):
+    def __init__(self, parent: str):
+        self.parent = parent
+        self.name = f"{parent}_default"
+
+
+@compiles(CreateDefaultPartition)
+def compile_default_partition(element: CreateDefaultPartition, compiler, **kw):
+    return (
+        f"CREATE TABLE IF NOT EXISTS {element.name} PARTITION OF {element.parent} DEFAULT"
+    )
+
+
+def window_start(moment: datetime, interval: Interval) -> datetime:
+    """The start of the partition window `moment` falls into (in UTC)."""
+    moment = moment.astimezone(timezone.utc) if moment.tzinfo else moment
+    day = moment.replace(hour=0, minute=0, second=0, microsecond=0, tzinfo=timezone.utc)
+    if interval == "day":
+        return day
+    if interval == "week":
+        return day - timedelta(days=day.weekday())
+    if interval == "month":
+        return day.replace(day=1)
+    raise ValueError(f"Unknown partition interval {interval}")
+
+
+def next_window(start: datetime, interval: Interval) -> datetime:
+    if interval == "day":
+        return start + timedelta(days=1)
+    if interval == "week":
+        return start + timedelta(weeks=1)
+    if start.month == 12:
+        return start.replace(year=start.year + 1, month=1)
+    return start.replace(month=start.month + 1)
+
+
+def range_partitions(
+    parent: str,
+    interval: Interval = "month",
+    ahead: int = 3,
+    now: Optional[datetime] = None,
+) -> List[Bounds]:
+    """The current window plus `ahead` windows after it.
+
+    Returns:
+        List[Bounds]: (partition name, start, end) for every window.
+    """
+    start = window_start(now or datetime.now(timezone.utc), interval)
+    bounds = []
+    for _ in range(ahead + 1):
+        end = next_window(start, interval)
+        bounds.append((f"{parent}_p{start:%Y%m%d}", start, end))
+        start = end
+    return bounds
+
+
+def ensure_time_partitions(
+    engine: Engine,
+    parent: str,
+    interval: Interval = "month",
+    ahead: int = 3,
+    now: Optional[datetime] = None,
+) -> List[str]:
+    """Create the range partitions of `parent` ahead of time. Safe to run repeatedly.
+
+    A default partition catches rows outside the windows (backfills mostly).
+
+    Returns:
+        List[str]: The partitions we made sure of.
+    """
+    names = []
+    with engine.begin() as conn:
+        conn.execute(CreateDefaultPartition(parent))
+        for name, start, end in range_partitions(parent, interval, ahead, now):
+            conn.execute(CreateRangePartition(parent, name, start, end))
+            names.append(name)
+    logger.debug(f"Partitions ready for {parent}: {names}")
+    return names
+
+
+def ensure_hypertable(
+    engine: Engine, table: str, column: str = "event_at", interval: Interval = "month"
+) -> bool:
+    """Turn `table` into a hypertable, unless it already is one. Safe to run repeatedly.
+
+    Raises:
+        RuntimeError: Timescale isn't installed, or the table already has rows.
+            Moving them into chunks (`migrate_data`) locks the table for as long
+            as it takes, so that's left to whoever runs the database.
+
+    Returns:
+        bool: True when the table was converted just now.
+    """
+    with engine.begin() as conn:
+        try:
+            known = conn.execute(IS_HYPERTABLE, name=table).scalar()
+        except ProgrammingError as e:
+            raise RuntimeError(
+                "Hypertable partitioning needs the timescaledb extension"
+            ) from e
+        if known:
+            return False
+        if conn.execute(text(f'SELECT 1 FROM "{table}" LIMIT 1')).first():
+            raise RuntimeError(
+                f"{table} already has rows, so it can't become a hypertable "
+                f"on startup. Convert it once with SELECT create_hypertable("
+                f"'{table}', '{column}', migrate_data => TRUE), or keep "
+                "BODHI_KERNEL_PARTITIONING at its old value."
+            )
+        hypertable = create_hypertable(
+            table, column, chunk_time_interval=f"1 {interval}", if_not_exists=True
+        )
+        conn.execute(select([hypertable]))
+    logger.debug(f"{table} is now a hypertable")
+    return True
+
+
+async def maintain_partitions(adapter, every: float = 3600.0):
+    """Keep creating upcoming partitions for as long as the server runs.
+
+    Args:
+        adapter (MetaTableAdapter): The adapter whose `prepare_partitions` we call.
+        every (float, optional): Seconds between runs. Defaults to an hour.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(every)
+        try:
+            await loop.run_in_executor(None, adapter.prepare_partitions)
+        except Exception as e:
+            logger.exception(e)
+
+
+class BucketPartitions:
+    """Creates a LIST partition of `kernel` the first time we see a bucket.
+
+    The buckets we've already taken care of are remembered in process, so the
+    steady state costs a set lookup. Anything that slips through (another
+    process racing us, a failed create) lands in the default partition.
+
+    Args:
+        parent (str, optional): The partitioned table. Defaults to "kernel".
+    """
+
+    def __init__(self, parent: str = "kernel"):
+        self.parent = parent
+        self._known: Set[str] = set()
+        self._lock = threading.Lock()
+
+    def __contains__(self, bucket: str) -> bool:
+        return bucket in self._known
+
+    def partition_name(self, bucket: str) -> str:
+        # Identifiers top out at 63 characters and buckets can be anything.
+        readable = "".join(c if c.isalnum() else "_" for c in bucket.lower())[:32]
+        return f"{self.parent}_b_{readable}_{xxhash.xxh32_hexdigest(bucket.encode())}"
+
+    def ddl(self, bucket: str) -> str:
+        element = CreateListPartition(self.parent, self.partition_name(bucket), bucket)
+        return str(element.compile(dialect=postgresql.dialect()))
+
+    def missing(self, buckets: Iterable[str]) -> List[str]:
+        return sorted(set(buckets) - self._known)
+
+    def prepare(self, engine: Engine):
+        with engine.begin() as conn:
+            conn.execute(CreateDefaultPartition(self.parent))
+
+    def ensure(self, engine: Engine, buckets: Iterable[str]):
+        """Make sure every bucket has its partition, using a sqlalchemy engine."""
+        missing = self.missing(buckets)
+        if not missing:
+            return
+        with self._lock:
+            for bucket in self.missing(missing):
+                try:
+                    engine.execute(self.ddl(bucket))
+                except Exception as e:
+                    logger.warning(f"Couldn't create the partition for {bucket}: {e}")
+                self._known.add(bucket)
+
+    async def ensure_async(self, conn, buckets: Iterable[str]):
+        """Same as `ensure`, with an asyncpg connection."""
+        for bucket in self.missing(buckets):
+            try:
+                await conn.execute(self.ddl(bucket))
+            except Exception as e:
+                logger.warning(f"Couldn't create the partition for {bucket}: {e}")
+            self._known.add(bucket)
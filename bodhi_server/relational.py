@@ -1,3 +1,4 @@
+from datetime import datetime
 from typing import Any, Dict, List, Optional
 
 from devtools import debug
@@ -44,6 +45,8 @@ class TablesAndRels(FlexibleModel):
 
 
 class Field(Component):
+    __slots__ = ()
+
     def __init__(self, field_type: str, aggregate: str = "sum", **attrs):
         super().__init__("field", **attrs)
         # aggregate = aggregate.upper()
@@ -55,10 +58,13 @@ class Field(Component):
 
     def create(self, field_name: str):
         self._name = field_name
+        self._invalidate()
         return self
 
 
 class Table(Entity):
+    __slots__ = ()
+
     def __init__(self, table_name: str, **attrs):
         super().__init__("table", name=table_name, **attrs)
 
@@ -130,11 +136,17 @@ class SQLVisitor(Visitor):
         return self.local_tables_two
 
 
-def plan_sql(dag_system: System) -> str:
+def plan_sql(
+    dag_system: System,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+) -> str:
     """Execute SQLAlchemy plan for the given Dag system .
 
     Args:
         dag_system (System): Use dag system to generate SQLAlchemy code.
+        start (Optional[datetime], optional): Lower `event_at` bound for every view. Defaults to None.
+        end (Optional[datetime], optional): Upper `event_at` bound for every view. Defaults to None.
     """
     _base_table_adapter = _init_tables()
     sql_planner: SQLVisitor = SQLVisitor(dag_system)
@@ -143,7 +155,7 @@ def plan_sql(dag_system: System) -> str:
     table_set, relation_set = table_and_rels.tables, table_and_rels.relationships
     sql_commands = []
     for table in table_set:
-        _table = build_view(table, _base_table_adapter)
+        _table = build_view(table, _base_table_adapter, start=start, end=end)
         sql_commands.append(_table)
 
     for _table in sql_commands:
@@ -61,7 +61,7 @@ class TraversalManager(FlexibleModel):
         return self.system.net
 
     def node_name(self, node_id: str) -> str:
-        return self.network.nodes[node_id]["name"]
+        return self.system.get_node(node_id)["name"]
 
     def node_names(self, node_id_list: List[str]) -> List[str]:
         name_list = []
@@ -78,25 +78,24 @@ class TraversalManager(FlexibleModel):
         Returns:
             ChildParentsResponse: Both the child and all parents.
         """
-        subgraph = get_parent_subgraph(child_id, self.network)
+        subgraph = self.system.subgraph([*self.system.predecessors(child_id), child_id])
         json_subgraph, root = get_shortest_topograph(subgraph)
         json_path = nx.shortest_path(json_subgraph, root, child_id)
         subgraph.remove_node(child_id)
         sub_nodes = dict(subgraph.nodes(data=True))
 
         return ChildParentsResponse(
-            child={child_id: self.network.nodes[child_id]},
+            child={child_id: self.system.get_node(child_id)},
             parents=sub_nodes,
             json_path=self.node_names(json_path),
             root_id=root,
         )
 
     def children(self, parent_id: str):
-        succs = self.network.successors(parent_id)
-        subgraph = self.network.subgraph(succs).copy()
+        subgraph = self.system.subgraph(self.system.direct_successors(parent_id))
         sub_nodes = dict(subgraph.nodes(data=True))
         return ParentChildResponse(
-            parent={parent_id: self.network.nodes[parent_id]}, children=sub_nodes
+            parent={parent_id: self.system.get_node(parent_id)}, children=sub_nodes
         )
 
     def everything(self, node_id: str):
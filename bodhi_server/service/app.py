@@ -1,23 +1,48 @@
+import asyncio
 from datetime import datetime
-from typing import Any, Dict, Optional
+from typing import Any, Dict, List, Optional
 
 from devtools import debug
 from inflection import tableize
 from loguru import logger
 
 from addict import Addict as DDict
-from fastapi import FastAPI, Response
+from fastapi import FastAPI, Header, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from pydantic import root_validator
-from bodhi_server import commands, models
+from bodhi_server import commands, connection, models
 from bodhi_server import circular as circle
 from bodhi_server import settings
+from bodhi_server.circular import BatchResponse
+from bodhi_server.circular import BulkMeasureResponse
 from bodhi_server.circular import DBResponse
-from bodhi_server.settings import ModuleSettings
+from bodhi_server.circular import StreamResponse
+from bodhi_server.ingestion import NDJSON_TYPES
+from bodhi_server.measures import MeasureColumns
+from bodhi_server.measures import MeasureQuery
+from bodhi_server.measures import QuantileQuery
+from bodhi_server.measures.chunks import check_compaction
+from bodhi_server.measures.chunks import maintain_chunks
+from bodhi_server.measures.live import maintain_snapshots
+from bodhi_server.measures.live import snapshot_live_stats
+from bodhi_server.measures.rollups import maintain_rollups
+from bodhi_server.measures.sketch import flush_sketches
+from bodhi_server.measures.sketch import maintain_sketches
+from bodhi_server.partitions import maintain_partitions
+from bodhi_server.settings import get_settings
 from bodhi_server.utils import InsertParameters
 from bodhi_server.service.routers import chat
 
-settings_root = ModuleSettings()
+settings_root = get_settings()
+# Attributes of `app.state` holding the maintenance loops started with the app.
+BACKGROUND_TASKS = (
+    "partition_task",
+    "rollup_task",
+    "snapshot_task",
+    "sketch_task",
+    "compact_task",
+)
 
 app = FastAPI()
 app.include_router(chat.router, prefix="/chat", tags=["websocket", "broadcast"])
@@ -29,11 +54,92 @@ async def start_databases():
     table = circle.init()
     logger.error(settings_root.postgres_connection_str)
     logger.info(table)
+    if table.partitioning == "range":
+        app.state.partition_task = asyncio.create_task(
+            maintain_partitions(table, settings_root.partitions.maintenance_seconds)
+        )
+    app.state.snapshot_task = asyncio.create_task(
+        maintain_snapshots(
+            table, commands.LIVE_STATS, settings_root.metrics.live_snapshot_seconds
+        )
+    )
+    app.state.sketch_task = asyncio.create_task(
+        maintain_sketches(
+            table, commands.SKETCHES, settings_root.metrics.sketch_flush_seconds
+        )
+    )
+    if table.metric_rollups:
+        app.state.rollup_task = asyncio.create_task(
+            maintain_rollups(
+                table,
+                settings_root.metrics.rollup_refresh_seconds,
+                settings_root.metrics.rollup_lag_seconds,
+                settings_root.metrics.bucket_function,
+                settings_root.metrics.compact_after_seconds,
+            )
+        )
+    if table.metric_rollups and settings_root.metrics.compact_after_seconds:
+        check_compaction(table)
+        app.state.compact_task = asyncio.create_task(
+            maintain_chunks(
+                table,
+                settings_root.metrics.compact_every_seconds,
+                settings_root.metrics.compact_after_seconds,
+                settings_root.metrics.chunk_seconds,
+            )
+        )
+
+
+@app.on_event("shutdown")
+async def stop_databases():
+    for name in BACKGROUND_TASKS:
+        task = getattr(app.state, name, None)
+        if task is not None:
+            task.cancel()
+    try:
+        # Whatever changed since the last periodic write
+        snapshot_live_stats(commands.get_db(), commands.LIVE_STATS)
+        flush_sketches(commands.get_db(), commands.SKETCHES)
+    except Exception as e:
+        logger.exception(e)
+    commands.close_buffer()
+    await connection.close()
 
 
 @app.post("/insert", response_model=DBResponse)
-def insert_item(item: InsertParameters):
-    return commands.ingest_data(**item.dict())
+def insert_item(
+    item: InsertParameters,
+    wait: bool = True,
+    idempotency_key: Optional[str] = Header(None),
+):
+    # wait=false returns before the record's group commit lands.
+    params = item.dict()
+    if idempotency_key is not None:
+        params["idempotency_key"] = idempotency_key
+    return commands.ingest_data(**params, wait=wait)
+
+
+@app.post("/insert/batch", response_model=BatchResponse)
+async def insert_batch(items: List[Dict[str, Any]]):
+    # Each item is validated as `InsertParameters` inside the command. A single
+    # bad record shouldn't 422 the whole batch.
+    return await commands.ingest_batch(items)
+
+
+@app.post("/insert/stream", response_model=StreamResponse)
+async def insert_stream(request: Request):
+    # Read the raw body as it arrives. Never parsed as one big pydantic model.
+    content_type = request.headers.get("content-type", "")
+    if not content_type.startswith(NDJSON_TYPES):
+        raise HTTPException(
+            status_code=415, detail="Send the records as application/x-ndjson"
+        )
+    return await commands.ingest_stream(request.stream())
+
+
+@app.get("/stats")
+def get_stats():
+    return commands.stats()
 
 
 @app.post("/measure")
@@ -41,3 +147,29 @@ def record_measurement(measurements: models.MeasureSet, response: Response):
     commands.measure_many(measurements)
     response.status_code = 200
     return measurements
+
+
+@app.post("/measure/bulk", response_model=BulkMeasureResponse)
+async def record_measurement_columns(measurements: MeasureColumns):
+    # Columns in, one COPY out. No model per point.
+    return await commands.measure_bulk(measurements)
+
+
+@app.get("/measure/live")
+def live_measurements(subject: str, names: Optional[List[str]] = Query(None)):
+    # Running stats since the server started (or the last snapshot it restored).
+    return commands.live_measures(subject, names)
+
+
+@app.post("/measure/quantiles")
+def measurement_quantiles(query: QuantileQuery):
+    # Merges the stored sketches. The raw points aren't read or sorted.
+    return commands.measure_quantiles(query)
+
+
+@app.post("/measure/query")
+async def query_measurements(query: MeasureQuery):
+    # NDJSON, written as the cursor moves. The whole result is never in memory.
+    return StreamingResponse(
+        commands.query_measures(query), media_type="application/x-ndjson"
+    )
@@ -3,10 +3,10 @@ from typing import List
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, APIRouter
 from fastapi.responses import HTMLResponse
 
-from bodhi_server.settings import ModuleSettings
+from bodhi_server.settings import get_settings
 from fastapi_websocket_pubsub import PubSubEndpoint
 
-settings = ModuleSettings()
+settings = get_settings()
 
 router = APIRouter()
 endpoint = PubSubEndpoint(broadcaster=settings.postgres_connection_str)
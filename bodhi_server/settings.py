@@ -1,10 +1,10 @@
 import os
+from functools import lru_cache
 from typing import Dict, Optional, Tuple
 
 from devtools import debug
 
 from addict import Dict as Add
-from faker import Faker
 from pydantic import BaseSettings
 from pydantic import Field
 from pydantic import PostgresDsn
@@ -12,13 +12,20 @@ from pydantic import root_validator
 from pydantic.env_settings import SettingsSourceCallable
 
 
-fake = Faker()
+@lru_cache(maxsize=None)
+def random_graph_name() -> str:
+    # Faker is slow to import. Only load it when no graph name was configured.
+    from faker import Faker
+
+    return Faker().cryptocurrency_name()
 
 
 class EnvPrioritySettings(BaseSettings):
     class Config:
         case_sensitive = False
         env_file = ".env"
+        # Settings are read once, on startup. Nothing changes them afterwards.
+        allow_mutation = False
 
         @classmethod
         def customise_sources(
@@ -156,25 +163,178 @@ class ArangoSettings(EnvPrioritySettings):
     database: Optional[str] = Field("test", env="ARANOGO_DATABASE")
     user: Optional[str] = Field("root", env="ARANOGO_USER")
     password: Optional[str] = Field("8uLiSAXHM0g7t1Hjoo27", env="ARANOGO_PASSWORD")
-    graph_name: Optional[str] = Field(
-        default_factory=lambda: fake.cryptocurrency_name(), env="ARANOGO_GRAPH_NAME"
-    )
+    graph_name: Optional[str] = Field(None, env="ARANOGO_GRAPH_NAME")
+
+    @property
+    def graph(self) -> str:
+        return self.graph_name or random_graph_name()
 
     @property
     def url(self):
         return f"{self.scheme}://{self.host}:{self.port}"
 
 
+class IngestSettings(EnvPrioritySettings):
+    # Group commit records into `kernel` instead of one insert per request.
+    # Off by default: /insert?wait=false only returns early with it on.
+    buffered: bool = Field(False, env="BODHI_INGEST_BUFFERED")
+    buffer_size: int = Field(500, env="BODHI_INGEST_BUFFER_SIZE")
+    linger_ms: float = Field(10.0, env="BODHI_INGEST_LINGER_MS")
+    # NDJSON streaming
+    stream_batch_size: int = Field(1000, env="BODHI_STREAM_BATCH_SIZE")
+    stream_max_line_bytes: int = Field(1 << 20, env="BODHI_STREAM_MAX_LINE_BYTES")
+    stream_max_errors: int = Field(100, env="BODHI_STREAM_MAX_ERRORS")
+    # Derive an idempotency key from the record's content when the client didn't send one.
+    dedup: bool = Field(False, env="BODHI_INGEST_DEDUP")
+    dedup_recent: int = Field(100_000, env="BODHI_DEDUP_RECENT")
+    # Schemas of arrays longer than the cap are inferred from a sample: the
+    # first `infer_array_head` items and a random pick of the rest. 0 reads every item.
+    infer_array_cap: int = Field(1000, env="BODHI_INFER_ARRAY_CAP")
+    infer_array_head: int = Field(100, env="BODHI_INFER_ARRAY_HEAD")
+
+
+class PartitionSettings(EnvPrioritySettings):
+    # none | range | hypertable | list. Only takes effect when kernel is first created.
+    partitioning: str = Field("none", env="BODHI_KERNEL_PARTITIONING")
+    partition_interval: str = Field("month", env="BODHI_PARTITION_INTERVAL")
+    partitions_ahead: int = Field(3, env="BODHI_PARTITIONS_AHEAD")
+    # How often the server makes sure upcoming partitions exist.
+    maintenance_seconds: float = Field(3600.0, env="BODHI_PARTITION_MAINTENANCE")
+
+    @property
+    def table_options(self) -> dict:
+        return self.dict(exclude={"maintenance_seconds"})
+
+
+class MetricSettings(EnvPrioritySettings):
+    # text | typed. typed stores numbers as numbers and keeps `metrics` as a view.
+    # There's no migration yet: typed is for new databases, where `metrics`
+    # isn't already a table.
+    layout: str = Field("text", env="BODHI_METRICS_LAYOUT")
+    # Keep the `metrics` view for old readers (typed only). Turn it off to compact.
+    view: bool = Field(True, env="BODHI_METRICS_VIEW")
+    # The most points a single /measure/bulk request can carry.
+    bulk_max_points: int = Field(1_000_000, env="BODHI_MEASURE_BULK_MAX_POINTS")
+    # Rollup widths, like "1m,1h,1d". Empty turns rollups off.
+    rollups: str = Field("1m,1h,1d", env="BODHI_METRIC_ROLLUPS")
+    rollup_refresh_seconds: float = Field(30.0, env="BODHI_ROLLUP_REFRESH_SECONDS")
+    rollup_lag_seconds: float = Field(5.0, env="BODHI_ROLLUP_LAG_SECONDS")
+    # date_bin (postgres 14+) | time_bucket (needs the timescaledb extension)
+    bucket_function: str = Field("date_bin", env="BODHI_BUCKET_FUNCTION")
+    # /measure/query: the most buckets per name, and rows fetched per round trip.
+    query_max_buckets: int = Field(100_000, env="BODHI_MEASURE_QUERY_MAX_BUCKETS")
+    query_prefetch: int = Field(1000, env="BODHI_MEASURE_QUERY_PREFETCH")
+    # Live stats: how often the changed series are written to metric_stats.
+    live_snapshot_seconds: float = Field(10.0, env="BODHI_LIVE_SNAPSHOT_SECONDS")
+    # Quantile sketches: bucket width, t-digest compression, seconds between writes
+    sketch_seconds: int = Field(60, env="BODHI_SKETCH_SECONDS")
+    sketch_compression: int = Field(100, env="BODHI_SKETCH_COMPRESSION")
+    sketch_flush_seconds: float = Field(10.0, env="BODHI_SKETCH_FLUSH_SECONDS")
+    # Points older than this are compacted into chunks. 0 keeps every point raw.
+    # Needs rollups, and the `metrics` view off: it only reads points still raw.
+    compact_after_seconds: float = Field(0.0, env="BODHI_COMPACT_AFTER_SECONDS")
+    chunk_seconds: int = Field(7200, env="BODHI_CHUNK_SECONDS")
+    compact_every_seconds: float = Field(3600.0, env="BODHI_COMPACT_EVERY_SECONDS")
+
+    @property
+    def rollup_widths(self) -> Tuple[int, ...]:
+        from bodhi_server.measures.rollups import parse_widths
+
+        return parse_widths(self.rollups)
+
+    @property
+    def table_options(self) -> dict:
+        return {
+            "metrics_layout": self.layout,
+            "metric_rollups": self.rollup_widths,
+            "metrics_view": self.view,
+        }
+
+
+class EngineSettings(EnvPrioritySettings):
+    # The sqlalchemy pool, shared by everything in the process.
+    pool_size: int = Field(5, env="BODHI_PG_POOL_SIZE")
+    max_overflow: int = Field(10, env="BODHI_PG_MAX_OVERFLOW")
+    pool_timeout: float = Field(30.0, env="BODHI_PG_POOL_TIMEOUT")
+    pool_recycle: int = Field(1800, env="BODHI_PG_POOL_RECYCLE")
+    pre_ping: bool = Field(True, env="BODHI_PG_PRE_PING")
+    # The asyncpg pool used for COPY
+    async_min_size: int = Field(1, env="BODHI_PG_ASYNC_MIN_SIZE")
+    async_max_size: int = Field(10, env="BODHI_PG_ASYNC_MAX_SIZE")
+    # Applies to every connection in both pools. 0 turns it off.
+    statement_timeout_ms: int = Field(30_000, env="BODHI_PG_STATEMENT_TIMEOUT_MS")
+
+    @property
+    def server_settings(self) -> Dict[str, str]:
+        if not self.statement_timeout_ms:
+            return {}
+        return {"statement_timeout": str(self.statement_timeout_ms)}
+
+    @property
+    def engine_options(self) -> dict:
+        options = dict(
+            pool_size=self.pool_size,
+            max_overflow=self.max_overflow,
+            pool_timeout=self.pool_timeout,
+            pool_recycle=self.pool_recycle,
+            pool_pre_ping=self.pre_ping,
+        )
+        if self.server_settings:
+            flags = " ".join(f"-c {k}={v}" for k, v in self.server_settings.items())
+            options["connect_args"] = {"options": flags}
+        return options
+
+
+class CacheSettings(EnvPrioritySettings):
+    # How long a bucket's known schema hashes are trusted before asking arango again.
+    schema_ttl: float = Field(300.0, env="BODHI_SCHEMA_CACHE_TTL")
+    # Bounds of each memoized function in graph_database.utilz
+    memo_entries: int = Field(4096, env="BODHI_MEMO_MAX_ENTRIES")
+    memo_bytes: int = Field(64 << 20, env="BODHI_MEMO_MAX_BYTES")
+    # Planned views, by schema
+    plan_entries: int = Field(256, env="BODHI_PLAN_CACHE_ENTRIES")
+    plan_bytes: int = Field(16 << 20, env="BODHI_PLAN_CACHE_BYTES")
+
+
+class PlanSettings(EnvPrioritySettings):
+    # Graph library behind `System`: networkx | retworkx
+    graph_backend: str = Field("networkx", env="BODHI_GRAPH_BACKEND")
+
+
 class APIKeys(EnvPrioritySettings):
     news_api: str = Field(..., env="NEWSAPI_KEY")
 
 
 class ModuleSettings:
+    """Every settings group, read from the environment once.
+
+    Frozen after it's built. Use `get_settings` instead of making new ones, and
+    `replace` to get a copy with different groups.
+    """
+
     def __init__(self):
         # pass
         self.postgres: PostgresSettings = PostgresSettings()
         self.arangoo: ArangoSettings = ArangoSettings()
         self.namespace: NamespaceSettings = NamespaceSettings()
+        self.ingest: IngestSettings = IngestSettings()
+        self.cache: CacheSettings = CacheSettings()
+        self.partitions: PartitionSettings = PartitionSettings()
+        self.engine: EngineSettings = EngineSettings()
+        self.metrics: MetricSettings = MetricSettings()
+        self.plan: PlanSettings = PlanSettings()
+        self._frozen = True
+
+    def __setattr__(self, name, value):
+        if getattr(self, "_frozen", False):
+            raise TypeError("ModuleSettings is frozen. Use `replace` to change it.")
+        super().__setattr__(name, value)
+
+    def replace(self, **groups) -> "ModuleSettings":
+        """A copy with some of the groups swapped out."""
+        clone = object.__new__(ModuleSettings)
+        clone.__dict__.update(self.__dict__, **groups)
+        return clone
 
     @property
     def postgres_connection_str(self) -> PostgresDsn:
@@ -190,3 +350,9 @@ class ModuleSettings:
 
     def __repr__(self):
         return f"{repr(self.postgres)}\n\n{repr(self.arangoo)}"
+
+
+@lru_cache(maxsize=None)
+def get_settings() -> ModuleSettings:
+    """The settings shared by the whole process."""
+    return ModuleSettings()
@@ -1,17 +1,26 @@
+from datetime import datetime
 from functools import cached_property
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Sequence
 
+from loguru import logger
+
+from sqlalchemy import BigInteger
 from sqlalchemy import Boolean
 from sqlalchemy import cast
 from sqlalchemy import Column
+from sqlalchemy import extract
+from sqlalchemy import Float
 from sqlalchemy import func
 from sqlalchemy import Integer
+from sqlalchemy import LargeBinary
 from sqlalchemy import MetaData
 from sqlalchemy import NUMERIC
 from sqlalchemy import select as _select
 from sqlalchemy import String
 from sqlalchemy import Table
+from sqlalchemy.dialects import postgresql
 from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.dialects.postgresql import TEXT
 from sqlalchemy.dialects.postgresql import TIMESTAMP
 from sqlalchemy.dialects.postgresql import UUID
@@ -19,7 +28,16 @@ from sqlalchemy.sql.schema import Index
 from sqlalchemy.sql.selectable import TableClause
 from sqlalchemy.types import TypeEngine
 from sqlalchemy.engine import Engine
-
+from sqlalchemy.exc import ProgrammingError
+
+from bodhi_server.measures.rollups import rollup_table_name
+from bodhi_server.measures.typed import METRIC_LAYOUTS
+from bodhi_server.partitions import BUCKET_PARTITIONED
+from bodhi_server.partitions import BucketPartitions
+from bodhi_server.partitions import ensure_hypertable
+from bodhi_server.partitions import ensure_time_partitions
+from bodhi_server.partitions import PARTITION_MODES
+from bodhi_server.partitions import TIME_PARTITIONED
 from bodhi_server.timescale import create_uuid
 
 
@@ -42,8 +60,14 @@ class BaseWrapper(object):
     def execute(self, *args, **kwargs):
         return self.conn.execute(*args, **kwargs)
 
-    def insert_into(self, is_execute: bool = False, **values):
-        insert_query = self.table.insert().values(**values)
+    def _insert(self, skip_conflicts: bool = False):
+        if skip_conflicts:
+            # ON CONFLICT DO NOTHING. Rows that break a unique index are dropped quietly.
+            return pg_insert(self.table).on_conflict_do_nothing()
+        return self.table.insert()
+
+    def insert_into(self, is_execute: bool = False, skip_conflicts: bool = False, **values):
+        insert_query = self._insert(skip_conflicts).values(**values)
         if is_execute:
             insert_query.execute()
         return insert_query
@@ -52,6 +76,14 @@ class BaseWrapper(object):
         """Insert Many Values. Running execute is inherient"""
         self.execute(self.table.insert(), values)
 
+    def insert_values(self, values: List[Dict[str, Any]], skip_conflicts: bool = False):
+        """Insert all of the values with one multi-row INSERT statement.
+
+        Unlike `insert_many` (executemany) this is a single round trip. Every
+        dict needs the same keys.
+        """
+        return self.execute(self._insert(skip_conflicts).values(values))
+
 
 def create_nested_path(nested_list: list, element: str):
     composite = "$"
@@ -108,20 +140,211 @@ class KernelWrapper(BaseWrapper):
 
 
 class MetaTableAdapter:
-    def __init__(self, metadata: Optional[MetaData] = None):
+    """All of the tables we manage.
+
+    Args:
+        metadata (Optional[MetaData], optional): Bound metadata. Defaults to None.
+        partitioning (str, optional): How `kernel` and `event_log` are laid out.
+            "none", "range" (declarative partitions on `event_at`), "hypertable" (timescale)
+            or "list" (one partition of `kernel` per bucket).
+            Only applies when the tables are first created. Defaults to "none".
+        partition_interval (str, optional): The width of a time partition. Defaults to "month".
+        partitions_ahead (int, optional): Partitions created ahead of the current one. Defaults to 3.
+        metrics_layout (str, optional): "text" keeps every metric value as a string in `metrics`.
+            "typed" writes into `metric_points` (a column per value type) and `metrics`
+            becomes a view over it. Defaults to "text".
+        metric_rollups (Sequence[int], optional): Widths (in seconds) of the rollups kept
+            for `metric_points`. Only with the typed layout. Defaults to none.
+        metrics_view (bool, optional): Keep the `metrics` view over `metric_points` for
+            old readers. Only with the typed layout. Compaction needs it off, the view
+            can't see compacted points. Defaults to True.
+    """
+
+    # Tables partitioned by time when it's turned on.
+    time_tables = ("kernel", "event_log")
+
+    def __init__(
+        self,
+        metadata: Optional[MetaData] = None,
+        partitioning: str = "none",
+        partition_interval: str = "month",
+        partitions_ahead: int = 3,
+        metrics_layout: str = "text",
+        metric_rollups: Sequence[int] = (),
+        metrics_view: bool = True,
+    ):
+        if partitioning not in PARTITION_MODES:
+            raise ValueError(f"Partitioning must be one of {PARTITION_MODES}")
+        if metrics_layout not in METRIC_LAYOUTS:
+            raise ValueError(f"The metrics layout must be one of {METRIC_LAYOUTS}")
+        self.metrics_layout = metrics_layout
+        self.rollup_widths = tuple(sorted(metric_rollups))
+        self.metrics_view = metrics_view
+        self.partitioning = partitioning
+        self.partition_interval = partition_interval
+        self.partitions_ahead = partitions_ahead
+        self.bucket_partitions: Optional[BucketPartitions] = None
+        if self.is_bucket_partitioned:
+            self.bucket_partitions = BucketPartitions("kernel")
         self.metadata = metadata or MetaData()
         self.load_tables()
         self.engine: Engine = self.metadata.bind
 
+    @property
+    def is_time_partitioned(self) -> bool:
+        return self.partitioning in TIME_PARTITIONED
+
+    @property
+    def is_bucket_partitioned(self) -> bool:
+        return self.partitioning in BUCKET_PARTITIONED
+
+    def partition_options(self, name: str) -> Dict[str, Any]:
+        if self.partitioning == "range":
+            return {"postgresql_partition_by": "RANGE (event_at)"}
+        if self.partitioning == "list" and name == "kernel":
+            return {"postgresql_partition_by": "LIST (bucket)"}
+        return {}
+
+    def partition_columns(self, name: str) -> List[str]:
+        """The columns every unique index on the table has to include."""
+        if self.is_time_partitioned:
+            return ["event_at"]
+        if self.is_bucket_partitioned and name == "kernel":
+            return ["bucket"]
+        return []
+
+    def ensure_buckets(self, *buckets: str):
+        """Create the kernel partitions of new buckets. A no-op unless it's list partitioned."""
+        if self.bucket_partitions is not None:
+            self.bucket_partitions.ensure(self.engine, buckets)
+
+    def insert_kernel(self, rows: List[Dict[str, Any]]) -> int:
+        """Write rows into `kernel` in one transaction. Returns how many were written.
+
+        Rows with an idempotency key claim it in `kernel_keys` first. A key
+        that's already there was written before, and its row is skipped.
+        `kernel`'s own unique index has to include the partition columns, so
+        with time partitioning it can't tell a retry (stamped later) apart.
+        """
+        keys = [row["idempotency_key"] for row in rows if row.get("idempotency_key")]
+        with self.engine.begin() as conn:
+            if keys:
+                claimed = set(self._claim_keys(conn, keys))
+                fresh = []
+                for row in rows:
+                    key = row.get("idempotency_key")
+                    if key is None or key in claimed:
+                        # Only the first row with a key gets to use it.
+                        claimed.discard(key)
+                        fresh.append(row)
+                rows = fresh
+            if not rows:
+                return 0
+            statement = pg_insert(self.kernel.table).values(rows)
+            if keys:
+                statement = statement.on_conflict_do_nothing()
+            return conn.execute(statement).rowcount
+
+    def _claim_keys(self, conn, keys: List[str]) -> List[str]:
+        keys_table = self.kernel_keys
+        claim = (
+            pg_insert(keys_table)
+            .values([{"idempotency_key": key} for key in keys])
+            .on_conflict_do_nothing()
+            .returning(keys_table.c.idempotency_key)
+        )
+        return [key for key, in conn.execute(claim)]
+
+    def prepare(self):
+        """Everything that has to happen after `create_all`."""
+        self.upgrade_columns()
+        self.prepare_partitions()
+        self.prepare_metrics_view()
+
+    def upgrade_columns(self):
+        """Add the columns newer versions expect to a kernel `create_all` won't touch again."""
+        key_columns = ", ".join(["idempotency_key", *self.partition_columns("kernel")])
+        with self.engine.begin() as conn:
+            conn.execute("ALTER TABLE kernel ADD COLUMN IF NOT EXISTS idempotency_key TEXT")
+            conn.execute(
+                "CREATE UNIQUE INDEX IF NOT EXISTS ux_idempotency_key "
+                f"ON kernel ({key_columns})"
+            )
+
+    def prepare_metrics_view(self):
+        """Put the `metrics` view over `metric_points`, for anything still reading `metrics`."""
+        if self.metrics_layout != "typed":
+            return
+        if not self.metrics_view:
+            # A view left from an earlier run would quietly miss compacted points.
+            self.drop_metrics_view()
+            return
+        try:
+            self.engine.execute(f"CREATE OR REPLACE VIEW metrics AS {self.metrics_view_sql()}")
+        except ProgrammingError as e:
+            # Most likely an old `metrics` table. We never drop it for you.
+            logger.warning(f"Couldn't create the metrics view: {e}")
+
+    def drop_metrics_view(self):
+        try:
+            self.engine.execute("DROP VIEW IF EXISTS metrics")
+        except ProgrammingError as e:
+            # `metrics` is an old table, not our view. Leave it be.
+            logger.warning(f"Couldn't drop the metrics view: {e}")
+
+    def metrics_view_sql(self) -> str:
+        points = self.metric_points.c
+        value = func.coalesce(
+            cast(points.value_float, TEXT),
+            cast(points.value_int, TEXT),
+            cast(points.value_bool, TEXT),
+            points.value_text,
+        )
+        view = _select(
+            [
+                points.id,
+                points.subject,
+                points.name,
+                value.label("value"),
+                points.val_type,
+                # The text layout kept unix timestamps.
+                extract("epoch", points.clock_at).label("clock_at"),
+                extract("epoch", points.created_at).label("created_at"),
+            ]
+        )
+        return str(view.compile(dialect=postgresql.dialect()))
+
+    def prepare_partitions(self, now: Optional[datetime] = None):
+        """Create upcoming partitions (or hypertables). Run after `create_all`, and then periodically."""
+        if self.partitioning == "range":
+            for name in self.time_tables:
+                ensure_time_partitions(
+                    self.engine,
+                    name,
+                    interval=self.partition_interval,
+                    ahead=self.partitions_ahead,
+                    now=now,
+                )
+        elif self.partitioning == "hypertable":
+            for name in self.time_tables:
+                ensure_hypertable(self.engine, name, "event_at", self.partition_interval)
+
     def load_tables(self):
         """Loads the tables for the first time. For cache purposes."""
         self.kernel
+        self.kernel_keys
         self.clock
         self.event_log
         self.episode
         self.session
         self.mappings
         self.metrics
+        self.metric_stats
+        self.metric_sketches
+        if self.metrics_layout == "typed":
+            self.metric_rollups
+            self.rollup_watermarks
+            self.metric_chunks
 
     @cached_property
     def kernel(self):
@@ -133,16 +356,18 @@ class MetaTableAdapter:
                 "kernel_id",
                 UUID(as_uuid=True),
                 primary_key=True,
-                unique=True,
+                # Unique constraints on a partitioned table need the partition key.
+                unique=self.partitioning == "none",
                 nullable=False,
                 server_default=create_uuid(),
             ),
             Column("data", JSONB, default={}),
             Column("tags", JSONB, default={}),
-            Column("bucket", TEXT, nullable=False),
+            Column("bucket", TEXT, primary_key=self.is_bucket_partitioned, nullable=False),
             Column(
                 "event_at",
                 TIMESTAMP(timezone=True),
+                primary_key=self.is_time_partitioned,
                 nullable=False,
                 server_default=func.current_timestamp(),
             ),
@@ -152,14 +377,38 @@ class MetaTableAdapter:
                 nullable=False,
                 server_default=func.current_timestamp(),
             ),
+            # Set when a record should only ever be written once. See `ingestion.dedup`.
+            Column("idempotency_key", TEXT, nullable=True),
+            **self.partition_options("kernel"),
         )
         """ Creating Indexes Here. """
         Index("ix_json", _kernel.c.data, _kernel.c.tags, postgresql_using="gin")
         Index("ix_time", _kernel.c.created_at, _kernel.c.event_at)
         Index("idx_buck", _kernel.c.bucket)
+        Index(
+            "ux_idempotency_key",
+            _kernel.c.idempotency_key,
+            *[_kernel.c[name] for name in self.partition_columns("kernel")],
+            unique=True,
+        )
 
         return KernelWrapper(_kernel)
 
+    @cached_property
+    def kernel_keys(self) -> Table:
+        """Every idempotency key written to `kernel`. Never partitioned, so a key is unique on its own."""
+        return Table(
+            "kernel_keys",
+            self.metadata,
+            Column("idempotency_key", TEXT, primary_key=True),
+            Column(
+                "created_at",
+                TIMESTAMP(timezone=True),
+                nullable=False,
+                server_default=func.current_timestamp(),
+            ),
+        )
+
     """
         Getting to these after MVP.
     """
@@ -244,7 +493,7 @@ class MetaTableAdapter:
                 "event_id",
                 UUID(as_uuid=True),
                 primary_key=True,
-                unique=True,
+                unique=not self.is_time_partitioned,
                 nullable=False,
                 server_default=create_uuid(),
             ),
@@ -255,6 +504,7 @@ class MetaTableAdapter:
             Column(
                 "event_at",
                 TIMESTAMP(timezone=True),
+                primary_key=self.is_time_partitioned,
                 nullable=False,
                 server_default=func.current_timestamp(),
             ),
@@ -264,6 +514,7 @@ class MetaTableAdapter:
                 nullable=False,
                 server_default=func.current_timestamp(),
             ),
+            **self.partition_options("event_log"),
         )
         """ Creating Indexes Here. """
 
@@ -271,6 +522,9 @@ class MetaTableAdapter:
 
     @cached_property
     def metrics(self):
+        """Where measurements are written. `metric_points` with the typed layout."""
+        if self.metrics_layout == "typed":
+            return KernelWrapper(self.metric_points)
         return KernelWrapper(
             Table(
                 "metrics",
@@ -296,5 +550,143 @@ class MetaTableAdapter:
             )
         )
 
+    @cached_property
+    def metric_points(self) -> Table:
+        points = Table(
+            "metric_points",
+            self.metadata,
+            Column(
+                "id",
+                UUID(as_uuid=True),
+                server_default=create_uuid(),
+                primary_key=True,
+                nullable=False,
+            ),
+            Column("subject", TEXT, nullable=False),
+            Column("name", TEXT, nullable=False),
+            Column("val_type", TEXT, nullable=False),
+            # One of these is set, depending on `val_type`.
+            Column("value_float", Float(precision=53)),
+            Column("value_int", BigInteger),
+            Column("value_bool", Boolean),
+            Column("value_text", TEXT),
+            Column("clock_at", TIMESTAMP(timezone=True), nullable=False),
+            Column(
+                "created_at",
+                TIMESTAMP(timezone=True),
+                nullable=False,
+                server_default=func.current_timestamp(),
+            ),
+        )
+        Index("ix_metric_points", points.c.subject, points.c.name, points.c.clock_at)
+        # The rollup refresh scans by `created_at`, which only ever grows.
+        Index("ix_metric_points_created", points.c.created_at, postgresql_using="brin")
+        # Compaction looks for the oldest points.
+        Index("ix_metric_points_clock", points.c.clock_at, postgresql_using="brin")
+        return points
+
+    @cached_property
+    def metric_rollups(self) -> Dict[int, Table]:
+        """Aggregates of `metric_points`, one table per width (in seconds). See `measures.rollups`."""
+        if self.metrics_layout != "typed":
+            return {}
+        return {seconds: self._rollup(seconds) for seconds in self.rollup_widths}
+
+    def _rollup(self, seconds: int) -> Table:
+        double = Float(precision=53)
+        return Table(
+            rollup_table_name(seconds),
+            self.metadata,
+            Column("subject", TEXT, primary_key=True),
+            Column("name", TEXT, primary_key=True),
+            Column("bucket", TIMESTAMP(timezone=True), primary_key=True),
+            Column("count", BigInteger, nullable=False),
+            Column("sum", double, nullable=False),
+            Column("min", double, nullable=False),
+            Column("max", double, nullable=False),
+            # For the variance
+            Column("sum_sq", double, nullable=False),
+        )
+
+    @cached_property
+    def rollup_watermarks(self) -> Table:
+        # Every point created up to `watermark` is in the rollup.
+        return Table(
+            "metric_rollup_watermarks",
+            self.metadata,
+            Column("rollup", TEXT, primary_key=True),
+            Column("watermark", TIMESTAMP(timezone=True), nullable=False),
+        )
+
+    @cached_property
+    def metric_chunks(self) -> Table:
+        # Old points, compressed per (subject, name, window). See `measures.chunks`.
+        chunks = Table(
+            "metric_chunks",
+            self.metadata,
+            Column(
+                "id",
+                UUID(as_uuid=True),
+                server_default=create_uuid(),
+                primary_key=True,
+                nullable=False,
+            ),
+            Column("subject", TEXT, nullable=False),
+            Column("name", TEXT, nullable=False),
+            Column("val_type", TEXT, nullable=False),
+            Column("window_start", TIMESTAMP(timezone=True), nullable=False),
+            Column("first_at", TIMESTAMP(timezone=True), nullable=False),
+            Column("last_at", TIMESTAMP(timezone=True), nullable=False),
+            Column("count", Integer, nullable=False),
+            Column("data", LargeBinary, nullable=False),
+        )
+        Index(
+            "ix_metric_chunks", chunks.c.subject, chunks.c.name, chunks.c.window_start
+        )
+        return chunks
+
+    @cached_property
+    def metric_stats(self) -> Table:
+        # Snapshots of the running stats in `measures.live`. Either layout.
+        double = Float(precision=53)
+        return Table(
+            "metric_stats",
+            self.metadata,
+            Column("subject", TEXT, primary_key=True),
+            Column("name", TEXT, primary_key=True),
+            Column("count", BigInteger, nullable=False),
+            Column("mean", double, nullable=False),
+            # Sum of squared differences from the mean
+            Column("m2", double, nullable=False),
+            Column("min", double, nullable=False),
+            Column("max", double, nullable=False),
+            Column("updated_at", TIMESTAMP(timezone=True), nullable=False),
+        )
+
+    @cached_property
+    def metric_sketches(self) -> Table:
+        # t-digests per time bucket, see `measures.sketch`. A bucket can have a
+        # few rows (one per flush). They're merged when read.
+        sketches = Table(
+            "metric_sketches",
+            self.metadata,
+            Column(
+                "id",
+                UUID(as_uuid=True),
+                server_default=create_uuid(),
+                primary_key=True,
+                nullable=False,
+            ),
+            Column("subject", TEXT, nullable=False),
+            Column("name", TEXT, nullable=False),
+            Column("bucket", TIMESTAMP(timezone=True), nullable=False),
+            Column("count", BigInteger, nullable=False),
+            Column("digest", LargeBinary, nullable=False),
+        )
+        Index(
+            "ix_metric_sketches", sketches.c.subject, sketches.c.name, sketches.c.bucket
+        )
+        return sketches
+
     def execute(self, statement, *args, **kwargs):
         self.engine.execute(statement, *args, **kwargs)
@@ -1,15 +1,20 @@
-from typing import Union
+from typing import Optional, Union
 
 from inflection import parameterize
 from inflection import underscore
 
 from humanize import precisedelta
+from sqlalchemy import func
+from sqlalchemy import literal_column
 from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.sql.expression import ColumnClause
 from sqlalchemy.sql.expression import ColumnElement
 from sqlalchemy.sql.expression import Selectable
 from sqlalchemy.sql.functions import FunctionElement
 
+# Where timescale starts counting buckets. date_bin needs to be told.
+BUCKET_ORIGIN = "TIMESTAMPTZ '2000-01-03 00:00:00+00'"
+
 # Might come back to this later. Ran into some serious problems whiile trying to index.
 
 
@@ -17,21 +22,32 @@ class create_hypertable(ColumnElement):
     def __init__(
         self,
         table_name: Union[Selectable, str],
-        column_name: Union[ColumnElement, str]
+        column_name: Union[ColumnElement, str],
+        chunk_time_interval: Optional[str] = None,
+        if_not_exists: bool = True,
     ):
         self.table_name: str = table_name.key if isinstance(
             table_name, Selectable
         ) else table_name
-        self.column_name: str = column_name if isinstance(
+        self.column_name: str = column_name.key if isinstance(
             column_name, ColumnElement
         ) else column_name
+        self.chunk_time_interval = chunk_time_interval
+        self.if_not_exists = if_not_exists
 
 
 @compiles(create_hypertable, 'postgresql')
 def visit_hypertable(element: create_hypertable, compiler, **kw):
     tn = element.table_name
     cn = element.column_name
-    return f"create_hypertable({tn}, {cn})"
+    args = [f"'{tn}'", f"'{cn}'"]
+    if element.chunk_time_interval:
+        args.append(
+            f"chunk_time_interval => INTERVAL '{element.chunk_time_interval}'"
+        )
+    if element.if_not_exists:
+        args.append("if_not_exists => TRUE")
+    return f"create_hypertable({', '.join(args)})"
 
 
 class time_bucket(ColumnClause):
@@ -62,6 +78,26 @@ def compile_time_bucket(element: time_bucket, compiler, **kw):
     return f"time_bucket('{human_time}', {name}) AS {final_name}"
 
 
+def interval_literal(seconds: Union[float, int]):
+    return literal_column(f"INTERVAL '{seconds} seconds'")
+
+
+def bucket_expr(
+    seconds: Union[float, int], column: ColumnElement, function: str = "time_bucket"
+) -> ColumnElement:
+    """The start of the `seconds` wide bucket `column` falls in, as an expression.
+
+    Unlike `time_bucket` it has no label, so it can go in a GROUP BY or a join.
+    `date_bin` is plain postgres (14+), for databases without timescale. Both
+    line their buckets up on 2000-01-03.
+    """
+    if function == "date_bin":
+        return func.date_bin(
+            interval_literal(seconds), column, literal_column(BUCKET_ORIGIN)
+        )
+    return func.time_bucket(interval_literal(seconds), column)
+
+
 class create_uuid(FunctionElement):
     name = 'coalesce'
 
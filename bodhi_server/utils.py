@@ -12,30 +12,22 @@ from inflection import underscore, camelize
 
 import addict
 from loguru import logger
-from matplotlib.pyplot import title
 import networkx as nx
 from addict import Addict as DDict
 from auto_all import end_all
 from auto_all import start_all
 from toolz import curry
-from mako.lookup import TemplateLookup
 from pydantic import BaseModel
 from pydantic import root_validator
 from pydantic import validate_arguments
 from sqlalchemy.engine.base import Engine
 from sqlalchemy.sql import ClauseElement
-from retworkx.visualization import graphviz_draw
 from contextlib import contextmanager
 
 _T = TypeVar("_T")
 
 
 FOLDER_PATH = Path(__file__).parent
-MAKO_LOOPUP = TemplateLookup(
-    directories=[(FOLDER_PATH / "templates"), (FOLDER_PATH / "service")],
-    output_encoding="utf-8",
-    encoding_errors="replace",
-)
 
 start_all(globals())
 
@@ -132,8 +124,20 @@ def bfs_preds(G: nx.Graph, source, depth_limit=None):
     return nx.bfs_predecessors(G, source=source, depth_limit=depth_limit)
 
 
+@lru_cache(maxsize=None)
+def mako_lookup():
+    # Mako is only needed for code generation. Don't pay for it on startup.
+    from mako.lookup import TemplateLookup
+
+    return TemplateLookup(
+        directories=[(FOLDER_PATH / "templates"), (FOLDER_PATH / "service")],
+        output_encoding="utf-8",
+        encoding_errors="replace",
+    )
+
+
 def template_by_name(name: str):
-    return MAKO_LOOPUP.get_template(name)
+    return mako_lookup().get_template(name)
 
 
 import orjson
@@ -151,9 +155,12 @@ class hashabledict(dict):
 
 class InsertParameters(BaseModel):
     data: Dict[str, Any]
-    event_at: datetime = datetime.now()
+    # Left out, it's the time the record arrives.
+    event_at: Optional[datetime] = None
     bucket: Optional[str]
     tags: Dict[str, Any] = {}
+    # Retries with the same key (in the same bucket) are only written once.
+    idempotency_key: Optional[str] = None
 
     @root_validator
     def check_bucket(cls, values: dict):
@@ -204,6 +211,8 @@ def graphviz_show(
     image_type=None,
     method=None,
 ):
+    from retworkx.visualization import graphviz_draw
+
     drawing = graphviz_draw(
         graph, node_attr_fn, edge_attr_fn, graph_attr, method=method
     )
@@ -81,5 +81,7 @@ def visit_json_top(
 
 
 class Table(Entity):
+    __slots__ = ()
+
     def __init__(self, table_name: str, **attrs):
         super().__init__("table", name=table_name, **attrs)
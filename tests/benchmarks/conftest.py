@@ -0,0 +1,32 @@
+import os
+import time
+
+import pytest
+
+# Wall-clock assertions depend on the box they run on. They only run when asked:
+# BODHI_BENCHMARKS=1 pytest tests/benchmarks
+RUN_BENCHMARKS = os.getenv("BODHI_BENCHMARKS", "").lower() in ("1", "true", "yes")
+
+
+def pytest_collection_modifyitems(config, items):
+    if RUN_BENCHMARKS:
+        return
+    skip = pytest.mark.skip(reason="timing benchmark, set BODHI_BENCHMARKS=1 to run")
+    for item in items:
+        if "benchmark" in item.keywords:
+            item.add_marker(skip)
+
+
+def _best_of(runs: int, call) -> float:
+    """The fastest of `runs` calls, in milliseconds."""
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        call()
+        timings.append((time.perf_counter() - start) * 1000)
+    return min(timings)
+
+
+@pytest.fixture
+def best_of():
+    return _best_of
@@ -0,0 +1,58 @@
+import os
+import random
+
+import pytest
+
+from bodhi_server.graph_database.utilz import dict_to_schema
+from bodhi_server.graph_database.utilz import json_hash
+from bodhi_server.logic.accumulate import structure_fingerprint
+
+# The fingerprint has to be well ahead of genson, or it's no pre-check.
+MIN_SPEEDUP = float(os.getenv("BODHI_FINGERPRINT_MIN_SPEEDUP", "3"))
+RECORDS = 200
+
+
+def wide_record(rng: random.Random) -> dict:
+    return {
+        **{f"field_{index}": rng.random() for index in range(60)},
+        **{f"label_{index}": "x" * rng.randint(1, 20) for index in range(20)},
+        "address": {
+            "lines": ["1 Main St", "Apt 2"],
+            "geo": {"lat": rng.random(), "lng": rng.random()},
+        },
+        "orders": [
+            {"id": rng.randint(1, 10**6), "total": rng.random(), "items": [1, 2, 3]}
+            for _ in range(rng.randint(5, 20))
+        ],
+    }
+
+
+def records_and_hashers():
+    rng = random.Random(5)
+    records = [wide_record(rng) for _ in range(RECORDS)]
+
+    def fingerprints():
+        return {structure_fingerprint(record) for record in records}
+
+    def schema_hashes():
+        # Unwrapped, every record here is new to the memo anyway.
+        return {
+            json_hash.func(dict_to_schema.func(record, check=True))
+            for record in records
+        }
+
+    return fingerprints, schema_hashes
+
+
+def test_fingerprint_agrees_with_schema_hash():
+    fingerprints, schema_hashes = records_and_hashers()
+    assert len(fingerprints()) == len(schema_hashes())
+
+
+@pytest.mark.benchmark
+def test_fingerprint_beats_schema_hash(best_of):
+    fingerprints, schema_hashes = records_and_hashers()
+    fast = best_of(3, fingerprints)
+    slow = best_of(3, schema_hashes)
+    print(f"fingerprint {fast:.1f}ms, genson and sha256 {slow:.1f}ms")
+    assert slow / fast > MIN_SPEEDUP, f"only {slow / fast:.1f}x faster"
@@ -0,0 +1,35 @@
+import os
+import subprocess
+import sys
+from typing import Set, Tuple
+
+# Cold start budget for `import bodhi_server`, in milliseconds. CI boxes are
+# slow, so the default is generous. Tighten it locally with the env var.
+BUDGET_MS = float(os.getenv("BODHI_IMPORT_BUDGET_MS", "1500"))
+# None of these should load until something actually uses them.
+DEFERRED = ("matplotlib", "faker", "mako", "arango", "asyncpg", "retworkx")
+PROBE = (
+    "import sys, time\n"
+    "start = time.perf_counter()\n"
+    "import bodhi_server\n"
+    "print((time.perf_counter() - start) * 1000)\n"
+    "print(','.join(sys.modules))\n"
+)
+
+
+def cold_import() -> Tuple[float, Set[str]]:
+    output = subprocess.run(
+        [sys.executable, "-c", PROBE], capture_output=True, text=True, check=True
+    ).stdout.splitlines()
+    return float(output[0]), {name.split(".")[0] for name in output[1].split(",")}
+
+
+def test_heavy_imports_are_deferred():
+    _, modules = cold_import()
+    assert modules.isdisjoint(DEFERRED), modules.intersection(DEFERRED)
+
+
+def test_import_time_budget():
+    # Best of three, every run in a fresh interpreter.
+    elapsed = min(cold_import()[0] for _ in range(3))
+    assert elapsed < BUDGET_MS, f"import bodhi_server took {elapsed:.0f}ms"
@@ -0,0 +1,39 @@
+import os
+
+import numpy as np
+import pytest
+
+from bodhi_server.measures import TDigest
+
+# Merging a day of minute sketches has to be quick enough to do per request.
+BUDGET_MS = float(os.getenv("BODHI_SKETCH_MERGE_BUDGET_MS", "250"))
+SKETCHES = 1440
+POINTS = 500
+QUANTILES = [0.5, 0.95, 0.99]
+
+
+def a_day_of_sketches():
+    rng = np.random.default_rng(3)
+    values = rng.gamma(2.0, 30.0, (SKETCHES, POINTS))
+    blobs = [TDigest().update(row).to_bytes() for row in values]
+
+    def merge():
+        digests = [TDigest.from_bytes(blob) for blob in blobs]
+        return TDigest.merge_all(digests).quantiles(QUANTILES)
+
+    return values, merge
+
+
+def test_merged_day_matches_the_raw_points():
+    values, merge = a_day_of_sketches()
+    expected = np.quantile(values.ravel(), QUANTILES)
+    np.testing.assert_allclose(merge(), expected, rtol=0.02)
+
+
+@pytest.mark.benchmark
+def test_merge_a_day_of_sketches(best_of):
+    values, merge = a_day_of_sketches()
+    elapsed = best_of(3, merge)
+    sort = best_of(3, lambda: np.quantile(values.ravel(), QUANTILES))
+    print(f"merge {elapsed:.1f}ms, sorting the raw points {sort:.1f}ms")
+    assert elapsed < BUDGET_MS, f"merging {SKETCHES} sketches took {elapsed:.0f}ms"
@@ -0,0 +1,61 @@
+import os
+import time
+
+import pytest
+from loguru import logger
+
+from bodhi_server import scoped_system
+from bodhi_server import SQLVisitor
+from bodhi_server import System
+from bodhi_server.graph_database.utilz import dict_to_schema
+from bodhi_server.main import RxSystem
+from bodhi_server.main import SystemPool
+from bodhi_server.walkers import schema_walk
+
+# retworkx shouldn't make planning slower than networkx by more than this.
+MAX_SLOWDOWN = float(os.getenv("BODHI_RX_PLAN_MAX_SLOWDOWN", "1.5"))
+FIELDS = 1000
+NESTED = 10
+
+
+def wide_schema() -> dict:
+    values = [1, "x", 1.5, True]
+    record = {f"field_{index}": values[index % 4] for index in range(FIELDS)}
+    for nested in range(NESTED):
+        record[f"nested_{nested}"] = {
+            f"value_{nested}_{index}": "x" for index in range(FIELDS // NESTED)
+        }
+    return dict_to_schema(record)
+
+
+def plan(schema: dict, factory) -> tuple:
+    with scoped_system(SystemPool(factory=factory)) as local:
+        start = time.perf_counter()
+        schema_walk(schema, "wide")
+        walked = time.perf_counter()
+        tables = SQLVisitor(local).visit().tables
+        planned = time.perf_counter()
+    shape = sorted(
+        (table.name, sorted(field.name for field in table.table_fields))
+        for table in tables
+    )
+    return shape, (walked - start) * 1000, (planned - walked) * 1000
+
+
+@pytest.mark.benchmark
+def test_planning_latency_by_backend():
+    schema = wide_schema()
+    # The walk logs every node.
+    logger.disable("bodhi_server")
+    try:
+        nx_shape, nx_walk, nx_plan = plan(schema, System)
+        rx_shape, rx_walk, rx_plan = plan(schema, RxSystem)
+    finally:
+        logger.enable("bodhi_server")
+    print(
+        f"networkx: walk {nx_walk:.0f}ms, plan {nx_plan:.0f}ms. "
+        f"retworkx: walk {rx_walk:.0f}ms, plan {rx_plan:.0f}ms"
+    )
+    assert rx_shape == nx_shape
+    assert sum(len(fields) for _, fields in rx_shape) == 2 * FIELDS
+    assert rx_plan < MAX_SLOWDOWN * nx_plan
@@ -1,4 +1,7 @@
+import pytest
+
 from bodhi_server import ModuleSettings
+from bodhi_server.settings import get_settings
 
 
 def test_password_exist():
@@ -9,3 +12,16 @@ def test_password_exist():
 def test_username_is_starboy():
     local_settings = ModuleSettings()
     assert local_settings.postgres.user == "starboy"
+
+
+def test_settings_are_shared_and_frozen():
+    local_settings = get_settings()
+    assert local_settings is get_settings()
+    with pytest.raises(TypeError):
+        local_settings.ingest = None
+    with pytest.raises(TypeError):
+        local_settings.ingest.buffered = True
+    ingest = local_settings.ingest.copy(update={"buffered": True})
+    replaced = local_settings.replace(ingest=ingest)
+    assert replaced.ingest.buffered
+    assert not local_settings.ingest.buffered
@@ -0,0 +1,37 @@
+from unittest.mock import MagicMock
+from unittest.mock import patch
+
+from bodhi_server.engines import EngineRegistry
+from bodhi_server.settings import EngineSettings
+
+URL = "postgresql://starboy@localhost:5432/test"
+
+
+def test_engine_options():
+    options = EngineSettings(statement_timeout_ms=5000, pool_size=3).engine_options
+    assert options["pool_size"] == 3
+    assert options["pool_pre_ping"]
+    assert options["connect_args"] == {"options": "-c statement_timeout=5000"}
+    assert "connect_args" not in EngineSettings(statement_timeout_ms=0).engine_options
+
+
+@patch("bodhi_server.engines.create_engine")
+def test_one_engine_per_url(create_mock: MagicMock):
+    registry = EngineRegistry()
+    assert registry.engine(URL) is registry.engine(URL)
+    create_mock.assert_called_once()
+    assert create_mock.call_args.kwargs["pool_pre_ping"]
+
+
+@patch("bodhi_server.engines.MetaTableAdapter")
+@patch("bodhi_server.engines.MetaData")
+@patch("bodhi_server.engines.create_engine")
+def test_tables_are_created_once(
+    create_mock: MagicMock, metadata_mock: MagicMock, adapter_mock: MagicMock
+):
+    registry = EngineRegistry()
+    for _ in range(3):
+        adapter = registry.tables(URL)
+    assert adapter is adapter_mock.return_value
+    metadata_mock.return_value.create_all.assert_called_once()
+    adapter_mock.return_value.prepare.assert_called_once()
@@ -0,0 +1,184 @@
+from datetime import datetime
+from datetime import timezone
+from unittest.mock import MagicMock
+
+import pytest
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.schema import CreateIndex
+from sqlalchemy.schema import CreateTable
+
+from bodhi_server.ingestion.bulk import INSERT_FROM_STAGE
+from bodhi_server.materialized import create_select
+from bodhi_server.matches import MatchSQL
+from bodhi_server.partitions import BucketPartitions
+from bodhi_server.partitions import CreateRangePartition
+from bodhi_server.partitions import ensure_hypertable
+from bodhi_server.partitions import range_partitions
+from bodhi_server.tables import MetaTableAdapter
+
+NOW = datetime(2026, 11, 18, 15, 30, tzinfo=timezone.utc)
+
+
+def compile_pg(element) -> str:
+    return str(
+        element.compile(
+            dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}
+        )
+    )
+
+
+def test_monthly_partitions_roll_over_the_year():
+    bounds = range_partitions("kernel", "month", ahead=2, now=NOW)
+    assert [name for name, _, _ in bounds] == [
+        "kernel_p20261101",
+        "kernel_p20261201",
+        "kernel_p20270101",
+    ]
+    assert bounds[-1][2] == datetime(2027, 2, 1, tzinfo=timezone.utc)
+
+
+def test_weekly_partitions_start_on_monday():
+    (name, start, end), = range_partitions("kernel", "week", ahead=0, now=NOW)
+    assert start.weekday() == 0
+    assert (end - start).days == 7
+
+
+def test_partition_ddl():
+    _, start, end = range_partitions("kernel", "day", ahead=0, now=NOW)[0]
+    ddl = compile_pg(CreateRangePartition("kernel", "kernel_p20261118", start, end))
+    assert "PARTITION OF kernel FOR VALUES FROM ('2026-11-18" in ddl
+
+
+def test_range_partitioned_kernel():
+    adapter = MetaTableAdapter(partitioning="range")
+    ddl = str(CreateTable(adapter.kernel.table).compile(dialect=postgresql.dialect()))
+    assert "PARTITION BY RANGE (event_at)" in ddl
+    assert "PRIMARY KEY (kernel_id, event_at)" in ddl
+
+
+def keyed_row(key: str, event_at: datetime) -> dict:
+    return dict(
+        bucket="people", tags={}, data={}, event_at=event_at, idempotency_key=key
+    )
+
+
+def test_retries_are_caught_with_time_partitioning():
+    adapter = MetaTableAdapter(partitioning="range")
+    ddl = str(CreateTable(adapter.kernel_keys).compile(dialect=postgresql.dialect()))
+    assert "PARTITION BY" not in ddl
+    assert "PRIMARY KEY (idempotency_key)" in ddl
+
+    # A retry gets another event_at, so kernel's (key, event_at) index can't catch it.
+    adapter.engine = MagicMock()
+    conn = adapter.engine.begin.return_value.__enter__.return_value
+    conn.execute.return_value = iter([])
+    assert adapter.insert_kernel([keyed_row("k", datetime.now(timezone.utc))]) == 0
+    assert conn.execute.call_count == 1
+    claim = compile_pg(conn.execute.call_args.args[0])
+    assert "INSERT INTO kernel_keys" in claim and "ON CONFLICT DO NOTHING" in claim
+
+    conn.execute.reset_mock()
+    conn.execute.side_effect = [iter([("k",)]), MagicMock(rowcount=2)]
+    rows = [keyed_row("k", NOW), keyed_row("k", NOW), keyed_row(None, NOW)]
+    assert adapter.insert_kernel(rows) == 2
+    inserted = conn.execute.call_args.args[0].compile(dialect=postgresql.dialect())
+    assert "INSERT INTO kernel" in str(inserted)
+    assert sum(key.startswith("idempotency_key") for key in inserted.params) == 2
+
+    assert "INSERT INTO kernel_keys" in INSERT_FROM_STAGE
+    assert "DISTINCT ON (idempotency_key)" in INSERT_FROM_STAGE
+
+
+def test_list_partitioned_kernel():
+    adapter = MetaTableAdapter(partitioning="list")
+    ddl = str(CreateTable(adapter.kernel.table).compile(dialect=postgresql.dialect()))
+    assert "PARTITION BY LIST (bucket)" in ddl
+    assert "PRIMARY KEY (kernel_id, bucket)" in ddl
+    event_ddl = str(
+        CreateTable(adapter.event_log.table).compile(dialect=postgresql.dialect())
+    )
+    assert "PARTITION BY" not in event_ddl
+
+
+def test_bucket_partition_names():
+    partitions = BucketPartitions()
+    name = partitions.partition_name("Some Really/Long Bucket " * 10)
+    assert len(name) <= 63
+    assert name == partitions.partition_name("Some Really/Long Bucket " * 10)
+    assert name != partitions.partition_name("Some Really/Long Bucket " * 11)
+    assert "FOR VALUES IN ('it''s')" in partitions.ddl("it's")
+
+
+def test_bucket_partitions_created_once():
+    partitions = BucketPartitions()
+    engine = MagicMock()
+    partitions.ensure(engine, ["people", "orders", "people"])
+    partitions.ensure(engine, ["people"])
+    assert engine.execute.call_count == 2
+    assert "people" in partitions
+
+
+def hypertable_engine(*answers) -> MagicMock:
+    # Each answer is what one statement in the transaction returns.
+    engine = MagicMock()
+    conn = engine.begin.return_value.__enter__.return_value
+    conn.execute.side_effect = [MagicMock(**answer) for answer in answers]
+    return engine
+
+
+def test_hypertables_are_made_once():
+    engine = hypertable_engine({"scalar.return_value": True})
+    assert not ensure_hypertable(engine, "kernel")
+
+    engine = hypertable_engine(
+        {"scalar.return_value": False}, {"first.return_value": None}, {}
+    )
+    assert ensure_hypertable(engine, "kernel", interval="week")
+    conn = engine.begin.return_value.__enter__.return_value
+    statement = conn.execute.call_args.args[0]
+    sql = str(statement.compile(dialect=postgresql.dialect()))
+    assert "create_hypertable('kernel', 'event_at'" in sql
+    assert "INTERVAL '1 week'" in sql
+    assert "if_not_exists => TRUE" in sql
+
+
+def test_tables_with_rows_need_migrate_data():
+    engine = hypertable_engine(
+        {"scalar.return_value": False}, {"first.return_value": (1,)}
+    )
+    with pytest.raises(RuntimeError, match="migrate_data"):
+        ensure_hypertable(engine, "kernel")
+
+
+def test_unknown_partitioning():
+    with pytest.raises(ValueError):
+        MetaTableAdapter(partitioning="sideways")
+
+
+def test_view_time_bounds():
+    adapter = MetaTableAdapter()
+    table_attrs = {"node_type": "entity", "sub_type": "tables"}
+    field_attrs = {"node_type": "component", "sub_type": "field", "field_type": "integer"}
+    table = MatchSQL({"item_id": "people", "name": "people", "attrs": table_attrs}).node
+    table.add_field(MatchSQL({"item_id": "age", "name": "age", "attrs": field_attrs}).node)
+
+    sql = compile_pg(create_select(table, adapter, start=NOW, end=NOW))
+    assert "kernel.event_at >= CAST('2026-11-18T15:30:00+00:00' AS TIMESTAMP" in sql
+    assert "kernel.event_at < CAST(" in sql
+
+
+def test_idempotency_index_includes_the_partition_key():
+    for partitioning, expected in [
+        ("none", "(idempotency_key)"),
+        ("range", "(idempotency_key, event_at)"),
+        ("list", "(idempotency_key, bucket)"),
+    ]:
+        adapter = MetaTableAdapter(partitioning=partitioning)
+        (index,) = [
+            index
+            for index in adapter.kernel.table.indexes
+            if index.name == "ux_idempotency_key"
+        ]
+        ddl = str(CreateIndex(index).compile(dialect=postgresql.dialect()))
+        assert ddl.startswith("CREATE UNIQUE INDEX")
+        assert ddl.endswith(expected)
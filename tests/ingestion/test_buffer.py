@@ -0,0 +1,93 @@
+import threading
+import time
+from typing import List
+
+import pytest
+
+from bodhi_server.ingestion import IngestBuffer
+
+
+class Sink:
+    def __init__(self):
+        self.batches: List[list] = []
+
+    def __call__(self, rows: list):
+        self.batches.append(list(rows))
+
+
+def test_flush_on_size():
+    sink = Sink()
+    buffer = IngestBuffer(sink, max_size=3, linger=10.0)
+    futures = [buffer.submit({"index": i}) for i in range(3)]
+    for future in futures:
+        assert future.result(timeout=2)
+    assert sink.batches == [[{"index": 0}, {"index": 1}, {"index": 2}]]
+    buffer.close()
+
+
+def test_flush_on_linger():
+    sink = Sink()
+    buffer = IngestBuffer(sink, max_size=100, linger=0.02)
+    start = time.monotonic()
+    buffer.submit({"index": 0}).result(timeout=2)
+    assert time.monotonic() - start >= 0.015
+    assert len(sink.batches) == 1
+    buffer.close()
+
+
+def test_concurrent_submits_share_a_commit():
+    sink = Sink()
+    buffer = IngestBuffer(sink, max_size=1000, linger=0.1)
+    threads = [
+        threading.Thread(target=lambda i=i: buffer.submit({"i": i}).result(timeout=2))
+        for i in range(20)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sum(len(batch) for batch in sink.batches) == 20
+    assert len(sink.batches) < 20
+    buffer.close()
+
+
+def test_close_drains_fire_and_forget():
+    sink = Sink()
+    buffer = IngestBuffer(sink, max_size=100, linger=10.0)
+    for i in range(5):
+        buffer.submit({"index": i})
+    buffer.close(timeout=2)
+    assert sum(len(batch) for batch in sink.batches) == 5
+    with pytest.raises(RuntimeError):
+        buffer.submit({"index": 6})
+
+
+def test_failed_flush_reaches_waiters():
+    def explode(rows: list):
+        raise ValueError("database is down")
+
+    buffer = IngestBuffer(explode, max_size=1)
+    with pytest.raises(ValueError):
+        buffer.submit({"index": 0}).result(timeout=2)
+    buffer.close()
+
+
+def test_leftovers_keep_their_age():
+    class SlowFirst(Sink):
+        def __call__(self, rows: list):
+            if not self.batches:
+                time.sleep(0.3)
+            super().__call__(rows)
+
+    sink = SlowFirst()
+    buffer = IngestBuffer(sink, max_size=2, linger=0.3)
+    start = time.monotonic()
+    buffer.submit({"index": 0})
+    # The first flush is still writing while these pile up past max_size.
+    time.sleep(0.35)
+    futures = [buffer.submit({"index": i}) for i in range(1, 4)]
+    futures[-1].result(timeout=2)
+    # The leftover was due 0.3s after its submit, not 0.3s after the batch before it.
+    assert time.monotonic() - start < 0.8
+    assert [len(batch) for batch in sink.batches] == [1, 2, 1]
+    buffer.close()
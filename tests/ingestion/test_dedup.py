@@ -0,0 +1,69 @@
+import time
+from datetime import datetime
+from datetime import timezone
+from unittest.mock import patch
+
+from bodhi_server.ingestion import client_key
+from bodhi_server.ingestion import content_key
+from bodhi_server import commands
+from bodhi_server.ingestion import Deduplicator
+
+EVENT_AT = datetime(2026, 10, 18, tzinfo=timezone.utc)
+
+
+def test_content_key_ignores_key_order():
+    first = content_key(
+        bucket="people", data={"a": 1, "b": {"c": 2, "d": 3}}, tags={}, event_at=EVENT_AT
+    )
+    second = content_key(
+        bucket="people", data={"b": {"d": 3, "c": 2}, "a": 1}, tags={}, event_at=EVENT_AT
+    )
+    assert first == second
+    assert first != content_key(
+        bucket="orders", data={"a": 1, "b": {"c": 2, "d": 3}}, tags={}, event_at=EVENT_AT
+    )
+
+
+def test_client_keys_are_scoped_to_the_bucket():
+    assert client_key(bucket="people", key="1") != client_key(bucket="orders", key="1")
+
+
+def test_records_without_a_time_hash_the_same():
+    record = dict(bucket="people", data={"a": 1}, tags={})
+    assert content_key(**record) == content_key(**record, event_at=None)
+    assert content_key(**record) != content_key(**record, event_at=EVENT_AT)
+
+
+def test_records_without_a_time_are_stamped_on_arrival():
+    record = {"bucket": "people", "data": {"a": 1}}
+    ingest = commands.settings.ingest.copy(update={"dedup": True})
+    with patch.object(commands, "settings", commands.settings.replace(ingest=ingest)):
+        first = commands.prepare_row(record)
+        time.sleep(0.001)
+        second = commands.prepare_row(record)
+    assert first.event_at < second.event_at
+    assert first.idempotency_key == second.idempotency_key
+
+
+def test_recent_duplicates_are_caught_in_memory():
+    dedup = Deduplicator(recent=2)
+    assert not dedup.is_duplicate("a")
+    assert dedup.is_duplicate("a")
+    assert not dedup.is_duplicate(None)
+
+    dedup.is_duplicate("b")
+    dedup.is_duplicate("c")
+    # "a" fell out of the recent keys. The unique index catches it now.
+    assert not dedup.is_duplicate("a")
+    assert dedup.stats()["duplicates"] == 1
+
+
+def test_failed_writes_are_forgotten():
+    dedup = Deduplicator()
+    dedup.is_duplicate("a")
+    dedup.forget(["a"])
+    assert not dedup.is_duplicate("a")
+    dedup.record_conflicts(1)
+    stats = dedup.stats()
+    assert stats["conflicts"] == 1
+    assert stats["dedup_rate"] == 0.5
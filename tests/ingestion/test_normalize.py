@@ -0,0 +1,91 @@
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+from bodhi_server.graph_database.utilz import dict_to_schema
+from bodhi_server.ingestion import compile_normalizer
+from bodhi_server.ingestion import normalize_data
+from bodhi_server.ingestion import NormalizerRegistry
+from bodhi_server.logic.accumulate import SchemaAccumulator
+from bodhi_server.settings import get_settings
+
+
+def bakery_record() -> dict:
+    return {
+        "id": "0001",
+        "ppu": 0.55,
+        "isGlazed": True,
+        "batters": {"batterList": [{"batterId": "1001", "type": "Regular"}]},
+        "topping": [{"toppingId": "5001", "type": "None"}, {"toppingId": "5002"}],
+        "sizes": [[1, 2], [3]],
+        "labels": ["a", "b"],
+        "notes": None,
+    }
+
+
+def test_compiled_matches_generic():
+    record = bakery_record()
+    normalizer = compile_normalizer(dict_to_schema(record))
+    assert normalizer(record) == normalize_data(record)
+
+
+def test_registry_uses_compiled_path():
+    registry = NormalizerRegistry()
+    first = registry.normalize("bakery", bakery_record())
+    second = registry.normalize("bakery", bakery_record())
+    assert first == second == normalize_data(bakery_record())
+    assert registry.compiles == 1
+    assert registry.hits == 1
+
+
+def test_registry_falls_back_and_widens():
+    registry = NormalizerRegistry()
+    registry.normalize("bakery", bakery_record())
+
+    different = {**bakery_record(), "extraField": {"someKey": 1}, "ppu": "free"}
+    assert registry.normalize("bakery", different) == normalize_data(different)
+    assert registry.fallbacks == 1
+
+    assert registry.normalize("bakery", different) == normalize_data(different)
+    assert registry.normalize("bakery", bakery_record()) == normalize_data(
+        bakery_record()
+    )
+    assert registry.fallbacks == 1
+    assert registry.hits == 2
+
+
+def test_registry_compiles_from_the_bucket_accumulator():
+    accumulator = SchemaAccumulator()
+    registry = NormalizerRegistry(accumulators=lambda bucket: accumulator)
+    registry.normalize("bakery", bakery_record())
+    assert accumulator.records == 1
+    # Widened elsewhere (by the maestro), then picked up by the next compile.
+    different = {**bakery_record(), "extraField": {"someKey": 1}}
+    accumulator.fold(different)
+    registry.invalidate("bakery")
+    registry.normalize("bakery", bakery_record())
+    assert registry.normalize("bakery", different) == normalize_data(different)
+    assert registry.fallbacks == 0
+
+
+def test_registry_shared_by_threads():
+    registry = NormalizerRegistry()
+    records = [{**bakery_record(), f"extra{n % 10}": n} for n in range(200)]
+
+    def normalize(record: dict) -> dict:
+        return registry.normalize("bakery", record)
+
+    with ThreadPoolExecutor(8) as pool:
+        normalized = list(pool.map(normalize, records))
+    assert normalized == [normalize_data(record) for record in records]
+    assert len(registry) == 1
+
+
+def test_registry_folds_long_arrays_sampled():
+    accumulator = SchemaAccumulator()
+    registry = NormalizerRegistry(accumulators=lambda bucket: accumulator)
+    record = {"id": "0001", "readings": list(range(50_000))}
+    with patch.object(accumulator, "fold", wraps=accumulator.fold) as fold:
+        assert registry.normalize("sensors", record) == normalize_data(record)
+    folded = fold.call_args.args[0]
+    assert len(folded["readings"]) <= get_settings().ingest.infer_array_cap
+    assert len(record["readings"]) == 50_000
@@ -0,0 +1,57 @@
+import asyncio
+from typing import List
+from unittest.mock import AsyncMock
+from unittest.mock import patch
+
+import orjson
+
+from bodhi_server import commands
+from bodhi_server.ingestion import iter_ndjson_lines
+
+
+async def as_chunks(body: bytes, size: int):
+    for start in range(0, len(body), size):
+        yield body[start : start + size]
+
+
+def collect(body: bytes, size: int = 7, max_line_bytes: int = 1 << 20) -> List:
+    async def run():
+        return [
+            line
+            async for line in iter_ndjson_lines(as_chunks(body, size), max_line_bytes)
+        ]
+
+    return asyncio.run(run())
+
+
+def test_lines_split_across_chunks():
+    body = b'{"a": 1}\n\n{"b": 2}\r\n{"c": 3}'
+    assert collect(body) == [(1, b'{"a": 1}'), (3, b'{"b": 2}'), (4, b'{"c": 3}')]
+
+
+def test_long_lines_are_dropped():
+    body = b'{"a": 1}\n' + b"x" * 50 + b'\n{"b": 2}\n'
+    assert collect(body, max_line_bytes=20) == [
+        (1, b'{"a": 1}'),
+        (2, None),
+        (3, b'{"b": 2}'),
+    ]
+
+
+@patch("bodhi_server.commands.connection.pool", new_callable=AsyncMock)
+@patch("bodhi_server.commands.copy_kernel_rows", new_callable=AsyncMock)
+def test_stream_writes_bounded_batches(copy_mock: AsyncMock, pool_mock: AsyncMock):
+    copy_mock.side_effect = lambda pool, rows, partitions: len(rows)
+    records = [
+        orjson.dumps({"bucket": "people", "data": {"index": i}}) for i in range(5)
+    ]
+    body = b"\n".join(records[:2] + [b"not json", b'{"tags": {}}'] + records[2:])
+    ingest = commands.settings.ingest.copy(update={"stream_batch_size": 2})
+    with patch.object(commands, "settings", commands.settings.replace(ingest=ingest)):
+        response = asyncio.run(commands.ingest_stream(as_chunks(body, 16)))
+
+    assert response.accepted == 5
+    assert response.rejected == 2
+    assert response.batches == 3
+    assert [error.index for error in response.errors] == [3, 4]
+    assert [len(call.args[1]) for call in copy_mock.await_args_list] == [2, 2, 1]
@@ -0,0 +1,77 @@
+import asyncio
+from unittest.mock import AsyncMock
+from unittest.mock import patch
+
+from bodhi_server import commands
+from bodhi_server.ingestion import KERNEL_COPY_COLUMNS
+from bodhi_server.ingestion import kernel_row
+
+
+def profile(index: int) -> dict:
+    return {
+        "bucket": "person_test",
+        "data": {"firstName": f"Elsbeth {index}", "id": index},
+        "tags": {"client_id": "batch"},
+    }
+
+
+async def copied(pool, rows, partitions=None) -> int:
+    return len(rows)
+
+
+def test_kernel_row_matches_columns():
+    row = kernel_row(**{**profile(0), "event_at": None})
+    assert len(row) == len(KERNEL_COPY_COLUMNS)
+    assert row.bucket == "person_test"
+    assert isinstance(row.tags, str) and isinstance(row.data, str)
+
+
+@patch("bodhi_server.commands.connection.pool", new_callable=AsyncMock)
+@patch("bodhi_server.commands.copy_kernel_rows", new_callable=AsyncMock)
+def test_batch_reports_per_record_status(copy_mock: AsyncMock, pool_mock: AsyncMock):
+    copy_mock.side_effect = copied
+    records = [profile(0), {"tags": {}}, profile(2)]
+    response = asyncio.run(commands.ingest_batch(records))
+
+    copy_mock.assert_awaited_once()
+    rows = copy_mock.await_args.args[1]
+    assert len(rows) == 2
+    assert response.accepted == 2
+    assert response.rejected == 1
+    assert [result.status for result in response.results] == [True, False, True]
+
+
+@patch("bodhi_server.commands.connection.pool", new_callable=AsyncMock)
+@patch("bodhi_server.commands.copy_kernel_rows", new_callable=AsyncMock)
+def test_batch_copy_failure_rejects_valid_records(
+    copy_mock: AsyncMock, pool_mock: AsyncMock
+):
+    copy_mock.side_effect = RuntimeError("connection lost")
+    response = asyncio.run(commands.ingest_batch([profile(0), profile(1)]))
+    assert response.accepted == 0
+    assert response.rejected == 2
+    assert not response.status
+
+
+@patch("bodhi_server.commands.connection.pool", new_callable=AsyncMock)
+@patch("bodhi_server.commands.copy_kernel_rows", new_callable=AsyncMock)
+def test_batch_skips_repeated_idempotency_keys(
+    copy_mock: AsyncMock, pool_mock: AsyncMock
+):
+    copy_mock.side_effect = copied
+    first = {**profile(0), "idempotency_key": "batch-retry-0"}
+    response = asyncio.run(commands.ingest_batch([first, dict(first), profile(1)]))
+
+    rows = copy_mock.await_args.args[1]
+    assert len(rows) == 2
+    assert rows[0].idempotency_key is not None
+    assert rows[1].idempotency_key is None
+    assert response.accepted == 2
+    assert response.duplicates == 1
+    assert all(result.status for result in response.results)
+
+    # The retry of the whole batch only writes the record without a key.
+    response = asyncio.run(commands.ingest_batch([first]))
+    assert response.duplicates == 1
+    assert response.accepted == 0
+    assert response.status
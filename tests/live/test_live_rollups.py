@@ -0,0 +1,45 @@
+import uuid
+from datetime import datetime
+from datetime import timedelta
+from datetime import timezone
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy import MetaData
+
+from bodhi_server.measures.rollups import refresh_rollups
+from bodhi_server.measures.rollups import series_query
+from bodhi_server.models import MeasureSet
+from bodhi_server.settings import get_settings
+from bodhi_server.tables import MetaTableAdapter
+
+
+@pytest.mark.living
+def test_points_written_after_a_refresh_are_queried():
+    engine = create_engine(get_settings().postgres_connection_str)
+    adapter = MetaTableAdapter(
+        MetaData(bind=engine), metrics_layout="typed", metric_rollups=(60,)
+    )
+    adapter.metadata.create_all()
+    subject = uuid.uuid4().hex
+    clock_at = datetime.now(timezone.utc)
+
+    def measure(value: float):
+        measures = MeasureSet(subject=subject, clock_at=clock_at, values={"x": value})
+        adapter.metric_points.insert().execute(measures.get_insertable("typed"))
+
+    measure(1.0)
+    refresh_rollups(adapter, lag=0, function="date_bin")
+    measure(2.0)
+    query = series_query(
+        adapter,
+        subject=subject,
+        names=["x"],
+        start=clock_at - timedelta(minutes=5),
+        end=clock_at + timedelta(minutes=5),
+        resolution=60,
+        function="date_bin",
+    )
+    [row] = engine.execute(query).fetchall()
+    assert row["count"] == 2
+    assert row["sum"] == 3.0
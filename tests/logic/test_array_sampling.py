@@ -0,0 +1,64 @@
+from genson import SchemaBuilder
+
+from bodhi_server.graph_database.utilz import dict_to_schema
+from bodhi_server.graph_database.utilz import sample_arrays
+from bodhi_server.graph_database.utilz import sample_items
+
+
+def full_schema(item: dict) -> dict:
+    builder = SchemaBuilder()
+    builder.add_object(item)
+    return builder.to_schema()
+
+
+def test_sample_keeps_the_head():
+    items = list(range(10_000))
+    sample = sample_items(items, cap=50, head=10)
+    assert len(sample) == 50
+    assert sample[:10] == list(range(10))
+    assert sample == sorted(sample)
+    # Seeded by the length, so the same array samples the same way.
+    assert sample == sample_items(list(range(10_000)), cap=50, head=10)
+
+
+def test_short_arrays_and_no_cap():
+    items = list(range(100))
+    assert sample_items(items, cap=100, head=10) is items
+    assert sample_items(list(range(10_000)), cap=0, head=10) == list(range(10_000))
+
+
+def test_mixed_samples_fall_back_to_everything():
+    mixed = [1] * 5000 + ["one"] * 5000
+    assert sample_items(mixed, cap=50, head=10) is mixed
+    keys = [{"id": 1, "type": "a"}] * 5000 + [{"id": 1}] * 5000
+    assert sample_items(keys, cap=50, head=10) is keys
+
+
+def test_unsampled_items_are_checked():
+    # The indices are the sample of an array that long.
+    chosen = set(sample_items(list(range(10_000)), cap=50, head=10))
+    items = [{"id": 1} if index in chosen else {"id": "1"} for index in range(10_000)]
+    assert sample_items(items, cap=50, head=10) is items
+
+
+def test_nothing_is_copied_without_a_cut():
+    record = {"id": "0001", "tags": list(range(50)), "nested": {"ids": [1, 2, 3]}}
+    assert sample_arrays(record, cap=100, head=10) is record
+    record["long"] = list(range(500))
+    sampled = sample_arrays(record, cap=100, head=10)
+    assert sampled is not record and len(sampled["long"]) == 100
+    assert sampled["nested"] is record["nested"]
+
+
+def test_nested_arrays_are_sampled():
+    record = {
+        "id": "0001",
+        "batters": {"batter": [{"id": str(n), "type": "Regular"} for n in range(5000)]},
+        "topping": [{"id": str(n), "tags": list(range(150))} for n in range(2000)],
+    }
+    sampled = sample_arrays(record, cap=100, head=10)
+    assert len(sampled["batters"]["batter"]) == 100
+    assert len(sampled["topping"]) == 100
+    assert all(len(topping["tags"]) == 100 for topping in sampled["topping"])
+    assert len(record["topping"]) == 2000
+    assert dict_to_schema(record) == full_schema(record)
@@ -0,0 +1,84 @@
+from unittest.mock import MagicMock
+from unittest.mock import patch
+
+from bodhi_server.graph_database import utilz
+from bodhi_server.graph_database.utilz import json_hash
+from bodhi_server.graph_database.utilz import LRUMemo
+from bodhi_server.graph_database.utilz import memo_stats
+from bodhi_server.graph_database.utilz import memoize
+from bodhi_server.graph_database.utilz import schema_hash
+from bodhi_server.graph_database.utilz import structural_key
+from bodhi_server.settings import get_settings
+
+
+def test_key_ignores_dict_order():
+    first = structural_key(({"a": 1, "b": {"c": [1, 2]}},), {})
+    second = structural_key(({"b": {"c": [1, 2]}, "a": 1},), {})
+    assert first == second
+    assert first != structural_key(({"a": 1, "b": {"c": [2, 1]}},), {})
+    assert structural_key((1,), {}) != structural_key((True,), {})
+
+
+def test_hits_and_misses():
+    func = MagicMock(side_effect=lambda item, check=False: len(item))
+    memo = LRUMemo(func, max_entries=10)
+    assert memo({"a": 1}) == 1
+    assert memo({"a": 1}) == 1
+    assert memo({"a": 1}, check=True) == 1
+    assert func.call_count == 2
+    stats = memo.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 2
+    assert stats["entries"] == 2
+
+
+def test_evicts_least_recently_used():
+    func = MagicMock(side_effect=lambda number: number)
+    memo = LRUMemo(func, max_entries=2)
+    memo(1)
+    memo(2)
+    memo(1)
+    memo(3)
+    assert len(memo) == 2
+    assert memo.stats()["evictions"] == 1
+    memo(1)
+    memo(2)
+    # 1 was still cached, 2 had to be computed again
+    assert [call.args[0] for call in func.call_args_list] == [1, 2, 3, 2]
+
+
+def test_bounded_by_bytes():
+    memo = LRUMemo(lambda size: list(range(size)), max_entries=100, max_bytes=1000)
+    for size in range(50, 60):
+        memo(size)
+    assert memo.bytes <= 1000
+    assert memo.stats()["evictions"] > 0
+    memo.clear()
+    assert len(memo) == 0
+    assert memo.bytes == 0
+
+
+def test_decorated_functions():
+    @memoize(max_entries=3)
+    def double(number):
+        return number * 2
+
+    assert double(2) == 4
+    assert double.__name__ == "double"
+    assert double.max_entries == 3
+    assert memo_stats()["double"]["misses"] == 1
+    record = {"name": "Elsbeth", "email": "egrioli0@example.com"}
+    assert schema_hash(record) == schema_hash(dict(reversed(list(record.items()))))
+    assert json_hash({"a": 1, "b": 2}) == json_hash({"b": 2, "a": 1})
+
+
+def test_bounds_are_read_from_the_settings_when_used():
+    memo = LRUMemo(lambda number: number, bounds="plan")
+    settings = get_settings()
+    cache = settings.cache.copy(update={"plan_entries": 2})
+    with patch.object(utilz, "get_settings", return_value=settings.replace(cache=cache)):
+        for number in range(5):
+            memo(number)
+        assert memo.max_entries == 2
+    assert len(memo) == 2
+    assert memo.max_entries == settings.cache.plan_entries
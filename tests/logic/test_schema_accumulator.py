@@ -0,0 +1,113 @@
+import random
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import MagicMock
+from unittest.mock import patch
+
+from genson import SchemaBuilder
+
+from bodhi_server.graph_database.graph import ViewParams
+from bodhi_server.logic.accumulate import SchemaAccumulator
+from bodhi_server.logic.accumulate import structure_fingerprint
+from bodhi_server.logic.interfaces import NamespaceResponse
+from bodhi_server.logic.maestro import NameMaestro
+
+VIEW_SPACE = ViewParams(username="beep", stakeholder="boop", project="blurp")
+
+
+def random_record(rng: random.Random) -> dict:
+    record = {"id": rng.randint(1, 100)}
+    if rng.random() < 0.7:
+        record["name"] = rng.choice(["Elsbeth", None])
+    if rng.random() < 0.5:
+        record["score"] = rng.choice([1, 2.5, True])
+    if rng.random() < 0.5:
+        record["tags"] = [
+            {"key": "k", **({"value": 1} if rng.random() < 0.5 else {})}
+            for _ in range(rng.randint(0, 3))
+        ]
+    return record
+
+
+def test_same_schema_as_genson():
+    rng = random.Random(11)
+    accumulator, builder = SchemaAccumulator(), SchemaBuilder()
+    for _ in range(500):
+        record = random_record(rng)
+        accumulator.fold(record)
+        builder.add_object(record)
+    assert accumulator.schema() == builder.to_schema()
+    assert accumulator.records == 500
+    # Everything that can change did so early on.
+    assert accumulator.changes < 25
+
+
+def test_structural_diff():
+    accumulator = SchemaAccumulator()
+    first = accumulator.fold({"id": 1, "address": {"lines": ["a"]}})
+    assert first.changed
+    assert first.added["address.lines[]"] == ["string"]
+
+    same = accumulator.fold({"id": 2, "address": {"lines": []}})
+    assert not same.changed
+
+    change = accumulator.fold({"id": 2.5, "email": "e@example.com"})
+    assert change.added == {"email": ["string"]}
+    assert change.widened == {"id": ["number"]}
+    assert change.optional == ["address"]
+    fingerprint = accumulator.fingerprint
+    assert not accumulator.diff({"id": 3}).changed
+    assert accumulator.fingerprint == fingerprint
+
+
+@patch("bodhi_server.logic.maestro.NameMaestro._update_schema", return_value=[])
+@patch("bodhi_server.logic.maestro.NameMaestro.get_or_create_namespace_view")
+def test_maestro_acts_on_real_changes(ns_mock: MagicMock, update_mock: MagicMock):
+    ns_mock.return_value = NamespaceResponse()
+    master = NameMaestro(graph_controller=MagicMock())
+
+    def update(record):
+        master.update_schema(view_name="people", record=record, view_space=VIEW_SPACE)
+
+    update({"id": 1, "name": "Elsbeth"})
+    update({"id": 2, "name": "Grioli"})
+    assert ns_mock.call_count == 1
+
+    update({"id": 3, "name": "Grioli", "email": "e@example.com"})
+    assert ns_mock.call_count == 2
+    schema = update_mock.call_args.args[0]
+    assert set(schema["properties"]) == {"id", "name", "email"}
+    assert master.schema_stats() == {"buckets": 1, "records": 3, "changes": 2}
+
+
+def test_structure_fingerprint():
+    fingerprint = structure_fingerprint
+    assert fingerprint({"a": 1, "b": "x"}) == fingerprint({"b": "y", "a": 2})
+    assert fingerprint({"a": [1, 2, 3]}) == fingerprint({"a": [4]})
+    assert fingerprint({"a": 1}) != fingerprint({"a": 1.5})
+    assert fingerprint({"a": []}) != fingerprint({"a": [1]})
+    assert fingerprint({"a.b": 1, "a": {}}) != fingerprint({"a": {"b": 1}})
+    # An item without "v" makes it optional, that's a different schema.
+    complete = {"tags": [{"k": 1, "v": 1}]}
+    partial = {"tags": [{"k": 1, "v": 1}, {"k": 2}]}
+    assert fingerprint(complete) != fingerprint(partial)
+
+
+def test_seen_structures_skip_the_walk():
+    accumulator = SchemaAccumulator()
+    assert accumulator.fold({"id": 1, "tags": [{"k": 1, "v": 1}]}).changed
+    assert not accumulator.fold({"id": 2, "tags": [{"k": 3, "v": 4}]}).changed
+    assert accumulator.prechecked == 1
+    change = accumulator.fold({"id": 3, "tags": [{"k": 1, "v": 1}, {"k": 2}]})
+    assert change.optional == ["tags[].v"]
+
+
+def test_folds_from_many_threads():
+    records = [{"id": n, f"field_{n % 20}": n % 3 == 0 or str(n)} for n in range(400)]
+    accumulator = SchemaAccumulator()
+    with ThreadPoolExecutor(8) as pool:
+        list(pool.map(accumulator.fold, records))
+    builder = SchemaBuilder()
+    for record in records:
+        builder.add_object(record)
+    assert accumulator.schema() == builder.to_schema()
+    assert accumulator.records == 400
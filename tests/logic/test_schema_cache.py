@@ -0,0 +1,83 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import MagicMock
+from unittest.mock import patch
+
+from bodhi_server.graph_database.graph import ViewParams
+from bodhi_server.logic.cache import SchemaHashCache
+from bodhi_server.logic.interfaces import NamespaceResponse
+from bodhi_server.logic.maestro import NameMaestro
+
+
+VIEW_SPACE = ViewParams(username="beep", stakeholder="boop", project="blurp")
+
+
+def create_profile():
+    return {"id": 1, "first_name": "Elsbeth", "email": "egrioli0@example.com"}
+
+
+def test_cache_hits_and_misses():
+    cache = SchemaHashCache(ttl=60)
+    assert not cache.check("people", "abc")
+    cache.remember("people", "abc")
+    assert cache.check("people", "abc")
+    assert not cache.check("people", "xyz")
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 2
+
+
+def test_cache_ttl_and_invalidation():
+    cache = SchemaHashCache(ttl=0.01)
+    cache.remember("people", "abc")
+    time.sleep(0.02)
+    assert not cache.check("people", "abc")
+
+    cache.ttl = 60
+    cache.remember("people", "abc")
+    cache.invalidate("people")
+    assert not cache.check("people", "abc")
+
+
+def test_cache_bounds_hashes_per_bucket():
+    cache = SchemaHashCache(max_hashes=2)
+    for schema_hash in ["a", "b", "c"]:
+        cache.remember("people", schema_hash)
+    assert not cache.check("people", "a")
+    assert cache.check("people", "c")
+
+
+def test_cache_shared_by_threads():
+    cache = SchemaHashCache(ttl=60, max_hashes=4)
+
+    def churn(worker: int):
+        for n in range(500):
+            bucket = f"bucket_{n % 3}"
+            cache.remember(bucket, f"{worker}_{n}")
+            cache.check(bucket, f"{worker}_{n}")
+            if n % 50 == 0:
+                cache.invalidate(bucket)
+
+    with ThreadPoolExecutor(8) as pool:
+        list(pool.map(churn, range(8)))
+    assert cache.hits + cache.misses == 8 * 500
+    assert all(len(hashes) <= 4 for hashes in cache._buckets.values())
+
+
+@patch("bodhi_server.logic.maestro.NameMaestro._update_schema", return_value=[])
+@patch("bodhi_server.logic.maestro.NameMaestro.get_or_create_namespace_view")
+def test_unchanged_schema_skips_graph(ns_mock: MagicMock, update_mock: MagicMock):
+    ns_mock.return_value = NamespaceResponse()
+    master = NameMaestro(graph_controller=MagicMock())
+
+    for _ in range(3):
+        master.update_schema(
+            view_name="people", record=create_profile(), view_space=VIEW_SPACE
+        )
+    ns_mock.assert_called_once()
+    assert master.schema_cache.hits == 2
+
+    master.invalidate_schema("people", VIEW_SPACE)
+    master.update_schema(
+        view_name="people", record=create_profile(), view_space=VIEW_SPACE
+    )
+    assert ns_mock.call_count == 2
@@ -0,0 +1,90 @@
+import asyncio
+from datetime import datetime
+from datetime import timezone
+from unittest.mock import AsyncMock
+from unittest.mock import patch
+
+import pytest
+
+from bodhi_server import commands
+from bodhi_server.measures import columnize
+from bodhi_server.measures import MeasureColumns
+from bodhi_server.measures.bulk import TEXT_COPY_COLUMNS
+from bodhi_server.measures.bulk import TYPED_COPY_COLUMNS
+
+START = datetime(2026, 10, 18, tzinfo=timezone.utc).timestamp()
+
+
+def grid(**overrides) -> MeasureColumns:
+    columns = dict(
+        subject="augmented_dao",
+        names=["pool_balance", "slippage", "open", "state"],
+        clock_at=[START, START + 1, START + 2],
+        values=[
+            [1, 0.04, True, "up"],
+            [2, 0.05, False, "up"],
+            [3, 0.06, True, "down"],
+        ],
+    )
+    columns.update(overrides)
+    return MeasureColumns(**columns)
+
+
+def test_typed_records_use_one_column_per_name():
+    records = list(columnize(grid()).typed_records())
+    assert len(records) == 12
+    rows = [dict(zip(TYPED_COPY_COLUMNS, record)) for record in records[:4]]
+    assert [row["val_type"] for row in rows] == ["int", "float", "bool", "str"]
+    assert rows[0]["value_int"] == 1 and type(rows[0]["value_int"]) is int
+    assert rows[1]["value_float"] == 0.04 and rows[1]["value_int"] is None
+    assert rows[2]["value_bool"] is True
+    assert rows[3]["value_text"] == "up"
+    assert rows[0]["clock_at"] == datetime(2026, 10, 18, tzinfo=timezone.utc)
+    assert records[4][1] == "pool_balance"
+    # Postgres stamps created_at, the rollup watermark goes by it.
+    assert "created_at" not in TYPED_COPY_COLUMNS
+    assert all(len(record) == len(TYPED_COPY_COLUMNS) for record in records)
+
+
+def test_mixed_columns_fall_back_per_value():
+    batch = columnize(grid(names=["a"], clock_at=[START, START], values=[[1.5], [None]]))
+    first, second = [dict(zip(TYPED_COPY_COLUMNS, r)) for r in batch.typed_records()]
+    assert first["value_float"] == 1.5
+    assert second["val_type"] == "NoneType" and second["value_float"] is None
+
+
+def test_text_records():
+    record = dict(zip(TEXT_COPY_COLUMNS, next(iter(columnize(grid()).text_records()))))
+    assert record["value"] == "1"
+    assert record["val_type"] == "int"
+    assert record["clock_at"] == START
+
+
+@pytest.mark.parametrize(
+    "overrides",
+    [
+        {"names": ["a", "a", "b", "c"]},
+        {"clock_at": [START, "soon", START]},
+        {"clock_at": [START, float("nan"), START]},
+        {"values": [[1, 2, 3, 4], [1, 2, 3]]},
+        {"values": [[1, 2, 3, 4]]},
+    ],
+)
+def test_misshapen_columns_are_rejected(overrides):
+    with pytest.raises(ValueError):
+        columnize(grid(**overrides))
+
+
+def test_point_limit():
+    with pytest.raises(ValueError):
+        columnize(grid(), max_points=11)
+
+
+@patch("bodhi_server.commands.connection.pool", new_callable=AsyncMock)
+@patch("bodhi_server.commands.copy_measure_columns", new_callable=AsyncMock)
+def test_measure_bulk_copies_once(copy_mock: AsyncMock, pool_mock: AsyncMock):
+    copy_mock.return_value = 12
+    response = asyncio.run(commands.measure_bulk(grid()))
+    copy_mock.assert_awaited_once()
+    assert response.points == 12
+    assert response.status
@@ -0,0 +1,186 @@
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import datetime
+from datetime import timedelta
+from datetime import timezone
+from unittest.mock import MagicMock
+
+import numpy as np
+import pytest
+from sqlalchemy.dialects import postgresql
+
+from bodhi_server.measures import MeasureQuery
+from bodhi_server.measures import stream_points
+from bodhi_server.measures.chunks import check_compaction
+from bodhi_server.measures.chunks import chunk_rows
+from bodhi_server.measures.chunks import compact_points
+from bodhi_server.measures.chunks import compactable
+from bodhi_server.measures.chunks import decode_points
+from bodhi_server.measures.chunks import to_micros
+from bodhi_server.measures.gorilla import decode_chunk
+from bodhi_server.measures.gorilla import encode_chunk
+from bodhi_server.measures.query import merge_sorted
+from bodhi_server.measures.rollups import frozen_before
+from bodhi_server.measures.rollups import refresh_statement
+from bodhi_server.tables import MetaTableAdapter
+
+START = datetime(2026, 10, 18, tzinfo=timezone.utc)
+SECOND = 1_000_000
+
+
+def series(n: int = 7200):
+    rng = np.random.default_rng(5)
+    times = to_micros(START) + np.arange(n, dtype=np.int64) * SECOND
+    return times, np.cumsum(rng.normal(0, 1, n)).round(2)
+
+
+def same_bits(left: np.ndarray, right: np.ndarray) -> bool:
+    return bool((left.view(np.uint64) == right.view(np.uint64)).all())
+
+
+def test_codec_round_trip():
+    times, values = series()
+    # Jitter and a gap, so every delta-of-delta size gets used.
+    times[100] += 37
+    times[200:] += 3600 * SECOND
+    times[300:] += 1 << 40
+    decoded_times, decoded = decode_chunk(encode_chunk(times, values))
+    assert (decoded_times == times).all()
+    assert same_bits(decoded, values)
+
+
+def test_odd_floats_survive():
+    values = np.array([np.nan, np.inf, -np.inf, -0.0, 0.0, 5e-324, 1.7e308, 1.0])
+    times = np.arange(len(values), dtype=np.int64)
+    _, decoded = decode_chunk(encode_chunk(times, values))
+    assert same_bits(decoded, values)
+    _, single = decode_chunk(encode_chunk(times[:1], values[-1:]))
+    assert single.tolist() == [1.0]
+    with pytest.raises(ValueError):
+        encode_chunk(times[:0], values[:0])
+
+
+def test_regular_series_compress_well():
+    times, values = series()
+    # A point row is over 100 bytes. A steady counter fits in about two.
+    steady = encode_chunk(times, np.arange(len(times), dtype=float))
+    assert len(steady) / len(times) < 2.5
+    # Even a noisy random walk is an order of magnitude smaller than rows.
+    assert len(encode_chunk(times, values)) / len(times) < 10
+
+
+def test_chunk_rows_and_decode():
+    records = [
+        ("sim", "balance", "int", None, 3, None, START + timedelta(seconds=2)),
+        ("sim", "balance", "int", None, 1, None, START),
+        ("sim", "open", "bool", None, None, True, START + timedelta(seconds=1)),
+        ("sim", "rate", "float", 0.5, None, None, START),
+    ]
+    rows = {row["name"]: row for row in chunk_rows(records, START)}
+    assert rows["balance"]["count"] == 2
+    assert rows["balance"]["first_at"] == START
+    assert rows["balance"]["last_at"] == START + timedelta(seconds=2)
+
+    chunks = [(row["name"], row["val_type"], row["data"]) for row in rows.values()]
+    points = list(decode_points(chunks, START, START + timedelta(seconds=2)))
+    assert [(p["name"], p["value"]) for p in points] == [
+        ("balance", 1.0),
+        ("rate", 0.5),
+        ("open", 1.0),
+    ]
+    assert points[0]["clock_at"] == START
+    assert points[2]["val_type"] == "bool"
+
+
+def test_only_lossless_points_are_compacted():
+    adapter = MetaTableAdapter(metrics_layout="typed")
+    condition = str(
+        compactable(adapter.metric_points.c).compile(dialect=postgresql.dialect())
+    )
+    assert "value_text" not in condition
+    assert "value_int BETWEEN" in condition
+
+
+def test_nothing_is_compacted_without_rollups():
+    # No engine is needed, it returns before touching the database.
+    assert compact_points(MetaTableAdapter(metrics_layout="typed"), 3600) == 0
+
+
+def test_no_compaction_while_the_metrics_view_is_kept():
+    kept = MetaTableAdapter(metrics_layout="typed", metric_rollups=(60,))
+    with pytest.raises(RuntimeError, match="BODHI_METRICS_VIEW"):
+        compact_points(kept, 3600)
+    dropped = MetaTableAdapter(
+        metrics_layout="typed", metric_rollups=(60,), metrics_view=False
+    )
+    check_compaction(dropped)
+    dropped.engine = MagicMock()
+    dropped.prepare_metrics_view()
+    dropped.engine.execute.assert_called_once_with("DROP VIEW IF EXISTS metrics")
+
+
+def test_compacted_buckets_are_frozen():
+    now = datetime(2026, 10, 18, 15, 30, tzinfo=timezone.utc)
+    frozen = frozen_before(now, 86400, [60, 3600, 7200, 86400])
+    assert frozen == datetime(2026, 10, 17, tzinfo=timezone.utc)
+    adapter = MetaTableAdapter(metrics_layout="typed", metric_rollups=(60,))
+    statement = refresh_statement(adapter, 60, START, now, frozen=frozen)
+    sql = str(statement.compile(dialect=postgresql.dialect()))
+    assert "metric_points.clock_at >= %(clock_at_1)s" in sql
+
+
+async def items(values):
+    for value in values:
+        yield value
+
+
+async def collect(stream):
+    return [item async for item in stream]
+
+
+def test_merge_sorted():
+    merged = merge_sorted(items([1, 4, 5]), items([2, 3, 6, 7]), key=lambda x: x)
+    assert asyncio.run(collect(merged)) == [1, 2, 3, 4, 5, 6, 7]
+    assert asyncio.run(collect(merge_sorted(items([]), items([]), key=abs))) == []
+
+
+class FakeConnection:
+    def __init__(self, rows, chunks):
+        self.rows = rows
+        self.chunks = chunks
+
+    @asynccontextmanager
+    async def transaction(self, **options):
+        assert options["isolation"] == "repeatable_read"
+        yield
+
+    def cursor(self, sql, *args, prefetch=None):
+        return items(self.chunks if "metric_chunks" in sql else self.rows)
+
+
+class FakePool:
+    def __init__(self, conn):
+        self.conn = conn
+
+    @asynccontextmanager
+    async def acquire(self):
+        yield self.conn
+
+
+def test_stream_points_merges_chunks_and_rows():
+    adapter = MetaTableAdapter(metrics_layout="typed")
+    second = timedelta(seconds=1)
+    points = [
+        ("sim", "a", "float", float(i), None, None, START + i * second) for i in range(3)
+    ]
+    old = chunk_rows(points, START)[0]
+    rows = [
+        {"name": "a", "clock_at": START + 1.5 * second, "value": 9.0},
+        {"name": "a", "clock_at": START + 5 * second, "value": 10.0},
+    ]
+    conn = FakeConnection(rows, [("a", "float", START, old["data"])])
+    query = MeasureQuery(
+        subject="sim", names=["a"], start=START, end=START + 10 * second, limit=4
+    )
+    points = asyncio.run(collect(stream_points(FakePool(conn), adapter, query)))
+    assert [point["value"] for point in points] == [0.0, 1.0, 9.0, 2.0]
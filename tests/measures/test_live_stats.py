@@ -0,0 +1,136 @@
+import asyncio
+import statistics
+from datetime import datetime
+from datetime import timezone
+from unittest.mock import AsyncMock
+from unittest.mock import MagicMock
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+
+from bodhi_server import commands
+from bodhi_server.measures import columnize
+from bodhi_server.measures import LiveStats
+from bodhi_server.measures import MeasureColumns
+from bodhi_server.measures import RunningStats
+from bodhi_server.measures.live import snapshot_live_stats
+from bodhi_server.models import MeasureSet
+from bodhi_server.tables import MetaTableAdapter
+
+START = datetime(2026, 10, 18, tzinfo=timezone.utc)
+
+
+def test_running_stats_match_statistics():
+    values = [3.5, -1.0, 7.25, 0.0, 12.0, 4.0]
+    stats = RunningStats()
+    for value in values:
+        stats.add(value)
+    assert stats.count == 6
+    assert stats.mean == pytest.approx(statistics.mean(values))
+    assert stats.variance == pytest.approx(statistics.variance(values))
+    assert (stats.min, stats.max) == (-1.0, 12.0)
+
+
+def test_merging_batches_is_the_same_as_adding():
+    rng = np.random.default_rng(7)
+    values = rng.normal(50, 10, 1000)
+    merged = RunningStats()
+    for chunk in np.array_split(values, 7):
+        mean = chunk.mean()
+        merged.merge(
+            chunk.size, mean, ((chunk - mean) ** 2).sum(), chunk.min(), chunk.max()
+        )
+    assert merged.count == 1000
+    assert merged.mean == pytest.approx(values.mean())
+    assert merged.variance == pytest.approx(values.var(ddof=1))
+    assert merged.min == values.min()
+
+
+def test_live_stats_skip_non_numbers():
+    live = LiveStats()
+    live.observe(
+        "sim", {"balance": 1, "open": True, "state": "up", "gap": float("nan")}
+    )
+    live.observe("sim", {"balance": 3, "open": False, "state": None})
+    current = live.get("sim")
+    assert set(current) == {"balance", "open"}
+    assert current["balance"]["mean"] == 2.0
+    assert current["open"]["max"] == 1.0
+    assert live.get("sim", ["balance", "missing"]).keys() == {"balance"}
+    assert live.get("other") == {}
+
+
+def test_observe_batch_by_column():
+    batch = columnize(
+        MeasureColumns(
+            subject="sim",
+            names=["balance", "state", "mixed"],
+            clock_at=[START.timestamp(), START.timestamp() + 1, START.timestamp() + 2],
+            values=[[1, "up", 1.5], [2, "up", None], [6, "down", 2]],
+        )
+    )
+    live = LiveStats()
+    live.observe("sim", {"balance": 3})
+    live.observe_batch(batch)
+    current = live.get("sim")
+    assert "state" not in current
+    assert current["balance"]["count"] == 4
+    assert current["balance"]["mean"] == 3.0
+    variance = statistics.variance([3, 1, 2, 6])
+    assert current["balance"]["variance"] == pytest.approx(variance)
+    assert current["mixed"]["count"] == 2
+
+
+def test_snapshots_only_write_changed_series():
+    live = LiveStats()
+    live.observe("sim", {"a": 1, "b": 2})
+    adapter = MetaTableAdapter()
+    adapter.engine = MagicMock()
+    conn = adapter.engine.begin.return_value.__enter__.return_value
+    assert snapshot_live_stats(adapter, live) == 2
+    statement, rows = conn.execute.call_args.args
+    assert {row["name"] for row in rows} == {"a", "b"}
+    assert rows[0]["count"] == 1
+    assert snapshot_live_stats(adapter, live) == 0
+
+    live.observe("sim", {"a": 5})
+    conn.execute.side_effect = RuntimeError("down")
+    with pytest.raises(RuntimeError):
+        snapshot_live_stats(adapter, live)
+    # Retried on the next snapshot
+    assert [row["name"] for row in live.changed_rows()] == ["a"]
+
+
+def test_restore_keeps_newer_series():
+    live = LiveStats()
+    live.observe("sim", {"a": 10})
+    saved = dict(count=4, mean=2.0, m2=8.0, min=0.0, max=4.0, updated_at=START)
+    live.restore(
+        [
+            {"subject": "sim", "name": "a", **saved},
+            {"subject": "sim", "name": "b", **saved},
+        ]
+    )
+    assert live.get("sim")["a"]["count"] == 1
+    assert live.get("sim")["b"]["variance"] == pytest.approx(8.0 / 3)
+
+
+def test_measures_update_the_live_stats():
+    live = LiveStats()
+    measures = MeasureSet(subject="sim", clock_at=START, values={"balance": 4})
+    with patch.object(commands, "LIVE_STATS", live), patch.object(
+        commands, "get_db", return_value=MagicMock(metrics_layout="typed")
+    ) as db:
+        commands.measure_many(measures)
+        db.return_value.metrics.insert_many.assert_called_once()
+        assert commands.live_measures("sim")["balance"]["mean"] == 4.0
+
+    bulk = MeasureColumns(
+        subject="sim", names=["balance"], clock_at=[START.timestamp()], values=[[8]]
+    )
+    with patch.object(commands, "LIVE_STATS", live), patch.object(
+        commands.connection, "pool", AsyncMock()
+    ), patch.object(commands, "copy_measure_columns", AsyncMock(return_value=1)):
+        asyncio.run(commands.measure_bulk(bulk))
+    assert live.get("sim")["balance"]["mean"] == 6.0
@@ -0,0 +1,140 @@
+import asyncio
+from datetime import datetime
+from datetime import timezone
+from unittest.mock import AsyncMock
+from unittest.mock import patch
+
+import orjson
+import pytest
+from fastapi import HTTPException
+from pydantic import ValidationError
+
+from bodhi_server import commands
+from bodhi_server.measures import asyncpg_sql
+from bodhi_server.measures import encode_ndjson
+from bodhi_server.measures import MeasureQuery
+from bodhi_server.measures import query_statement
+from bodhi_server.tables import MetaTableAdapter
+
+START = datetime(2026, 10, 18, tzinfo=timezone.utc)
+END = datetime(2026, 10, 19, tzinfo=timezone.utc)
+
+
+def measure_query(**overrides) -> MeasureQuery:
+    params = dict(subject="augmented_dao", names=["pool_balance"], start=START, end=END)
+    params.update(overrides)
+    return MeasureQuery(**params)
+
+
+async def records(rows):
+    for row in rows:
+        yield row
+
+
+async def collect(lines):
+    return [orjson.loads(line) async for line in lines]
+
+
+def test_query_validation():
+    with pytest.raises(ValidationError):
+        measure_query(end=START)
+    with pytest.raises(ValidationError):
+        measure_query(names=[])
+    naive = measure_query(start=datetime(2026, 10, 18))
+    assert naive.start == START
+    assert measure_query(resolution=3600).buckets() == 24
+    assert measure_query().buckets() == 0
+
+
+def test_asyncpg_sql_numbers_the_binds():
+    adapter = MetaTableAdapter(metrics_layout="typed", metric_rollups=(60, 3600))
+    sql, args = asyncpg_sql(query_statement(adapter, measure_query(resolution=7200)))
+    assert "$1" in sql and ":1" not in sql
+    # Casts are left alone.
+    assert "'-infinity'::timestamptz" in sql
+    assert "FROM metric_rollup_1h" in sql
+    assert args.count("augmented_dao") == 2
+    assert START in args
+
+
+def test_raw_points_in_either_layout():
+    typed = MetaTableAdapter(metrics_layout="typed")
+    sql, args = asyncpg_sql(query_statement(typed, measure_query(limit=10)))
+    assert "FROM metric_points" in sql and "LIMIT" in sql
+    assert START in args
+
+    text = MetaTableAdapter()
+    sql, args = asyncpg_sql(query_statement(text, measure_query()))
+    assert "FROM metrics" in sql
+    assert START.timestamp() in args
+    with pytest.raises(ValueError):
+        query_statement(text, measure_query(resolution=60))
+
+
+def test_encode_rows_and_columns():
+    rows = [{"name": "a", "value": i} for i in range(5)]
+    lines = asyncio.run(collect(encode_ndjson(records(rows))))
+    assert lines == rows
+    chunks = asyncio.run(collect(encode_ndjson(records(rows), "columns", chunk=2)))
+    assert chunks == [
+        {"name": ["a", "a"], "value": [0, 1]},
+        {"name": ["a", "a"], "value": [2, 3]},
+        {"name": ["a"], "value": [4]},
+    ]
+    assert asyncio.run(collect(encode_ndjson(records([]), "columns"))) == []
+
+
+def test_query_measures_streams_through_the_cursor():
+    adapter = MetaTableAdapter()
+    rows = [{"name": "pool_balance", "clock_at": START.timestamp(), "value": "1"}]
+    with patch.object(commands, "get_db", return_value=adapter), patch.object(
+        commands.connection, "pool", AsyncMock()
+    ), patch.object(
+        commands, "stream_records", return_value=records(rows)
+    ) as stream:
+        lines = asyncio.run(collect(commands.query_measures(measure_query())))
+    assert lines == rows
+    sql = stream.call_args.args[1]
+    assert sql.startswith("SELECT metrics.name")
+
+
+def test_typed_raw_points_include_the_chunks():
+    adapter = MetaTableAdapter(metrics_layout="typed")
+    rows = [{"name": "pool_balance", "clock_at": START, "value": 1.0}]
+    with patch.object(commands, "get_db", return_value=adapter), patch.object(
+        commands.connection, "pool", AsyncMock()
+    ), patch.object(
+        commands, "stream_points", return_value=records(rows)
+    ) as stream:
+        lines = asyncio.run(collect(commands.query_measures(measure_query())))
+    assert lines[0]["clock_at"] == START.isoformat()
+    assert stream.call_args.args[1] is adapter
+
+
+def test_query_measures_rejects_before_streaming():
+    adapter = MetaTableAdapter(metrics_layout="typed")
+    with patch.object(commands, "get_db", return_value=adapter):
+        with pytest.raises(HTTPException) as error:
+            commands.query_measures(measure_query(resolution=0.1))
+    assert error.value.status_code == 422
+    with patch.object(commands, "get_db", return_value=MetaTableAdapter()):
+        with pytest.raises(HTTPException):
+            commands.query_measures(measure_query(resolution=60))
+
+
+def test_buckets_over_compacted_points_need_a_rollup():
+    adapter = MetaTableAdapter(metrics_layout="typed", metric_rollups=(60,))
+    with patch.object(commands, "get_db", return_value=adapter), patch.object(
+        commands, "compacted_between", return_value=True
+    ) as compacted:
+        with pytest.raises(HTTPException) as error:
+            commands.query_measures(measure_query(resolution=90))
+        assert error.value.status_code == 422
+        assert "60 seconds" in error.value.detail
+        # The rollup has every point, compacted or not.
+        commands.query_measures(measure_query(resolution=120))
+    assert compacted.call_count == 1
+    with patch.object(commands, "get_db", return_value=adapter), patch.object(
+        commands, "compacted_between", return_value=False
+    ):
+        commands.query_measures(measure_query(resolution=90))
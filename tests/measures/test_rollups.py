@@ -0,0 +1,108 @@
+from datetime import datetime
+from datetime import timezone
+
+import pytest
+from sqlalchemy.dialects import postgresql
+
+from bodhi_server.measures.rollups import align
+from bodhi_server.measures.rollups import parse_widths
+from bodhi_server.measures.rollups import pick_rollup
+from bodhi_server.measures.rollups import refresh_statement
+from bodhi_server.measures.rollups import rollup_table_name
+from bodhi_server.measures.rollups import series_query
+from bodhi_server.tables import MetaTableAdapter
+
+START = datetime(2026, 10, 18, 0, 20, tzinfo=timezone.utc)
+END = datetime(2026, 10, 18, 5, 10, tzinfo=timezone.utc)
+
+
+def sql(statement) -> str:
+    return str(statement.compile(dialect=postgresql.dialect()))
+
+
+@pytest.fixture
+def adapter():
+    return MetaTableAdapter(metrics_layout="typed", metric_rollups=(60, 3600, 86400))
+
+
+def test_widths():
+    assert parse_widths("1d, 1m,1h,60s") == (60, 3600, 86400)
+    assert parse_widths("") == ()
+    assert rollup_table_name(3600) == "metric_rollup_1h"
+    assert rollup_table_name(90) == "metric_rollup_90s"
+    with pytest.raises(ValueError):
+        parse_widths("1w")
+
+
+def test_pick_the_coarsest_rollup_that_divides():
+    widths = (60, 3600, 86400)
+    assert pick_rollup(widths, 7200) == 3600
+    assert pick_rollup(widths, 300) == 60
+    assert pick_rollup(widths, 86400 * 7) == 86400
+    assert pick_rollup(widths, 90) is None
+    assert pick_rollup(widths, 30) is None
+
+
+def test_align_to_buckets():
+    assert align(START, 3600) == datetime(2026, 10, 18, 0, tzinfo=timezone.utc)
+    assert align(START, 3600, up=True) == datetime(2026, 10, 18, 1, tzinfo=timezone.utc)
+    # Already on a boundary
+    assert align(END, 600, up=True) == END
+
+
+def test_only_typed_layout_has_rollups():
+    assert MetaTableAdapter(metric_rollups=(60,)).metric_rollups == {}
+    typed = MetaTableAdapter(metrics_layout="typed", metric_rollups=(60, 3600))
+    assert set(typed.metadata.tables) >= {
+        "metric_rollup_1m",
+        "metric_rollup_1h",
+        "metric_rollup_watermarks",
+    }
+
+
+def test_series_reads_the_rollup_and_newer_points(adapter):
+    query = sql(
+        series_query(
+            adapter,
+            subject="augmented_dao",
+            names=["pool_balance"],
+            start=START,
+            end=END,
+            resolution=7200,
+        )
+    )
+    assert "FROM metric_rollup_1h" in query
+    assert "metric_rollup_watermarks.watermark" in query
+    assert "metric_points.created_at >" in query
+    assert "UNION ALL" in query
+    assert "INTERVAL '7200 seconds'" in query
+
+
+def test_series_without_a_fitting_rollup_reads_points(adapter):
+    query = sql(
+        series_query(
+            adapter,
+            subject="augmented_dao",
+            names=["pool_balance"],
+            start=START,
+            end=END,
+            resolution=90,
+        )
+    )
+    assert "metric_rollup" not in query
+    assert "FROM metric_points" in query
+
+
+def test_refresh_recomputes_changed_buckets(adapter):
+    statement = sql(refresh_statement(adapter, 3600, START, END))
+    assert "INSERT INTO metric_rollup_1h" in statement
+    assert "WITH changed AS" in statement
+    assert "ON CONFLICT (subject, name, bucket) DO UPDATE" in statement
+    assert "time_bucket(INTERVAL '3600 seconds'" in statement
+
+
+def test_date_bin_for_plain_postgres(adapter):
+    statement = sql(refresh_statement(adapter, 60, START, END, function="date_bin"))
+    assert "date_bin(INTERVAL '60 seconds'" in statement
+    assert "2000-01-03" in statement
+    assert "time_bucket" not in statement
@@ -0,0 +1,126 @@
+from datetime import datetime
+from datetime import timezone
+from unittest.mock import MagicMock
+
+import numpy as np
+import pytest
+
+from bodhi_server.measures import columnize
+from bodhi_server.measures import MeasureColumns
+from bodhi_server.measures import range_quantiles
+from bodhi_server.measures import SketchBuffer
+from bodhi_server.measures import TDigest
+from bodhi_server.measures.sketch import flush_sketches
+from bodhi_server.measures.sketch import HEADER
+from bodhi_server.tables import MetaTableAdapter
+
+START = datetime(2026, 10, 18, tzinfo=timezone.utc)
+QS = [0.01, 0.5, 0.95, 0.99]
+
+
+def rank_error(values: np.ndarray, digest: TDigest) -> float:
+    # How far off, in quantiles, the estimates land.
+    ordered = np.sort(values)
+    estimates = digest.quantiles(QS)
+    ranks = np.searchsorted(ordered, estimates) / len(ordered)
+    return float(np.abs(ranks - np.array(QS)).max())
+
+
+def test_digest_quantiles():
+    values = np.random.default_rng(1).lognormal(3, 1, 50_000)
+    digest = TDigest().update(values)
+    assert digest.count == 50_000
+    assert len(digest.means) <= 110
+    assert rank_error(values, digest) < 0.005
+    assert digest.quantile(0) == values.min()
+    assert digest.quantile(1) == values.max()
+    assert TDigest().quantiles([0.5]) == [None]
+
+
+def test_small_digests_are_exact_enough():
+    digest = TDigest().update([1, 2, 3, 4, float("nan")])
+    assert digest.count == 4
+    assert digest.quantile(0.5) == pytest.approx(2.5)
+
+
+def test_merge_matches_one_big_digest():
+    rng = np.random.default_rng(2)
+    parts = [rng.normal(loc, 5, 2_000) for loc in range(0, 100, 10)]
+    merged = TDigest.merge_all([TDigest().update(part) for part in parts])
+    values = np.concatenate(parts)
+    assert merged.count == values.size
+    assert merged.min == values.min() and merged.max == values.max()
+    assert rank_error(values, merged) < 0.01
+    assert TDigest.merge_all([]).count == 0
+
+
+def test_binary_round_trip():
+    digest = TDigest(50).update(np.arange(10_000))
+    blob = digest.to_bytes()
+    assert len(blob) == HEADER.size + 16 * len(digest.means)
+    loaded = TDigest.from_bytes(blob)
+    assert loaded.compression == 50
+    assert loaded.quantiles(QS) == digest.quantiles(QS)
+    with pytest.raises(ValueError):
+        TDigest.from_bytes(blob[:-8])
+
+
+def test_buffer_splits_values_into_buckets():
+    buffer = SketchBuffer(seconds=60)
+    buffer.add("sim", {"balance": 1, "state": "up"}, START)
+    batch = columnize(
+        MeasureColumns(
+            subject="sim",
+            names=["balance", "state"],
+            clock_at=[START.timestamp() + offset for offset in (10, 70, 80)],
+            values=[[2, "up"], [3, "down"], [4, "up"]],
+        )
+    )
+    buffer.add_batch(batch)
+    rows = {(row["name"], row["bucket"]): row for row in buffer.drain()}
+    assert set(rows) == {
+        ("balance", START),
+        ("balance", datetime(2026, 10, 18, 0, 1, tzinfo=timezone.utc)),
+    }
+    first = TDigest.from_bytes(rows[("balance", START)]["digest"])
+    assert first.count == 2 and (first.min, first.max) == (1, 2)
+    assert rows[("balance", START)]["count"] == 2
+    assert len(buffer) == 0 and buffer.drain() == []
+
+
+def test_failed_flushes_keep_their_digests():
+    buffer = SketchBuffer(seconds=60)
+    buffer.add("sim", {"balance": 1}, START)
+    broken = MagicMock()
+    broken.engine.begin.side_effect = ConnectionError("down")
+    with pytest.raises(ConnectionError):
+        flush_sketches(broken, buffer)
+    assert len(buffer) == 1
+
+    buffer.add("sim", {"balance": 2}, START)
+    adapter = MagicMock()
+    assert flush_sketches(adapter, buffer) == 2
+    conn = adapter.engine.begin.return_value.__enter__.return_value
+    rows = conn.execute.call_args.args[1]
+    assert sorted(row["count"] for row in rows) == [1, 1]
+    assert len(buffer) == 0
+
+
+def test_range_quantiles_merge_the_stored_sketches():
+    values = np.arange(1, 1001, dtype=float)
+    blobs = [TDigest().update(part).to_bytes() for part in np.split(values, 4)]
+    adapter = MetaTableAdapter()
+    adapter.engine = MagicMock()
+    conn = adapter.engine.connect.return_value.__enter__.return_value
+    conn.execute.return_value = [("latency", blob) for blob in blobs]
+    answer = range_quantiles(
+        adapter,
+        subject="sim",
+        names=["latency"],
+        start=START,
+        end=START.replace(hour=1),
+        quantiles=[0.5, 0.99],
+    )
+    assert answer["latency"]["count"] == 1000
+    assert answer["latency"]["quantiles"]["0.5"] == pytest.approx(500.5, rel=0.01)
+    assert answer["latency"]["quantiles"]["0.99"] == pytest.approx(990, rel=0.01)
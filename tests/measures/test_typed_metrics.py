@@ -0,0 +1,45 @@
+from datetime import datetime
+from datetime import timezone
+
+from bodhi_server.measures import typed_value
+from bodhi_server.models import MeasureSet
+from bodhi_server.tables import MetaTableAdapter
+
+
+def test_values_go_into_their_own_column():
+    assert typed_value(True)["value_bool"] is True
+    assert typed_value(True)["value_int"] is None
+    assert typed_value(3)["value_int"] == 3
+    assert typed_value(0.25)["value_float"] == 0.25
+    assert typed_value("up")["value_text"] == "up"
+    assert typed_value(1 << 70)["value_text"] == str(1 << 70)
+    assert typed_value([1, 2])["value_text"] == "[1,2]"
+    empty = typed_value(None)
+    assert empty["val_type"] == "NoneType"
+    assert not any(value is not None for key, value in empty.items() if key != "val_type")
+
+
+def test_measure_set_typed_rows():
+    clock_at = datetime(2026, 10, 18, tzinfo=timezone.utc)
+    measures = MeasureSet(
+        subject="augmented_dao",
+        clock_at=clock_at.timestamp(),
+        values={"pool_balance": 1, "slippage": 0.044, "open": False},
+    )
+    rows = {row["name"]: row for row in measures.get_insertable("typed")}
+    assert rows["pool_balance"]["value_int"] == 1
+    assert rows["slippage"]["value_float"] == 0.044
+    assert rows["open"]["value_bool"] is False
+    assert rows["slippage"]["clock_at"] == clock_at
+    assert "created_at" not in rows["slippage"]
+    # The text layout is untouched.
+    assert measures.get_insertable()[0]["value"] == "1"
+
+
+def test_typed_layout_keeps_metrics_as_a_view():
+    adapter = MetaTableAdapter(metrics_layout="typed")
+    assert "metrics" not in adapter.metadata.tables
+    assert adapter.metrics.table is adapter.metric_points
+    view = adapter.metrics_view_sql()
+    assert "AS value" in view
+    assert "EXTRACT(epoch FROM metric_points.clock_at) AS clock_at" in view
@@ -1,5 +1,6 @@
 import re
 from typing import List
+from unittest.mock import patch
 
 from loguru import logger
 
@@ -48,3 +49,41 @@ def test_add_component_to_entity(dynamic_system: System):
     assert dynamic_system.node_count == 2
     assert dynamic_system.edge_count == 1
     assert dynamic_system.root_id
+
+
+def test_node_identity_is_cached():
+    table = Entity("table", name="test_table_name")
+    node_id = table.node_id
+    with patch("bodhi_server.main.hashlib.md5") as md5:
+        assert table.node_id == node_id
+        assert table.graph_repr_dict["attrs"]["sub_type"] == "tables"
+        md5.assert_not_called()
+
+
+def test_node_identity_follows_props():
+    table = Entity("table", name="test_table_name")
+    node_id = table.node_id
+    table.add_props(owner="bodhi")
+    assert table.node_id != node_id
+    assert table.graph_repr_dict["attrs"]["owner"] == "bodhi"
+    assert table.graph_repr.attrs.owner == "bodhi"
+    # Same props, same id
+    same = Entity("table", name="test_table_name", owner="bodhi")
+    assert same.node_id == table.node_id
+    # The graph gets a copy, not the cached attributes.
+    table.graph_repr_dict["attrs"]["owner"] = "someone else"
+    assert table.graph_repr_dict["attrs"]["owner"] == "bodhi"
+
+
+def test_nodes_share_their_attributes(dynamic_system: System):
+    table = Entity("table", name="test_table_name")
+    table.add_current(dynamic_system)
+    first = table.add(Component("field", "first"))
+    second = table.add(Component("field", "second"))
+    assert not hasattr(first, "__dict__")
+    assert first.node_id != second.node_id
+    assert first.props is second.props
+    stored = dynamic_system.get_node(first)["attrs"]
+    assert stored is dynamic_system.get_node(second)["attrs"]
+    first.add_props(owner="bodhi")
+    assert "owner" not in second.props
@@ -0,0 +1,125 @@
+from unittest.mock import patch
+
+import pytest
+
+from bodhi_server import Component
+from bodhi_server import Entity
+from bodhi_server import scoped_system
+from bodhi_server import SQLVisitor
+from bodhi_server import System
+from bodhi_server.graph_database.utilz import dict_to_schema
+from bodhi_server.main import new_system
+from bodhi_server.main import RxSystem
+from bodhi_server.main import SystemPool
+from bodhi_server.settings import get_settings
+from bodhi_server.settings import PlanSettings
+from bodhi_server.walkers import schema_walk
+
+
+def build(local: System):
+    """root -> a -> (x, y), root -> b -> (y, z). y has two parents."""
+    root = Entity("table", name="root")
+    root.add_current(local)
+    nodes = {"root": root}
+    for table, fields in (("a", ("x", "y")), ("b", ("y", "z"))):
+        nodes[table] = root.add(Entity("table", name=table), edge_type="related_to")
+        for field in fields:
+            nodes[field] = nodes[table].add(
+                Component("field", field), edge_type="field_of"
+            )
+    return nodes
+
+
+@pytest.fixture
+def systems():
+    graphs = System(), RxSystem()
+    return graphs, [build(local) for local in graphs]
+
+
+def test_same_graph(systems):
+    (nx_system, rx_system), (nodes, _) = systems
+    assert rx_system.node_count == nx_system.node_count == 6
+    assert rx_system.edge_count == nx_system.edge_count == 6
+    assert rx_system.root_id == nx_system.root_id == nodes["root"].node_id
+    assert rx_system.get_node(nodes["x"]) == dict(nx_system.get_node(nodes["x"]))
+    assert rx_system.to_dict() == nx_system.to_dict()
+
+
+@pytest.mark.parametrize("protocol", ["breadth", "depth"])
+@pytest.mark.parametrize("depth_limit", [1, 2, None])
+def test_same_successors(systems, protocol, depth_limit):
+    (nx_system, rx_system), (nodes, _) = systems
+    root = nodes["root"].node_id
+    expected = nx_system.successors(root, depth_limit=depth_limit, protocol=protocol)
+    found = rx_system.successors(root, depth_limit=depth_limit, protocol=protocol)
+    assert found == expected
+    assert list(found) == list(expected)
+
+
+def test_same_neighbours(systems):
+    (nx_system, rx_system), (nodes, _) = systems
+    y, a = nodes["y"].node_id, nodes["a"].node_id
+    assert rx_system.predecessors(y) == nx_system.predecessors(y)
+    assert rx_system.direct_successors(a) == nx_system.direct_successors(a)
+    ids = [a, y, nodes["x"].node_id]
+    expected, found = nx_system.subgraph(ids), rx_system.subgraph(ids)
+    assert list(found.nodes(data=True)) == list(expected.nodes(data=True))
+    assert list(found.edges(data=True)) == list(expected.edges(data=True))
+
+
+def test_topological_sort(systems):
+    (_, rx_system), _ = systems
+    assert rx_system.is_dag()
+    order = rx_system.topological_sort()
+    assert len(order) == 6
+    for parent in order:
+        for child in rx_system.direct_successors(parent):
+            assert order.index(parent) < order.index(child)
+
+
+def planned_tables(schema: dict, factory) -> list:
+    with scoped_system(SystemPool(factory=factory)) as local:
+        schema_walk(schema, "profile")
+        tables = SQLVisitor(local).visit().tables
+    return sorted(
+        (table.name, sorted(field.name for field in table.table_fields))
+        for table in tables
+    )
+
+
+def test_same_sql_plan():
+    record = {"name": "x", "age": 1, "score": 1.5, "active": True}
+    record["address"] = {"city": "x", "zip": 1}
+    record["contact"] = {"email": "x", "phone": {"number": "x", "verified": False}}
+    schema = dict_to_schema(record)
+    expected = planned_tables(schema, System)
+    assert planned_tables(schema, RxSystem) == expected
+    fields = ["active", "address", "age", "contact", "name", "score"]
+    assert expected == [("profiles", fields)]
+
+
+def test_clear_and_pool():
+    pool = SystemPool(factory=RxSystem)
+    local = pool.acquire()
+    build(local)
+    pool.release(local)
+    assert pool.acquire() is local
+    assert local.node_count == 0
+    with pytest.raises(ValueError):
+        local.root_id
+
+
+def with_backend(backend: str):
+    # construct() skips the environment, the test picks the backend.
+    plan = PlanSettings.construct(graph_backend=backend)
+    settings = get_settings().replace(plan=plan)
+    return patch("bodhi_server.main.get_settings", return_value=settings)
+
+
+def test_backend_from_settings():
+    for backend, kind in (("retworkx", RxSystem), ("networkx", System)):
+        with with_backend(backend):
+            assert type(new_system()) is kind
+    with with_backend("igraph"):
+        with pytest.raises(ValueError):
+            new_system()
@@ -0,0 +1,53 @@
+from unittest.mock import MagicMock
+from unittest.mock import patch
+
+from bodhi_server import scoped_system
+from bodhi_server import system
+from bodhi_server.convert import json_to_sql
+from bodhi_server.convert import plan_schema
+from bodhi_server.main import SystemPool
+from bodhi_server.relational import Table
+
+
+def test_scoped_system_is_isolated():
+    default = system()
+    with scoped_system(SystemPool()) as local:
+        assert system() is local
+        assert system() is not default
+        Table("inside").add_current(system())
+        assert local.node_count == 1
+    assert system() is default
+    assert local.node_count == 0
+
+
+def test_pool_reuses_systems():
+    pool = SystemPool(size=1)
+    with scoped_system(pool) as first:
+        with scoped_system(pool) as second:
+            assert first is not second
+            assert system() is second
+        assert system() is first
+    with scoped_system(pool) as third:
+        assert third in (first, second)
+    assert pool.stats() == {"created": 2, "reused": 1, "idle": 1}
+
+
+def test_planned_views_are_cached():
+    nodes = []
+
+    def plan(local, start=None, end=None):
+        nodes.append(local.node_count)
+        return ["view"]
+
+    default_nodes = system().node_count
+    plan_schema.clear()
+    record = {"name": "Elsbeth", "address": {"city": "LA"}}
+    with patch("bodhi_server.convert.plan_sql", MagicMock(side_effect=plan)) as planner:
+        assert json_to_sql(record, "people") == ["view"]
+        assert json_to_sql(dict(reversed(list(record.items()))), "people") == ["view"]
+        assert planner.call_count == 1
+        json_to_sql(record, "others")
+        assert planner.call_count == 2
+    # Each plan only saw its own tables, and none of them leaked into the default.
+    assert nodes[0] == nodes[1] > 0
+    assert system().node_count == default_nodes